@@ -1,8 +1,21 @@
 
-from database import get_db_connection, init_app, execute_query, get_db_cursor, IntegrityError
+from database import (get_db_connection, init_app, execute_query, get_db_cursor, IntegrityError,
+                      registrar_alteracao, ler_versoes_tabelas, get_worker_connection)
+from response_cache import ResponseCache
+from import_jobs import ImportJobManager
+from export_cache import ExportCache
+from assinaturas import salvar_assinatura, buscar_assinatura, url_assinatura, hash_valido
+from backup import (gerar_dump, comprimir_gzip, Restauracao, ErroRestauracao, abrir_arquivo_sql,
+                    dump_paralelo, restaurar_paralelo, empacotar_tar, extrair_tar,
+                    gerar_incremental, ultimo_backup, limpar_historico_backup)
+from exportacao import (consultar_em_lotes, gerar_csv, gerar_csv_gzip, gerar_xlsx, gerar_parquet,
+                        MIMETYPES, FORMATOS_STREAMING)
+from importacao import (importar_bloco, IndiceChaves, ler_em_blocos,
+                        coluna_texto, coluna_booleana, coluna_data, VALORES_VERDADEIROS)
 from dotenv import load_dotenv
 # import mysql.connector # Removed direct dependency
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, send_from_directory
+from flask import (Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, send_from_directory,
+                   Response, stream_with_context)
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_wtf.csrf import CSRFProtect
 from flask_limiter import Limiter
@@ -13,11 +26,17 @@ from datetime import datetime, timedelta, date
 import os
 import time
 import shutil
+import tempfile
 import pandas as pd
 from werkzeug.utils import secure_filename
 import io
 import json
 import re
+import base64
+import threading
+import itertools
+import functools
+from collections import OrderedDict
 
 import logging
 from logging.handlers import RotatingFileHandler
@@ -94,14 +113,27 @@ limiter = Limiter(
     storage_uri="memory://"
 )
 
+# Cache curto das rotas de resumo (dashboard/admin), ver response_cache.py
+response_cache = ResponseCache(app)
+
+# Arquivos de /api/export guardados por versão das tabelas, ver export_cache.py
+export_cache = ExportCache(app)
+
 from werkzeug.exceptions import HTTPException
 
 # Desabilitar cache e injetar headers de segurança
 @app.after_request
 def add_security_headers(response):
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0, max-age=0'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '-1'
+    if request.path.startswith('/api/export/') and response.headers.get('ETag'):
+        # Exportações com ETag: o navegador guarda e revalida (304 se nada mudou)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    elif request.path.startswith('/api/assinaturas/') and response.status_code in (200, 304):
+        # O conteúdo de um hash nunca muda
+        response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0, max-age=0'
+        response.headers['Pragma'] = 'no-cache'
+        response.headers['Expires'] = '-1'
     # Security Headers
     response.headers['X-Content-Type-Options'] = 'nosniff'
     response.headers['X-Frame-Options'] = 'SAMEORIGIN'
@@ -163,7 +195,12 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_MB', 16)) * 1024 * 1024  # 16MB por padrão
+
+# Importações em segundo plano (?async=1), ver import_jobs.py
+# Fora de uma requisição a invalidação não espera o commit do job; por isso o
+# cache é invalidado de novo quando o job termina
+import_jobs = ImportJobManager(app, ao_finalizar=lambda: response_cache.invalidate('dashboard', 'admin'))
 
 def allowed_file(filename):
     return '.' in filename and \
@@ -186,6 +223,8 @@ def upsert_device_from_equipment(conn, equipment_data):
     """
     Garante que cada registro do equipment_control esteja sincronizado com a tabela devices.
     Sincroniza quando status='Emprestado' e para_emprestimo=true.
+    Roda dentro da transação da rota (sem commit), sob SAVEPOINT: se falhar,
+    a gravação do equipment é mantida e o erro fica no log.
     """
     if not equipment_data:
         return
@@ -212,6 +251,7 @@ def upsert_device_from_equipment(conn, equipment_data):
     # Se não está para empréstimo, ATUALIZA na tabela devices se existir (não deleta)
     cursor = get_db_cursor(conn)
     try:
+        cursor.execute("SAVEPOINT sync_device")
         cursor.execute("SELECT id FROM devices WHERE numero_serie = %s", (numero_serie,))
         existing = cursor.fetchone()
         
@@ -252,10 +292,67 @@ def upsert_device_from_equipment(conn, equipment_data):
                             observacao))
         # Se não existe e para_emprestimo é false, não faz nada (não cria device desnecessário)
         
-        conn.commit()
+        registrar_alteracao(conn, 'devices')
+        cursor.execute("RELEASE SAVEPOINT sync_device")
     except Exception as e:
         print(f"Erro ao sincronizar device {numero_serie}: {e}")
-        conn.rollback()
+        try:
+            cursor.execute("ROLLBACK TO SAVEPOINT sync_device")
+        except Exception:
+            pass
+    finally:
+        cursor.close()
+
+def sincronizar_devices_em_lote(conn, numeros_serie, tamanho_lote=500):
+    """Versão em conjunto do upsert_device_from_equipment, para importações.
+
+    Um INSERT ... SELECT por lote de números de série leva os registros do
+    equipment_control para devices: atualiza os que já existem e cria os que
+    estão para empréstimo, com as mesmas regras de nome/observação da versão
+    por linha. Roda dentro da transação da rota (sem commit), sob SAVEPOINT:
+    se falhar, a importação é mantida e o erro fica no log.
+    """
+    numeros_serie = [n for n in numeros_serie if n]
+    if not numeros_serie:
+        return
+
+    selecao = '''SELECT COALESCE(NULLIF(e.tipo_device, ''), 'Outro'),
+                      e.modelo, e.cor,
+                      COALESCE(NULLIF(e.local, ''), NULLIF(e.responsavel, ''),
+                               CONCAT(COALESCE(NULLIF(e.tipo_device, ''), 'Outro'), ' - ', e.numero_serie)),
+                      e.numero_serie,
+                      COALESCE(NULLIF(e.status, ''), 'Disponível'),
+                      e.para_emprestimo,
+                      CONCAT_WS(' | ', NULLIF(e.observacao, ''),
+                                CASE WHEN NULLIF(e.responsavel, '') IS NOT NULL THEN CONCAT('Responsável: ', e.responsavel) END,
+                                CASE WHEN NULLIF(e.local, '') IS NOT NULL THEN CONCAT('Local: ', e.local) END,
+                                CASE WHEN NULLIF(e.convenio, '') IS NOT NULL THEN CONCAT('Convênio: ', e.convenio) END)
+               FROM equipment_control e
+               WHERE e.numero_serie IN ({placeholders})
+                 AND (e.para_emprestimo OR EXISTS (SELECT 1 FROM devices d WHERE d.numero_serie = e.numero_serie))'''
+    if os.getenv('DB_TYPE') == 'postgres':
+        conflito = '''ON CONFLICT (numero_serie) DO UPDATE SET
+                      tipo = EXCLUDED.tipo, modelo = EXCLUDED.modelo, cor = EXCLUDED.cor, nome = EXCLUDED.nome,
+                      status = EXCLUDED.status, para_emprestimo = EXCLUDED.para_emprestimo,
+                      observacao = EXCLUDED.observacao'''
+    else:
+        conflito = '''ON DUPLICATE KEY UPDATE
+                      tipo = VALUES(tipo), modelo = VALUES(modelo), cor = VALUES(cor), nome = VALUES(nome),
+                      status = VALUES(status), para_emprestimo = VALUES(para_emprestimo),
+                      observacao = VALUES(observacao)'''
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SAVEPOINT sync_devices")
+        for inicio in range(0, len(numeros_serie), tamanho_lote):
+            lote = numeros_serie[inicio:inicio + tamanho_lote]
+            cursor.execute(f'''INSERT INTO devices (tipo, modelo, cor, nome, numero_serie, status, para_emprestimo, observacao)
+                               {selecao.format(placeholders=', '.join(['%s'] * len(lote)))}
+                               {conflito}''', lote)
+        cursor.execute("RELEASE SAVEPOINT sync_devices")
+    except Exception as e:
+        app.logger.warning(f"Erro ao sincronizar devices da importação: {e}")
+        cursor.execute("ROLLBACK TO SAVEPOINT sync_devices")
     finally:
         cursor.close()
 
@@ -272,23 +369,85 @@ class User(UserMixin):
         self.foto_path = foto_path
         self.assinatura_path = assinatura_path
 
+class UserCache:
+    """Cache em memória (TTL + LRU) dos dados usados para montar o User.
+
+    É por processo: com vários workers, uma alteração feita em outro worker
+    só aparece aqui depois do TTL. Rotas que alteram usuários chamam
+    invalidate() para que o próprio worker veja a mudança na hora.
+    """
+
+    def __init__(self, max_size=256, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        key = str(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, dados = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return dados
+
+    def set(self, user_id, dados):
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        key = str(user_id)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, dados)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(user_id), None)
+
+user_cache = UserCache(
+    max_size=int(os.getenv('USER_CACHE_SIZE', 256)),
+    ttl=int(os.getenv('USER_CACHE_TTL', 60))
+)
+
+def _user_from_row(dados):
+    return User(dados['id'], dados['username'], dados['role'], dados.get('email'), dados.get('foto_path'), dados.get('assinatura_path'))
+
 @login_manager.user_loader
 def load_user(user_id):
+    # Guardamos só os campos (e não o objeto) para cada requisição ter seu próprio User
+    dados = user_cache.get(user_id)
+    if dados:
+        return _user_from_row(dados)
+
+    # Usa a conexão da requisição: a rota que vier depois reaproveita a mesma sessão
     conn = get_db_connection()
     if not conn:
         return None
     
     try:
         cursor = get_db_cursor(conn)
-        cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
+        cursor.execute("SELECT id, username, role, email, foto_path, assinatura_path FROM users WHERE id = %s", (user_id,))
         user = cursor.fetchone()
         cursor.close()
         
         if user:
-            return User(user['id'], user['username'], user['role'], user.get('email'), user.get('foto_path'), user.get('assinatura_path'))
+            dados = dict(user)
+            user_cache.set(user_id, dados)
+            return _user_from_row(dados)
         return None
     except Exception as e:
         print(f"Erro ao carregar usuário: {e}")
+        # Não deixar a transação abortada (Postgres) contaminar a rota
+        conn.rollback()
         return None
     finally:
         if conn:
@@ -430,8 +589,393 @@ def api_logout():
 
 
 
+# =============================================================================
+# ESTATÍSTICAS DO DASHBOARD (contadores materializados em dashboard_counters)
+# =============================================================================
+#
+# Os contadores que só mudam quando alguém grava (totais por status/tipo) ficam
+# na tabela dashboard_counters, no formato "grupo.nome" -> valor. Cada rota que
+# altera uma das tabelas abaixo soma em dashboard_counters só a diferença que
+# ela causou (valor = valor + delta), na mesma transação, com DeltaContadores:
+# as linhas que a rota vai mexer são lidas antes e depois da escrita, e o que
+# cada linha vale vem das funções contribuicao_* (espelho dos CASE abaixo).
+# Nenhuma escrita reconta a tabela inteira; a recontagem completa fica só no
+# reconcile e no fim de um restore (recalcular_contadores_dashboard).
+# O que depende da data de hoje (atrasos, vencimentos, foundation do
+# trimestre/ano) continua sendo calculado na hora, numa única consulta indexada.
+#
+# Para reconstruir tudo e ver divergências: python reconcile_dashboard_counters.py
+
+CONTADORES_DASHBOARD_SQL = {
+    'alunos': '''
+        SELECT
+            COUNT(*) as total,
+            COALESCE(SUM(CASE WHEN tipo_aluno = 'Regular' THEN 1 ELSE 0 END), 0) as regular,
+            COALESCE(SUM(CASE WHEN tipo_aluno = 'Foundation' THEN 1 ELSE 0 END), 0) as foundation
+        FROM alunos
+    ''',
+    # Lido da view frota_emprestavel: equipments que ainda não viraram device
+    # também contam, por isso as rotas de equipment_control atualizam este grupo
+    'devices': '''
+        SELECT
+            COALESCE(SUM(CASE WHEN origem = 'devices' AND para_emprestimo = TRUE THEN 1 ELSE 0 END), 0) as para_emprestimo,
+            COALESCE(SUM(CASE WHEN origem = 'devices' AND status = 'Emprestado' THEN 1 ELSE 0 END), 0) as emprestados,
+            COALESCE(SUM(CASE WHEN origem = 'devices' AND status = 'Disponível' AND para_emprestimo = TRUE THEN 1 ELSE 0 END), 0) as disponiveis,
+            COALESCE(SUM(CASE WHEN origem = 'devices' AND status = 'Manutenção' THEN 1 ELSE 0 END), 0) as manutencao,
+            COALESCE(SUM(CASE WHEN origem = 'devices' AND tipo IN ('Macbook', 'Mac Mini') AND para_emprestimo = TRUE THEN 1 ELSE 0 END), 0) as regular,
+            COALESCE(SUM(CASE WHEN origem = 'devices' AND tipo IN ('iPad', 'iPhone') AND para_emprestimo = TRUE THEN 1 ELSE 0 END), 0) as foundation,
+            COALESCE(SUM(CASE WHEN origem = 'equipment_control' AND status = 'Emprestado' AND para_emprestimo = TRUE THEN 1 ELSE 0 END), 0) as equipment_emprestado,
+            COALESCE(SUM(CASE WHEN origem = 'equipment_control' AND status = 'Manutenção' THEN 1 ELSE 0 END), 0) as equipment_manutencao
+        FROM frota_emprestavel
+    ''',
+    'emprestimos': '''
+        SELECT
+            COALESCE(SUM(CASE WHEN status = 'Finalizado' THEN 1 ELSE 0 END), 0) as concluidos
+        FROM emprestimos
+    ''',
+    # livros e exemplares são só COUNT(*), então vão junto como subconsultas
+    'livros': '''
+        SELECT
+            COALESCE(SUM(CASE WHEN status = 'Finalizado' THEN 1 ELSE 0 END), 0) as concluidos,
+            COALESCE(SUM(CASE WHEN status IN ('Ativo', 'Atrasado') THEN 1 ELSE 0 END), 0) as emprestados,
+            (SELECT COUNT(*) FROM livros) as total_livros,
+            (SELECT COUNT(*) FROM exemplares) as total_exemplares
+        FROM emprestimos_livros
+    '''
+}
+
+def _linha_como_dict(cursor, row):
+    """Normaliza a linha para dict, tanto para cursores dict quanto tupla."""
+    if row is None:
+        return {}
+    if isinstance(row, dict):
+        return row
+    return {col[0]: valor for col, valor in zip(cursor.description, row)}
+
+def calcular_contadores_dashboard(cursor, grupos=None):
+    """Recalcula os contadores a partir das tabelas (uma consulta por grupo).
+
+    Retorna {"grupo.nome": int}. Os valores são convertidos para int porque
+    o MySQL devolve SUM como Decimal.
+    """
+    contadores = {}
+    for grupo in grupos or CONTADORES_DASHBOARD_SQL:
+        cursor.execute(CONTADORES_DASHBOARD_SQL[grupo])
+        row = _linha_como_dict(cursor, cursor.fetchone())
+        for chave, valor in row.items():
+            contadores[f"{grupo}.{chave}"] = int(valor or 0)
+    return contadores
+
+def gravar_contadores_dashboard(cursor, contadores):
+    """Grava valores absolutos (recontagem completa ou primeira escrita de um grupo)."""
+    if os.getenv('DB_TYPE') == 'postgres':
+        sql = '''INSERT INTO dashboard_counters (nome, valor, atualizado_em) VALUES (%s, %s, CURRENT_TIMESTAMP)
+                 ON CONFLICT (nome) DO UPDATE SET valor = EXCLUDED.valor, atualizado_em = EXCLUDED.atualizado_em'''
+    else:
+        sql = '''INSERT INTO dashboard_counters (nome, valor, atualizado_em) VALUES (%s, %s, CURRENT_TIMESTAMP)
+                 ON DUPLICATE KEY UPDATE valor = VALUES(valor), atualizado_em = VALUES(atualizado_em)'''
+    cursor.executemany(sql, list(contadores.items()))
+
+def somar_contadores_dashboard(cursor, deltas):
+    """Soma os deltas ({"grupo.nome": int}) aos contadores gravados.
+
+    Um grupo que ainda não tem linha em dashboard_counters é gravado uma vez
+    com o valor absoluto (recontagem só desse grupo); daí em diante só recebe
+    deltas.
+    """
+    deltas = {nome: delta for nome, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    cursor.execute(f"SELECT nome FROM dashboard_counters WHERE nome IN ({', '.join(['%s'] * len(deltas))})",
+                   tuple(deltas))
+    gravados = {_linha_como_dict(cursor, row)['nome'] for row in cursor.fetchall()}
+    faltando = sorted({nome.split('.', 1)[0] for nome in deltas if nome not in gravados})
+    if faltando:
+        gravar_contadores_dashboard(cursor, calcular_contadores_dashboard(cursor, faltando))
+    # Sempre na mesma ordem, para duas rotas não se travarem em ordem inversa
+    linhas = [(deltas[nome], nome) for nome in sorted(deltas) if nome.split('.', 1)[0] not in faltando]
+    if linhas:
+        cursor.executemany('''UPDATE dashboard_counters SET valor = valor + %s, atualizado_em = CURRENT_TIMESTAMP
+                              WHERE nome = %s''', linhas)
+
+def atualizar_contadores_dashboard(conn, deltas):
+    """Soma os deltas da rota aos contadores, dentro da transação atual.
+
+    Deve ser chamada antes do conn.commit() da rota (normalmente por
+    DeltaContadores.aplicar). Roda sob um SAVEPOINT: se falhar, a gravação da
+    rota não é perdida e o contador fica para o reconcile_dashboard_counters.py
+    corrigir. Também invalida o cache de respostas do dashboard quando a
+    requisição terminar.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SAVEPOINT contadores_dashboard")
+        somar_contadores_dashboard(cursor, deltas)
+        cursor.execute("RELEASE SAVEPOINT contadores_dashboard")
+    except Exception as e:
+        app.logger.warning(f"Falha ao atualizar contadores do dashboard {deltas}: {e}")
+        try:
+            cursor.execute("ROLLBACK TO SAVEPOINT contadores_dashboard")
+        except Exception:
+            pass
+    finally:
+        cursor.close()
+    response_cache.invalidate_after_request('dashboard')
+
+def recalcular_contadores_dashboard(conn):
+    """Recontagem completa (sem commit), para depois de um restore."""
+    cursor = conn.cursor()
+    try:
+        gravar_contadores_dashboard(cursor, calcular_contadores_dashboard(cursor))
+    finally:
+        cursor.close()
+    response_cache.invalidate_after_request('dashboard')
+
+# Quanto uma linha de cada tabela vale nos contadores (mesmas regras dos CASE
+# de CONTADORES_DASHBOARD_SQL)
+
+def contribuicao_aluno(linha):
+    tipo = linha.get('tipo_aluno')
+    return {'alunos.total': 1,
+            'alunos.regular': int(tipo == 'Regular'),
+            'alunos.foundation': int(tipo == 'Foundation')}
+
+def contribuicao_device(linha):
+    status, tipo = linha.get('status'), linha.get('tipo')
+    para_emprestimo = bool(linha.get('para_emprestimo'))
+    return {'devices.para_emprestimo': int(para_emprestimo),
+            'devices.emprestados': int(status == 'Emprestado'),
+            'devices.disponiveis': int(status == 'Disponível' and para_emprestimo),
+            'devices.manutencao': int(status == 'Manutenção'),
+            'devices.regular': int(tipo in ('Macbook', 'Mac Mini') and para_emprestimo),
+            'devices.foundation': int(tipo in ('iPad', 'iPhone') and para_emprestimo)}
+
+def contribuicao_equipment(linha):
+    """Só vale enquanto não existe device com o mesmo numero_serie (ver frota_emprestavel)."""
+    status = linha.get('status')
+    return {'devices.equipment_emprestado': int(status == 'Emprestado' and bool(linha.get('para_emprestimo'))),
+            'devices.equipment_manutencao': int(status == 'Manutenção')}
+
+def contribuicao_emprestimo(linha):
+    return {'emprestimos.concluidos': int(linha.get('status') == 'Finalizado')}
+
+def contribuicao_emprestimo_livro(linha):
+    status = linha.get('status')
+    return {'livros.concluidos': int(status == 'Finalizado'),
+            'livros.emprestados': int(status in ('Ativo', 'Atrasado'))}
+
+# tabela -> (colunas lidas, contribuição de uma linha); devices e
+# equipment_control são lidos juntos, por numero_serie (observar_frota)
+FONTES_CONTADORES = {
+    'alunos': ('tipo_aluno', contribuicao_aluno),
+    'emprestimos': ('status', contribuicao_emprestimo),
+    'emprestimos_livros': ('status', contribuicao_emprestimo_livro),
+    'livros': ('id', lambda linha: {'livros.total_livros': 1}),
+    'exemplares': ('id', lambda linha: {'livros.total_exemplares': 1}),
+}
+TAMANHO_LOTE_CONTADORES = 500
+
+def _somar_contribuicao(total, contribuicao, sinal=1):
+    for nome, valor in contribuicao.items():
+        total[nome] = total.get(nome, 0) + sinal * valor
+
+def _em_lotes(valores):
+    valores = list(valores)
+    for inicio in range(0, len(valores), TAMANHO_LOTE_CONTADORES):
+        yield valores[inicio:inicio + TAMANHO_LOTE_CONTADORES]
+
+def _ler_contribuicao(cursor, tabela, where, params):
+    colunas, contribuicao = FONTES_CONTADORES[tabela]
+    cursor.execute(f"SELECT {colunas} FROM {tabela} WHERE {where} FOR UPDATE", tuple(params))
+    total = {}
+    for row in cursor.fetchall():
+        _somar_contribuicao(total, contribuicao(_linha_como_dict(cursor, row)))
+    return total
+
+def _ler_contribuicao_frota(cursor, numeros_serie, device_ids, ja_lidos=()):
+    """Contribuição da frota (devices + equipments sem device) para os números de série / ids.
+
+    Números de série em ja_lidos ficam de fora. Retorna (contribuição,
+    números de série lidos, ids lidos de devices sem numero_serie).
+    """
+    devices = {}
+    for coluna, valores in (('numero_serie', numeros_serie), ('id', device_ids)):
+        for lote in _em_lotes(valores):
+            cursor.execute(f'''SELECT id, numero_serie, tipo, status, para_emprestimo FROM devices
+                               WHERE {coluna} IN ({', '.join(['%s'] * len(lote))}) FOR UPDATE''', tuple(lote))
+            for row in cursor.fetchall():
+                row = _linha_como_dict(cursor, row)
+                devices[row['id']] = row
+
+    series = (set(numeros_serie) | {d['numero_serie'] for d in devices.values() if d['numero_serie']}) - set(ja_lidos)
+    sem_serie = {d['id'] for d in devices.values() if not d['numero_serie']}
+    total = {}
+    for device in devices.values():
+        if device['numero_serie'] in series or device['id'] in sem_serie:
+            _somar_contribuicao(total, contribuicao_device(device))
+    com_device = {d['numero_serie'] for d in devices.values()}
+    for lote in _em_lotes(series):
+        cursor.execute(f'''SELECT numero_serie, status, para_emprestimo FROM equipment_control
+                           WHERE numero_serie IN ({', '.join(['%s'] * len(lote))}) FOR UPDATE''', tuple(lote))
+        for row in cursor.fetchall():
+            row = _linha_como_dict(cursor, row)
+            if row['numero_serie'] not in com_device:
+                _somar_contribuicao(total, contribuicao_equipment(row))
+    return total, series, sem_serie
+
+class DeltaContadores:
+    """Diferença que a escrita de uma rota causa nos contadores do dashboard.
+
+    Antes de escrever, a rota chama observar()/observar_frota() para as linhas
+    que vai mexer; aplicar(), antes do commit, relê as mesmas linhas e soma a
+    diferença em dashboard_counters. Inserções de valor conhecido entram direto
+    com somar(). As leituras usam FOR UPDATE: veem o último commit (também no
+    MySQL em REPEATABLE READ) e seguram as linhas até o commit, então duas
+    rotas mexendo na mesma linha não contam a mesma mudança duas vezes.
+    Se uma leitura falhar, nada é aplicado e o reconcile corrige.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.delta = {}
+        self.falhou = False
+        self._observadas = []
+        self._series = set()
+        self._device_ids = set()
+
+    def somar(self, contribuicao, sinal=1):
+        _somar_contribuicao(self.delta, contribuicao, sinal)
+
+    def observar(self, tabela, where, params=()):
+        """Linhas de <tabela> que atendem a where; chamar antes de mexer nelas."""
+        self._observadas.append((tabela, where, tuple(params)))
+        self.somar(self._ler(_ler_contribuicao, tabela, where, params) or {}, -1)
+
+    def observar_frota(self, numeros_serie=(), device_ids=()):
+        """devices/equipment_control por numero_serie (ou id do device); cada número conta uma vez."""
+        numeros_serie = {n for n in numeros_serie if n} - self._series
+        device_ids = {i for i in device_ids if i} - self._device_ids
+        if not numeros_serie and not device_ids:
+            return
+        self._device_ids |= device_ids
+        resultado = self._ler(_ler_contribuicao_frota, numeros_serie, device_ids, self._series)
+        if resultado:
+            contribuicao, series, _ = resultado
+            self._series |= series
+            self.somar(contribuicao, -1)
+
+    def aplicar(self):
+        """Soma o delta em dashboard_counters (sem commit)."""
+        for tabela, where, params in self._observadas:
+            self.somar(self._ler(_ler_contribuicao, tabela, where, params) or {})
+        if self._series or self._device_ids:
+            resultado = self._ler(_ler_contribuicao_frota, self._series, self._device_ids)
+            if resultado:
+                self.somar(resultado[0])
+        if self.falhou:
+            response_cache.invalidate_after_request('dashboard')
+            return
+        atualizar_contadores_dashboard(self.conn, self.delta)
+
+    def _ler(self, leitura, *args):
+        if self.falhou:
+            return None
+        cursor = get_db_cursor(self.conn)
+        try:
+            cursor.execute("SAVEPOINT contadores_dashboard")
+            resultado = leitura(cursor, *args)
+            cursor.execute("RELEASE SAVEPOINT contadores_dashboard")
+            return resultado
+        except Exception as e:
+            app.logger.warning(f"Falha ao ler linhas para os contadores do dashboard: {e}")
+            self.falhou = True
+            try:
+                cursor.execute("ROLLBACK TO SAVEPOINT contadores_dashboard")
+            except Exception:
+                pass
+            return None
+        finally:
+            cursor.close()
+
+def ler_contadores_dashboard(cursor):
+    """Lê os contadores materializados; grupos ainda não gravados são calculados na hora."""
+    cursor.execute("SELECT nome, valor FROM dashboard_counters")
+    contadores = {}
+    for row in cursor.fetchall():
+        row = _linha_como_dict(cursor, row)
+        contadores[row['nome']] = int(row['valor'])
+
+    faltando = [g for g in CONTADORES_DASHBOARD_SQL if not any(k.startswith(f"{g}.") for k in contadores)]
+    if faltando:
+        contadores.update(calcular_contadores_dashboard(cursor, faltando))
+    return contadores
+
+def _contadores_por_data(cursor, hoje):
+    """Contadores que dependem de hoje; não dá para materializar, mas filtram por índice."""
+    tres_dias = hoje + timedelta(days=3)
+    cursor.execute('''
+        SELECT
+            (SELECT COUNT(*) FROM alunos WHERE tipo_aluno = 'Foundation' AND data_inicio >= %s) as foundation_trimestre,
+            (SELECT COUNT(*) FROM alunos WHERE tipo_aluno = 'Foundation' AND data_inicio >= %s AND data_inicio < %s) as foundation_ano,
+            (SELECT COUNT(*) FROM emprestimos WHERE status = 'Ativo' AND data_devolucao < %s) as devices_atrasados,
+            (SELECT COUNT(*) FROM emprestimos WHERE status = 'Ativo' AND data_devolucao = %s) as devices_vencendo_hoje,
+            (SELECT COUNT(*) FROM emprestimos WHERE status = 'Ativo' AND data_devolucao > %s AND data_devolucao <= %s) as devices_vencendo_breve,
+            (SELECT COUNT(*) FROM emprestimos_livros WHERE status IN ('Ativo', 'Atrasado') AND data_previsao_devolucao < %s) as livros_atrasados,
+            (SELECT COUNT(*) FROM emprestimos_livros WHERE status = 'Ativo' AND data_previsao_devolucao = %s) as livros_vencendo_hoje,
+            (SELECT COUNT(*) FROM emprestimos_livros WHERE status = 'Ativo' AND data_previsao_devolucao > %s AND data_previsao_devolucao <= %s) as livros_vencendo_breve
+    ''', (hoje - timedelta(days=90), date(hoje.year, 1, 1), date(hoje.year + 1, 1, 1),
+          hoje, hoje, hoje, tres_dias,
+          hoje, hoje, hoje, tres_dias))
+    row = _linha_como_dict(cursor, cursor.fetchone())
+    return {chave: int(valor or 0) for chave, valor in row.items()}
+
+def coletar_contadores_dashboard(cursor, hoje=None, materializados=True):
+    """Monta os contadores do dashboard no formato usado por /api/dashboard.
+
+    Com materializados=True (padrão) lê dashboard_counters, que custa O(1);
+    com False recalcula tudo a partir das tabelas (usado no benchmark).
+    """
+    hoje = hoje or datetime.now().date()
+    if materializados:
+        c = ler_contadores_dashboard(cursor)
+    else:
+        c = calcular_contadores_dashboard(cursor)
+    d = _contadores_por_data(cursor, hoje)
+
+    return {
+        'alunos': {
+            'total': c['alunos.total'],
+            'regular': c['alunos.regular'],
+            'foundation': c['alunos.foundation'],
+            'foundation_trimestre': d['foundation_trimestre'],
+            'foundation_ano': d['foundation_ano']
+        },
+        'devices': {
+            'total_emprestimo': c['devices.para_emprestimo'] + c['devices.equipment_emprestado'],
+            'emprestados': c['devices.emprestados'] + c['devices.equipment_emprestado'],
+            'disponiveis': c['devices.disponiveis'],
+            'manutencao': c['devices.manutencao'] + c['devices.equipment_manutencao'],
+            'regular': c['devices.regular'],
+            'foundation': c['devices.foundation']
+        },
+        'biblioteca': {
+            'total_livros': c['livros.total_livros'],
+            'total_exemplares': c['livros.total_exemplares'],
+            'emprestados': c['livros.emprestados'],
+            'disponiveis': c['livros.total_exemplares'] - c['livros.emprestados']
+        },
+        'concluidos': c['emprestimos.concluidos'] + c['livros.concluidos'],
+        'alertas': {
+            'atrasados': d['livros_atrasados'] + d['devices_atrasados'],
+            'vencendo_hoje': d['livros_vencendo_hoje'] + d['devices_vencendo_hoje'],
+            'vencendo_breve': d['livros_vencendo_breve'] + d['devices_vencendo_breve']
+        }
+    }
+
+
 @app.route('/api/dashboard', methods=['GET'])
 @login_required
+@response_cache.cached('dashboard')
 def api_dashboard():
     conn = get_db_connection()
     if not conn:
@@ -440,78 +984,7 @@ def api_dashboard():
     try:
         cursor = get_db_cursor(conn) if os.getenv('DB_TYPE') != 'postgres' else conn.cursor()
         
-        # Helper to fetch dictionary or use tuple mapping for Postgres
-        def fetch_one(query, params=None):
-            if params: cursor.execute(query, params)
-            else: cursor.execute(query)
-            
-            if os.getenv('DB_TYPE') == 'postgres':
-                # For single count queries usually returned as (count,)
-                 row = cursor.fetchone()
-                 return {'total': row[0]} if row else {'total': 0}
-            else:
-                 return cursor.fetchone()
-
-        # Estatísticas de alunos
-        total_alunos = fetch_one("SELECT COUNT(*) as total FROM alunos")['total']
-        alunos_regular = fetch_one("SELECT COUNT(*) as total FROM alunos WHERE tipo_aluno = 'Regular'")['total']
-        alunos_foundation = fetch_one("SELECT COUNT(*) as total FROM alunos WHERE tipo_aluno = 'Foundation'")['total']
-        
-        tres_meses_atras = datetime.now() - timedelta(days=90)
-        foundation_trimestre = fetch_one("SELECT COUNT(*) as total FROM alunos WHERE tipo_aluno = 'Foundation' AND data_inicio >= %s", (tres_meses_atras.date(),))['total']
-        
-        # Postgres extract year syntax vs MySQL EXTRACT(YEAR FROM )
-        if os.getenv('DB_TYPE') == 'postgres':
-             foundation_ano = fetch_one("SELECT COUNT(*) as total FROM alunos WHERE tipo_aluno = 'Foundation' AND EXTRACT(YEAR FROM data_inicio) = %s", (datetime.now().year,))['total']
-        else:
-             foundation_ano = fetch_one("SELECT COUNT(*) as total FROM alunos WHERE tipo_aluno = 'Foundation' AND EXTRACT(YEAR FROM data_inicio) = %s", (datetime.now().year,))['total']
-        
-        # Devices stats - Simplified for API first version, copying logic
-        # Note: Current logic has complex subqueries. 
-        # For Postgres compatibility, we should ensure SQL is compatible or split queries.
-        # MySQL subqueries in select list works in Postgres too usually.
-        
-        devices_query_emprestimo = '''
-            SELECT 
-                (SELECT COUNT(*) FROM devices WHERE para_emprestimo = TRUE) +
-                (SELECT COUNT(*) FROM equipment_control ec
-                 LEFT JOIN devices d ON ec.numero_serie = d.numero_serie
-                 WHERE ec.status = 'Emprestado' AND ec.para_emprestimo = TRUE AND d.id IS NULL)
-            as total
-        '''
-        # MySQL uses 1/0 for boolean sometimes, but we used TRUE/FALSE in DDL if Postgres.
-        # In MySQL boolean is tinyint(1). TRUE is 1.
-        # So using TRUE should work for both (MySQL parses TRUE as 1).
-        
-        devices_emprestimo = fetch_one(devices_query_emprestimo)['total']
-        
-        devices_query_emprestados = '''
-           SELECT 
-                (SELECT COUNT(*) FROM devices WHERE status = 'Emprestado') +
-                (SELECT COUNT(*) FROM equipment_control ec
-                 LEFT JOIN devices d ON ec.numero_serie = d.numero_serie
-                 WHERE ec.status = 'Emprestado' AND ec.para_emprestimo = TRUE AND d.id IS NULL)
-            as total
-        '''
-        devices_emprestados = fetch_one(devices_query_emprestados)['total']
-        
-        # Devices Disponíveis
-        devices_disponiveis = fetch_one("SELECT COUNT(*) as total FROM devices WHERE status = 'Disponível' AND para_emprestimo = TRUE")['total']
-        
-        # Devices Regular/Foundation
-        devices_regular = fetch_one("SELECT COUNT(*) as total FROM devices WHERE tipo IN ('Macbook', 'Mac Mini') AND para_emprestimo = TRUE")['total']
-        devices_foundation = fetch_one("SELECT COUNT(*) as total FROM devices WHERE tipo IN ('iPad', 'iPhone') AND para_emprestimo = TRUE")['total']
-        
-        # Empréstimos Concluídos (Total Histórico)
-        concluidos_devices = fetch_one("SELECT COUNT(*) as total FROM emprestimos WHERE status = 'Finalizado'")['total']
-        concluidos_livros = fetch_one("SELECT COUNT(*) as total FROM emprestimos_livros WHERE status = 'Finalizado'")['total']
-        total_concluidos = concluidos_devices + concluidos_livros
-        
-        # Biblioteca Stats
-        total_livros = fetch_one("SELECT COUNT(*) as total FROM livros")['total']
-        total_exemplares = fetch_one("SELECT COUNT(*) as total FROM exemplares")['total']
-        livros_emprestados = fetch_one("SELECT COUNT(*) as total FROM emprestimos_livros WHERE status IN ('Ativo', 'Atrasado')")['total']
-        livros_disponiveis = total_exemplares - livros_emprestados
+        contadores = coletar_contadores_dashboard(cursor)
         
         # Atividades Recentes (Unificado: Livros + Devices)
         cursor.execute('''
@@ -543,25 +1016,10 @@ def api_dashboard():
                 item['data_retirada'] = str(item['data_retirada'])
             recent_activity.append(item)
 
-        # --- ESTATÍSTICAS DE ALERTAS (Devoluções) ---
-        # Itens atrasados (livros e devices)
+        # --- ALERTAS (Devoluções) ---
         hoje = datetime.now().date()
         tres_dias = hoje + timedelta(days=3)
 
-        # Atrasados Livros
-        atrasados_livros = fetch_one("SELECT COUNT(*) as total FROM emprestimos_livros WHERE status IN ('Ativo', 'Atrasado') AND data_previsao_devolucao < %s", (hoje,))['total']
-
-        # Vencendo Hoje Livros
-        vencendo_hoje_livros = fetch_one("SELECT COUNT(*) as total FROM emprestimos_livros WHERE status = 'Ativo' AND data_previsao_devolucao = %s", (hoje,))['total']
-
-        # Vencendo em 3 dias Livros
-        vencendo_breve_livros = fetch_one("SELECT COUNT(*) as total FROM emprestimos_livros WHERE status = 'Ativo' AND data_previsao_devolucao > %s AND data_previsao_devolucao <= %s", (hoje, tres_dias))['total']
-
-        # Devices não possuem data_devolucao_prevista explicita em todos os casos, mas a tabela emprestimos tem data_devolucao
-        atrasados_devices = fetch_one("SELECT COUNT(*) as total FROM emprestimos WHERE status = 'Ativo' AND data_devolucao < %s", (hoje,))['total']
-        vencendo_hoje_devices = fetch_one("SELECT COUNT(*) as total FROM emprestimos WHERE status = 'Ativo' AND data_devolucao = %s", (hoje,))['total']
-        vencendo_breve_devices = fetch_one("SELECT COUNT(*) as total FROM emprestimos WHERE status = 'Ativo' AND data_devolucao > %s AND data_devolucao <= %s", (hoje, tres_dias))['total']
-
         # Lista de Alertas Críticos (Top 5)
         # Combinar livros e devices mais urgentes
         cursor.execute('''
@@ -619,36 +1077,13 @@ def api_dashboard():
                 e['data_fim'] = e['data_fim'].isoformat()
             eventos_proximos.append(e)
 
-        # For brevity, returning simplified stats structure
         stats = {
-            'alunos': {
-                'total': total_alunos,
-                'regular': alunos_regular,
-                'foundation': alunos_foundation,
-                'foundation_trimestre': foundation_trimestre,
-                'foundation_ano': foundation_ano
-            },
-            'devices': {
-                'total_emprestimo': devices_emprestimo,
-                'emprestados': devices_emprestados,
-                'disponiveis': devices_disponiveis,
-                'regular': devices_regular,
-                'foundation': devices_foundation
-            },
-            'biblioteca': {
-                'total_livros': total_livros,
-                'total_exemplares': total_exemplares,
-                'emprestados': livros_emprestados,
-                'disponiveis': livros_disponiveis
-            },
-            'concluidos': total_concluidos,
+            'alunos': contadores['alunos'],
+            'devices': contadores['devices'],
+            'biblioteca': contadores['biblioteca'],
+            'concluidos': contadores['concluidos'],
             'recent_activity': recent_activity,
-            'alertas': {
-                'atrasados': atrasados_livros + atrasados_devices,
-                'vencendo_hoje': vencendo_hoje_livros + vencendo_hoje_devices,
-                'vencendo_breve': vencendo_breve_livros + vencendo_breve_devices,
-                'lista': alertas_lista
-            },
+            'alertas': dict(contadores['alertas'], lista=alertas_lista),
             'proximos_eventos': eventos_proximos
         }
         
@@ -682,60 +1117,8 @@ def dashboard():
     try:
         cursor = get_db_cursor(conn)
         
-        # Estatísticas de alunos - ATUALIZADAS
-        cursor.execute("SELECT COUNT(*) as total FROM alunos")
-        total_alunos = cursor.fetchone()['total']
-        
-        cursor.execute("SELECT COUNT(*) as total FROM alunos WHERE tipo_aluno = 'Regular'")
-        alunos_regular = cursor.fetchone()['total']
-        
-        cursor.execute("SELECT COUNT(*) as total FROM alunos WHERE tipo_aluno = 'Foundation'")
-        alunos_foundation = cursor.fetchone()['total']
-        
-        # Foundation por trimestre atual (últimos 3 meses)
-        tres_meses_atras = datetime.now() - timedelta(days=90)
-        cursor.execute("SELECT COUNT(*) as total FROM alunos WHERE tipo_aluno = 'Foundation' AND data_inicio >= %s", (tres_meses_atras.date(),))
-        foundation_trimestre = cursor.fetchone()['total']
-        
-        # Foundation por ano atual
-        ano_atual = datetime.now().year
-        cursor.execute("SELECT COUNT(*) as total FROM alunos WHERE tipo_aluno = 'Foundation' AND EXTRACT(YEAR FROM data_inicio) = %s", (ano_atual,))
-        foundation_ano = cursor.fetchone()['total']
-        
-        # Estatísticas de devices - CORRIGIDAS PARA INCLUIR EQUIPMENT_CONTROL
-        # Para Empréstimo: devices com para_emprestimo=1 + equipments com status='Emprestado' e para_emprestimo=1 (que não estão em devices)
-        cursor.execute('''
-            SELECT 
-                (SELECT COUNT(*) FROM devices WHERE para_emprestimo = 1) +
-                (SELECT COUNT(*) FROM equipment_control ec
-                 LEFT JOIN devices d ON ec.numero_serie = d.numero_serie
-                 WHERE ec.status = 'Emprestado' AND ec.para_emprestimo = 1 AND d.id IS NULL)
-            as total
-        ''')
-        devices_emprestimo = cursor.fetchone()['total']
-        
-        # Emprestados: devices com status='Emprestado' + equipments com status='Emprestado' e para_emprestimo=1 (que não estão em devices)
-        cursor.execute('''
-            SELECT 
-                (SELECT COUNT(*) FROM devices WHERE status = 'Emprestado') +
-                (SELECT COUNT(*) FROM equipment_control ec
-                 LEFT JOIN devices d ON ec.numero_serie = d.numero_serie
-                 WHERE ec.status = 'Emprestado' AND ec.para_emprestimo = 1 AND d.id IS NULL)
-            as total
-        ''')
-        devices_emprestados = cursor.fetchone()['total']
-        
-        # Disponíveis: apenas devices com status='Disponível' e para_emprestimo=1
-        cursor.execute("SELECT COUNT(*) as total FROM devices WHERE status = 'Disponível' AND para_emprestimo = 1")
-        devices_disponiveis = cursor.fetchone()['total']
-        
-        # Devices para alunos Regular (apenas da tabela devices)
-        cursor.execute("SELECT COUNT(*) as total FROM devices WHERE tipo IN ('Macbook', 'Mac Mini') AND para_emprestimo = 1")
-        devices_regular = cursor.fetchone()['total']
-        
-        # Devices para alunos Foundation (apenas da tabela devices)
-        cursor.execute("SELECT COUNT(*) as total FROM devices WHERE tipo IN ('iPad', 'iPhone') AND para_emprestimo = 1")
-        devices_foundation = cursor.fetchone()['total']
+        # Contadores de alunos e devices: mesma fonte do /api/dashboard
+        contadores = coletar_contadores_dashboard(cursor)
         
         # Empréstimos Recentes (últimos 5 empréstimos ativos) - ATUALIZADO
         cursor.execute('''SELECT e.data_retirada, a.nome as aluno_nome, d.nome as device_nome, d.tipo as device_tipo 
@@ -788,31 +1171,20 @@ def dashboard():
             livros_disponiveis = 0
             emprestimos_livros_ativos = 0
 
-        # Devices em Manutenção: devices + equipments com status='Manutenção' (que não estão em devices)
-        cursor.execute('''
-            SELECT 
-                (SELECT COUNT(*) FROM devices WHERE status = 'Manutenção') +
-                (SELECT COUNT(*) FROM equipment_control ec
-                 LEFT JOIN devices d ON ec.numero_serie = d.numero_serie
-                 WHERE ec.status = 'Manutenção' AND d.id IS NULL)
-            as total
-        ''')
-        devices_manutencao = cursor.fetchone()['total']
-        
         cursor.close()
         
         return render_template('dashboard.html', 
-                             total_alunos=total_alunos,
-                             alunos_regular=alunos_regular,
-                             alunos_foundation=alunos_foundation,
-                             foundation_trimestre=foundation_trimestre,
-                             foundation_ano=foundation_ano,
-                             devices_emprestimo=devices_emprestimo,
-                             devices_emprestados=devices_emprestados,
-                             devices_disponiveis=devices_disponiveis,
-                             devices_regular=devices_regular,
-                             devices_foundation=devices_foundation,
-                             devices_manutencao=devices_manutencao,
+                             total_alunos=contadores['alunos']['total'],
+                             alunos_regular=contadores['alunos']['regular'],
+                             alunos_foundation=contadores['alunos']['foundation'],
+                             foundation_trimestre=contadores['alunos']['foundation_trimestre'],
+                             foundation_ano=contadores['alunos']['foundation_ano'],
+                             devices_emprestimo=contadores['devices']['total_emprestimo'],
+                             devices_emprestados=contadores['devices']['emprestados'],
+                             devices_disponiveis=contadores['devices']['disponiveis'],
+                             devices_regular=contadores['devices']['regular'],
+                             devices_foundation=contadores['devices']['foundation'],
+                             devices_manutencao=contadores['devices']['manutencao'],
                              emprestimos_recentes=emprestimos_recentes,
                              devices_mais_utilizados=devices_mais_utilizados,
 
@@ -972,6 +1344,8 @@ def criar_equipment():
             'armazenamento': data.get('armazenamento', ''),
             'tela': data.get('tela', '')
         }
+        delta = DeltaContadores(conn)
+        delta.observar_frota([normalized_data['numero_serie']])
         
         # Prepare query based on DB type
         query = '''
@@ -1004,13 +1378,14 @@ def criar_equipment():
         
         if os.getenv('DB_TYPE') == 'postgres':
              equipment_id = cursor.fetchone()['id']
-             conn.commit()
         else:
-             conn.commit()
              equipment_id = cursor.lastrowid
+        registrar_alteracao(conn, 'equipment_control')
         
-        # CORREÇÃO: Chamar a função de upsert após o commit
+        # Equipment, device e contadores no mesmo commit
         upsert_device_from_equipment(conn, normalized_data)
+        delta.aplicar()
+        conn.commit()
         
         cursor.close()
         
@@ -1070,6 +1445,12 @@ def atualizar_equipment(equipment_id):
             'tela': data.get('tela', '')
         }
         
+        # Número de série atual e o novo: os dois podem mudar de contagem
+        cursor.execute('SELECT numero_serie FROM equipment_control WHERE id = %s', (equipment_id,))
+        atual = cursor.fetchone()
+        delta = DeltaContadores(conn)
+        delta.observar_frota([normalized_data['numero_serie'], atual['numero_serie'] if atual else None])
+        
         cursor.execute('''
             UPDATE equipment_control SET 
             tipo_device = %s, numero_serie = %s, modelo = %s, cor = %s, 
@@ -1095,10 +1476,11 @@ def atualizar_equipment(equipment_id):
             equipment_id
         ))
         
-        conn.commit()
-        
-        # CORREÇÃO: Chamar a função de upsert após o commit
+        # Equipment, device e contadores no mesmo commit
         upsert_device_from_equipment(conn, normalized_data)
+        delta.aplicar()
+        registrar_alteracao(conn, 'equipment_control')
+        conn.commit()
         
         cursor.close()
         
@@ -1140,14 +1522,22 @@ def excluir_equipment(equipment_id):
         result = cursor.fetchone()
         numero_serie = result['numero_serie'] if result else None
         
-        cursor.execute('DELETE FROM equipment_control WHERE id = %s', (equipment_id,))
+        # O device sai junto e leva os empréstimos dele (ON DELETE CASCADE)
+        delta = DeltaContadores(conn)
+        delta.observar_frota([numero_serie])
+        if numero_serie:
+            delta.observar('emprestimos', 'device_id IN (SELECT id FROM devices WHERE numero_serie = %s)',
+                           (numero_serie,))
         
-        conn.commit()
+        cursor.execute('DELETE FROM equipment_control WHERE id = %s', (equipment_id,))
         
         # Se existir na tabela devices, remover
         if numero_serie:
             cursor.execute("DELETE FROM devices WHERE numero_serie = %s", (numero_serie,))
-            conn.commit()
+        
+        delta.aplicar()
+        registrar_alteracao(conn, 'equipment_control', 'devices', 'emprestimos')
+        conn.commit()
         
         cursor.close()
         
@@ -1316,6 +1706,7 @@ def api_inventory():
                         data.get('local', ''),
                         parse_boolean(data.get('etiquetado'), False),
                         data.get('data_cadastro', datetime.now().date())))
+        registrar_alteracao(conn, 'inventory')
         conn.commit()
         cursor.close()
         
@@ -1383,12 +1774,14 @@ def api_inventory_item(item_id):
                             data.get('local', ''),
                             parse_boolean(data.get('etiquetado'), False),
                             item_id))
+            registrar_alteracao(conn, 'inventory')
             conn.commit()
             cursor.close()
             return jsonify({'success': True, 'message': 'Item atualizado com sucesso!'})
         
         cursor = conn.cursor()
         cursor.execute('DELETE FROM inventory WHERE id = %s', (item_id,))
+        registrar_alteracao(conn, 'inventory')
         conn.commit()
         cursor.close()
         return jsonify({'success': True, 'message': 'Item excluído com sucesso!'})
@@ -1423,6 +1816,7 @@ def delete_multiple_inventory():
         cursor = conn.cursor()
         placeholders = ','.join(['%s'] * len(ids))
         cursor.execute(f"DELETE FROM inventory WHERE id IN ({placeholders})", ids)
+        registrar_alteracao(conn, 'inventory')
         conn.commit()
         cursor.close()
         return jsonify({'success': True, 'message': f'{len(ids)} item(ns) excluído(s) com sucesso!'})
@@ -1433,6 +1827,151 @@ def delete_multiple_inventory():
         if conn:
             conn.close()
 
+def executar_importacao(tipo, processador, file):
+    """Roda a importação na requisição ou, com ?async=1, como job em segundo plano.
+
+    Com ?dry_run=1 o processador só valida (ver resultado_simulacao).
+    No modo síncrono a planilha é lida direto do stream do upload, sem cópia
+    para a pasta de uploads. No modo assíncrono o arquivo é salvo para o job
+    e a resposta (202) traz o id; o andamento é consultado em
+    /api/importar/jobs/<job_id>.
+    """
+    filename = secure_filename(file.filename)
+    if request.args.get('dry_run', '').lower() in ('1', 'true', 'sim'):
+        processador = functools.partial(processador, simular=True)
+    if request.args.get('async', '').lower() in ('1', 'true', 'sim'):
+        # Fora da pasta de uploads, que é pública (ver import_jobs.py)
+        filepath = import_jobs.arquivo_entrada(filename)
+        file.save(filepath)
+        job = import_jobs.submit(tipo, processador, filepath, filename, usuario_id=current_user.id)
+        return jsonify({
+            'success': True,
+            'message': 'Importação iniciada.',
+            'job_id': job['id'],
+            'status': job['status'],
+            'status_url': url_for('status_job_importacao', job_id=job['id'])
+        }), 202
+    return jsonify(processador(file.stream, filename))
+
+def resultado_simulacao(sucessos, erros, total_linhas, linhas_com_erro, inicio):
+    """Resposta do dry run: o que seria importado, linha a linha, e quanto levou."""
+    return {
+        'success': True,
+        'dry_run': True,
+        'message': f'Validação concluída! {sucessos} linha(s) seriam importadas e '
+                   f'{len(linhas_com_erro)} têm erro. Nada foi gravado.',
+        'detalhes': {
+            'sucessos': sucessos,
+            'erros': erros,
+            'total_linhas': total_linhas,
+            'linhas_com_erro': linhas_com_erro,
+            'tempo_ms': round((time.perf_counter() - inicio) * 1000, 1)
+        }
+    }
+
+@app.route('/api/importar/jobs/<job_id>')
+@login_required
+def status_job_importacao(job_id):
+    job = import_jobs.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Importação não encontrada!'}), 404
+    if job.get('usuario_id') != current_user.id and current_user.role != 'admin':
+        return jsonify({'success': False, 'message': 'Acesso não autorizado!'}), 403
+    return jsonify({'success': True, 'job': job})
+
+COLUNAS_IMPORTACAO_INVENTORY = ('tombamento', 'equipamento', 'carga', 'local', 'etiquetado')
+
+def processar_importacao_inventory(origem, filename, progresso=None, simular=False):
+    """Processa a planilha de inventory (caminho ou stream do upload); retorna o dict da resposta.
+
+    simular=True (?dry_run=1) valida tudo sem gravar nada.
+    """
+    # Ler em blocos (colunas já normalizadas); o primeiro bloco define o mapeamento
+    blocos = ler_em_blocos(origem, filename)
+    df = next(blocos)
+    
+    column_mapping = {
+        'tombamento': ['tombamento', 'patrimonio', 'patrimônio'],
+        'equipamento': ['equipamento', 'descricao', 'descrição', 'device'],
+        'carga': ['carga', 'cargahoraria', 'carga_horaria'],
+        'local': ['local', 'setor', 'ambiente'],
+        'etiquetado': ['etiquetado', 'etiqueta', 'identificado']
+    }
+    
+    mapped = {}
+    for key, options in column_mapping.items():
+        for option in options:
+            if option in df.columns:
+                mapped[key] = option
+                break
+    
+    required = ['tombamento', 'equipamento']
+    missing = [col for col in required if col not in mapped]
+    if missing:
+        return {'success': False, 'message': f'Colunas obrigatórias não encontradas: {", ".join(missing)}'}
+    
+    conn = get_db_connection()
+    if not conn:
+        return {'success': False, 'message': 'Erro de conexão com o banco!'}
+    
+    inicio = time.perf_counter()
+    try:
+        indice = IndiceChaves(conn, 'inventory', ('tombamento',))
+        sucessos = 0
+        erros = []
+        total_linhas = 0
+        linhas_com_erro = []
+        for df in itertools.chain([df], blocos):
+            tombamento = coluna_texto(df, mapped['tombamento'])
+            equipamento = coluna_texto(df, mapped['equipamento'])
+            valores = {
+                'tombamento': tombamento,
+                'equipamento': equipamento,
+                'carga': coluna_texto(df, mapped.get('carga'), ''),
+                'local': coluna_texto(df, mapped.get('local'), ''),
+                'etiquetado': coluna_booleana(df, mapped.get('etiquetado'))
+            }
+            regras = [
+                (tombamento.isna(), 'Tombamento não informado'),
+                (equipamento.isna(), 'Equipamento não informado'),
+            ]
+            
+            sucessos_bloco, erros_bloco, inseridas = importar_bloco(
+                conn, 'inventory', COLUNAS_IMPORTACAO_INVENTORY, df, valores, regras,
+                lambda v, e: f"Tombamento duplicado - {v[0]}",
+                indice=indice, progresso=progresso, ja_processadas=total_linhas, simular=simular)
+            
+            sucessos += sucessos_bloco
+            erros += erros_bloco
+            if simular:
+                aceitas = {numero_linha for numero_linha, _ in inseridas}
+                linhas_com_erro += [n for n in (df.index + 2).tolist() if n not in aceitas]
+            total_linhas += len(df)
+        
+        if simular:
+            conn.rollback()
+        else:
+            registrar_alteracao(conn, 'inventory')
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    if simular:
+        return resultado_simulacao(sucessos, erros, total_linhas, linhas_com_erro, inicio)
+    
+    return {
+        'success': True,
+        'message': f'Importação concluída! {sucessos} item(ns) importado(s) com sucesso.',
+        'detalhes': {
+            'sucessos': sucessos,
+            'erros': erros,
+            'total_linhas': total_linhas
+        }
+    }
+
 @app.route('/api/importar/inventory', methods=['POST'])
 @login_required
 def importar_inventory():
@@ -1450,76 +1989,7 @@ def importar_inventory():
             return jsonify({'success': False, 'message': 'Nenhum arquivo selecionado'})
         
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
-            df = pd.read_csv(filepath, encoding='utf-8') if filename.endswith('.csv') else pd.read_excel(filepath)
-            df.columns = [col.strip().lower() for col in df.columns]
-            
-            column_mapping = {
-                'tombamento': ['tombamento', 'patrimonio', 'patrimônio'],
-                'equipamento': ['equipamento', 'descricao', 'descrição', 'device'],
-                'carga': ['carga', 'cargahoraria', 'carga_horaria'],
-                'local': ['local', 'setor', 'ambiente'],
-                'etiquetado': ['etiquetado', 'etiqueta', 'identificado']
-            }
-            
-            mapped = {}
-            for key, options in column_mapping.items():
-                for option in options:
-                    if option in df.columns:
-                        mapped[key] = option
-                        break
-            
-            required = ['tombamento', 'equipamento']
-            missing = [col for col in required if col not in mapped]
-            if missing:
-                os.remove(filepath)
-                return jsonify({'success': False, 'message': f'Colunas obrigatórias não encontradas: {", ".join(missing)}'})
-            
-            conn = get_db_connection()
-            if not conn:
-                os.remove(filepath)
-                return jsonify({'success': False, 'message': 'Erro de conexão com o banco!'})
-            
-            cursor = conn.cursor()
-            sucessos = 0
-            erros = []
-            
-            for index, row in df.iterrows():
-                try:
-                    tombamento = str(row[mapped['tombamento']]).strip()
-                    equipamento = str(row[mapped['equipamento']]).strip()
-                    carga = str(row[mapped['carga']]).strip() if 'carga' in mapped else ''
-                    local = str(row[mapped['local']]).strip() if 'local' in mapped else ''
-                    etiquetado = parse_boolean(row[mapped['etiquetado']]) if 'etiquetado' in mapped else False
-                    
-                    cursor.execute('''INSERT INTO inventory
-                                      (tombamento, equipamento, carga, local, etiquetado)
-                                      VALUES (%s, %s, %s, %s, %s)''',
-                                   (tombamento, equipamento, carga, local, etiquetado))
-                    sucessos += 1
-                except IntegrityError:
-                    erros.append(f"Linha {index + 2}: Tombamento duplicado - {tombamento}")
-                except Exception as e:
-                    erros.append(f"Linha {index + 2}: {str(e)}")
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
-            os.remove(filepath)
-            
-            return jsonify({
-                'success': True,
-                'message': f'Importação concluída! {sucessos} item(ns) importado(s) com sucesso.',
-                'detalhes': {
-                    'sucessos': sucessos,
-                    'erros': erros,
-                    'total_linhas': len(df)
-                }
-            })
-        
+            return executar_importacao('inventory', processar_importacao_inventory, file)
         return jsonify({'success': False, 'message': 'Tipo de arquivo não permitido'})
     
     except Exception as e:
@@ -1529,6 +1999,128 @@ def importar_inventory():
 # ROTA DE IMPORTACAO PARA EQUIPMENT CONTROL (NOVA)
 # =============================================================================
 
+COLUNAS_IMPORTACAO_EQUIPMENT = ('tipo_device', 'numero_serie', 'modelo', 'cor', 'status', 'para_emprestimo',
+                                'responsavel', 'local', 'convenio', 'observacao', 'processador', 'memoria',
+                                'armazenamento', 'tela', 'data_cadastro')
+
+def processar_importacao_equipment_control(origem, filename, progresso=None, simular=False):
+    """Processa a planilha de equipment control (caminho ou stream do upload); retorna o dict da resposta.
+
+    simular=True (?dry_run=1) valida tudo sem gravar nada.
+    """
+    # Ler em blocos (colunas já normalizadas); o primeiro bloco define o mapeamento
+    blocos = ler_em_blocos(origem, filename)
+    df = next(blocos)
+    
+    # Mapeamento flexível de colunas
+    column_mapping = {
+        'tipo_device': ['tipo_device', 'tipo', 'device', 'type'],
+        'numero_serie': ['numero_serie', 'numero serie', 'serial', 'n_serie'],
+        'modelo': ['modelo', 'model'],
+        'cor': ['cor', 'color'],
+        'status': ['status', 'situacao'],
+        'para_emprestimo': ['para_emprestimo', 'emprestimo', 'disponivel_emprestimo', 'para_empresumo'],
+        'responsavel': ['responsavel', 'responsável', 'responsible'],
+        'local': ['local', 'location'],
+        'convenio': ['convenio', 'convênio', 'partnership'],
+        'observacao': ['observacao', 'observação', 'obs', 'notes'],
+        'processador': ['processador', 'processor', 'chip'],
+        'memoria': ['memoria', 'memory', 'ram'],
+        'armazenamento': ['armazenamento', 'storage'],
+        'tela': ['tela', 'screen', 'display']
+    }
+    
+    # Encontrar colunas correspondentes
+    mapped = {}
+    for key, options in column_mapping.items():
+        for option in options:
+            if option in df.columns:
+                mapped[key] = option
+                break
+    
+    # Verificar colunas obrigatórias
+    required = ['tipo_device', 'numero_serie']
+    missing = [col for col in required if col not in mapped]
+    if missing:
+        return {'success': False, 'message': f'Colunas obrigatórias não encontradas: {", ".join(missing)}'}
+    
+    conn = get_db_connection()
+    if not conn:
+        return {'success': False, 'message': 'Erro de conexão com o banco!'}
+    
+    inicio = time.perf_counter()
+    try:
+        indice = IndiceChaves(conn, 'equipment_control', ('numero_serie',))
+        delta = DeltaContadores(conn)
+        sucessos = 0
+        erros = []
+        total_linhas = 0
+        linhas_com_erro = []
+        for df in itertools.chain([df], blocos):
+            tipo_device = coluna_texto(df, mapped['tipo_device'])
+            numero_serie = coluna_texto(df, mapped['numero_serie'])
+            status = coluna_texto(df, mapped.get('status'), 'Disponível')
+            status = status.where(status.isin(['Disponível', 'Emprestado', 'Manutenção', 'Reservado']), 'Disponível')
+    
+            valores = {
+                'tipo_device': tipo_device,
+                'numero_serie': numero_serie,
+                'status': status,
+                'para_emprestimo': coluna_booleana(df, mapped.get('para_emprestimo'), True),
+                'data_cadastro': pd.Series([datetime.now().date()] * len(df), index=df.index, dtype=object)
+            }
+            for campo in ('modelo', 'cor', 'responsavel', 'local', 'convenio', 'observacao',
+                          'processador', 'memoria', 'armazenamento', 'tela'):
+                valores[campo] = coluna_texto(df, mapped.get(campo), '')
+    
+            regras = [
+                (tipo_device.isna(), 'Tipo de device não informado'),
+                (numero_serie.isna(), 'Número de série não informado'),
+            ]
+            if not simular:
+                delta.observar_frota(numero_serie.dropna().tolist())
+            
+            sucessos_bloco, erros_bloco, inseridas = importar_bloco(
+                conn, 'equipment_control', COLUNAS_IMPORTACAO_EQUIPMENT, df, valores, regras,
+                lambda v, e: f"Número de série duplicado - {v[1]}",
+                indice=indice, progresso=progresso, ja_processadas=total_linhas, simular=simular)
+            
+            # Sincronizar com a tabela devices as linhas que entraram (em conjunto, mesmo commit)
+            if not simular:
+                sincronizar_devices_em_lote(conn, [valores_linha[1] for _, valores_linha in inseridas])
+            
+            sucessos += sucessos_bloco
+            erros += erros_bloco
+            if simular:
+                aceitas = {numero_linha for numero_linha, _ in inseridas}
+                linhas_com_erro += [n for n in (df.index + 2).tolist() if n not in aceitas]
+            total_linhas += len(df)
+        
+        if simular:
+            conn.rollback()
+        else:
+            delta.aplicar()
+            registrar_alteracao(conn, 'equipment_control', 'devices')
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    if simular:
+        return resultado_simulacao(sucessos, erros, total_linhas, linhas_com_erro, inicio)
+    
+    return {
+        'success': True,
+        'message': f'Importação concluída! {sucessos} equipment(s) importado(s) com sucesso.',
+        'detalhes': {
+            'sucessos': sucessos,
+            'erros': erros,
+            'total_linhas': total_linhas
+        }
+    }
+
 @app.route('/api/importar/equipment-control', methods=['POST'])
 @csrf.exempt
 @login_required
@@ -1547,137 +2139,7 @@ def importar_equipment_control():
             return jsonify({'success': False, 'message': 'Nenhum arquivo selecionado'})
         
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
-            # Ler arquivo
-            df = pd.read_csv(filepath, encoding='utf-8') if filename.endswith('.csv') else pd.read_excel(filepath)
-            df.columns = [col.strip().lower() for col in df.columns]
-            
-            # Mapeamento flexível de colunas
-            column_mapping = {
-                'tipo_device': ['tipo_device', 'tipo', 'device', 'type'],
-                'numero_serie': ['numero_serie', 'numero serie', 'serial', 'n_serie'],
-                'modelo': ['modelo', 'model'],
-                'cor': ['cor', 'color'],
-                'status': ['status', 'situacao'],
-                'para_emprestimo': ['para_emprestimo', 'emprestimo', 'disponivel_emprestimo', 'para_empresumo'],
-                'responsavel': ['responsavel', 'responsável', 'responsible'],
-                'local': ['local', 'location'],
-                'convenio': ['convenio', 'convênio', 'partnership'],
-                'observacao': ['observacao', 'observação', 'obs', 'notes'],
-                'processador': ['processador', 'processor', 'chip'],
-                'memoria': ['memoria', 'memory', 'ram'],
-                'armazenamento': ['armazenamento', 'storage'],
-                'tela': ['tela', 'screen', 'display']
-            }
-            
-            # Encontrar colunas correspondentes
-            mapped = {}
-            for key, options in column_mapping.items():
-                for option in options:
-                    if option in df.columns:
-                        mapped[key] = option
-                        break
-            
-            # Verificar colunas obrigatórias
-            required = ['tipo_device', 'numero_serie']
-            missing = [col for col in required if col not in mapped]
-            if missing:
-                os.remove(filepath)
-                return jsonify({'success': False, 'message': f'Colunas obrigatórias não encontradas: {", ".join(missing)}'})
-            
-            conn = get_db_connection()
-            if not conn:
-                os.remove(filepath)
-                return jsonify({'success': False, 'message': 'Erro de conexão com o banco!'})
-            
-            cursor = get_db_cursor(conn)
-            sucessos = 0
-            erros = []
-            
-            for index, row in df.iterrows():
-                try:
-                    # Campos obrigatórios
-                    tipo_device = str(row[mapped['tipo_device']]).strip()
-                    numero_serie = str(row[mapped['numero_serie']]).strip()
-                    
-                    # Campos opcionais com valores padrão
-                    modelo = str(row[mapped['modelo']]).strip() if 'modelo' in mapped else ''
-                    cor = str(row[mapped['cor']]).strip() if 'cor' in mapped else ''
-                    status = str(row[mapped['status']]).strip() if 'status' in mapped else 'Disponível'
-                    responsavel = str(row[mapped['responsavel']]).strip() if 'responsavel' in mapped else ''
-                    local = str(row[mapped['local']]).strip() if 'local' in mapped else ''
-                    convenio = str(row[mapped['convenio']]).strip() if 'convenio' in mapped else ''
-                    observacao = str(row[mapped['observacao']]).strip() if 'observacao' in mapped else ''
-                    processador = str(row[mapped['processador']]).strip() if 'processador' in mapped else ''
-                    memoria = str(row[mapped['memoria']]).strip() if 'memoria' in mapped else ''
-                    armazenamento = str(row[mapped['armazenamento']]).strip() if 'armazenamento' in mapped else ''
-                    tela = str(row[mapped['tela']]).strip() if 'tela' in mapped else ''
-                    
-                    # Processar para_emprestimo
-                    if 'para_emprestimo' in mapped:
-                        para_emprestimo_val = row[mapped['para_emprestimo']]
-                        para_emprestimo = parse_boolean(para_emprestimo_val, True)
-                    else:
-                        para_emprestimo = True
-                    
-                    # Validar status
-                    if status not in ['Disponível', 'Emprestado', 'Manutenção', 'Reservado']:
-                        status = 'Disponível'
-                    
-                    # Inserir no banco
-                    cursor.execute('''INSERT INTO equipment_control 
-                                    (tipo_device, numero_serie, modelo, cor, status, para_emprestimo, 
-                                     responsavel, local, convenio, observacao, processador, memoria, 
-                                     armazenamento, tela, data_cadastro)
-                                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
-                                 (tipo_device, numero_serie, modelo, cor, status, para_emprestimo,
-                                  responsavel, local, convenio, observacao, processador, memoria,
-                                  armazenamento, tela, datetime.now().date()))
-                    
-                    # Sincronizar com a tabela devices
-                    normalized_data = {
-                        'tipo_device': tipo_device,
-                        'numero_serie': numero_serie,
-                        'modelo': modelo,
-                        'cor': cor,
-                        'status': status,
-                        'para_emprestimo': para_emprestimo,
-                        'responsavel': responsavel,
-                        'local': local,
-                        'convenio': convenio,
-                        'observacao': observacao,
-                        'processador': processador,
-                        'memoria': memoria,
-                        'armazenamento': armazenamento,
-                        'tela': tela
-                    }
-                    upsert_device_from_equipment(conn, normalized_data)
-                    
-                    sucessos += 1
-                    
-                except IntegrityError:
-                    erros.append(f"Linha {index + 2}: Número de série duplicado - {numero_serie}")
-                except Exception as e:
-                    erros.append(f"Linha {index + 2}: {str(e)}")
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
-            os.remove(filepath)
-            
-            return jsonify({
-                'success': True,
-                'message': f'Importação concluída! {sucessos} equipment(s) importado(s) com sucesso.',
-                'detalhes': {
-                    'sucessos': sucessos,
-                    'erros': erros,
-                    'total_linhas': len(df)
-                }
-            })
-        
+            return executar_importacao('equipment_control', processar_importacao_equipment_control, file)
         return jsonify({'success': False, 'message': 'Tipo de arquivo não permitido'})
     
     except Exception as e:
@@ -1714,6 +2176,13 @@ def delete_multiple_equipment():
         results = cursor.fetchall()
         numeros_serie = [result['numero_serie'] for result in results] if results else []
         
+        # Os devices saem junto e levam os empréstimos deles (ON DELETE CASCADE)
+        delta = DeltaContadores(conn)
+        delta.observar_frota(numeros_serie)
+        if numeros_serie:
+            delta.observar('emprestimos', f"device_id IN (SELECT id FROM devices WHERE numero_serie IN "
+                                          f"({','.join(['%s'] * len(numeros_serie))}))", numeros_serie)
+        
         # Executar delete múltiplo
         cursor.execute(f"DELETE FROM equipment_control WHERE id IN ({placeholders})", equipment_ids)
         
@@ -1722,6 +2191,8 @@ def delete_multiple_equipment():
             placeholders_devices = ','.join(['%s'] * len(numeros_serie))
             cursor.execute(f"DELETE FROM devices WHERE numero_serie IN ({placeholders_devices})", numeros_serie)
         
+        delta.aplicar()
+        registrar_alteracao(conn, 'equipment_control', 'devices', 'emprestimos')
         conn.commit()
         cursor.close()
         
@@ -1784,14 +2255,127 @@ def alunos():
         if conn:
             conn.close()
 
+def _codificar_cursor(*valores):
+    """Token opaco de continuação para paginação por cursor (keyset)."""
+    return base64.urlsafe_b64encode(json.dumps(valores, default=str).encode('utf-8')).decode('ascii').rstrip('=')
+
+def _decodificar_cursor(token):
+    try:
+        padding = '=' * (-len(token) % 4)
+        return json.loads(base64.urlsafe_b64decode(token + padding))
+    except Exception:
+        raise ValueError('Cursor inválido')
+
+def total_alunos_cacheado(cursor):
+    """Total de alunos a partir de dashboard_counters (mantido nas escritas), com COUNT(*) como fallback."""
+    cursor.execute("SELECT valor FROM dashboard_counters WHERE nome = 'alunos.total'")
+    row = _linha_como_dict(cursor, cursor.fetchone())
+    if row:
+        return int(row['valor'])
+    cursor.execute('SELECT COUNT(*) as total FROM alunos')
+    return int(_linha_como_dict(cursor, cursor.fetchone())['total'])
+
+def _escapar_like(texto):
+    return texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def _prefixo_cpf_formatado(digitos):
+    """Prefixo de dígitos no formato 000.000.000-00 (ex.: '123456' -> '123.456')."""
+    partes = [digitos[0:3], digitos[3:6], digitos[6:9], digitos[9:11]]
+    formatado = ''
+    for separador, parte in zip(('', '.', '.', '-'), partes):
+        if not parte:
+            break
+        formatado += separador + parte
+    return formatado
+
+def filtro_busca_alunos(q=None, tipo_aluno=None, trecho=False):
+    """Monta (condições, params) para busca de alunos usando os índices de create_tables.
+
+    - CPF (só dígitos/pontuação): prefixo em cpf (índice único), tanto só com
+      dígitos quanto no formato 000.000.000-00, então "123456" acha um CPF
+      gravado como "123.456.789-01" e vice-versa.
+    - Com '@': prefixo em email.
+    - Texto: Postgres usa ILIKE '%termo%' nos índices trigram (pg_trgm) de
+      nome/email; MySQL usa o índice FULLTEXT com prefixo por palavra. O
+      FULLTEXT não acha trechos no meio da palavra ("silva" em "dasilva"):
+      com trecho=True (ou palavras com menos de 3 letras, curtas demais para
+      o FULLTEXT) o MySQL usa LIKE '%termo%' em nome/email.
+    - tipo_aluno: igualdade (índice idx_alunos_tipo_nome_id).
+    """
+    condicoes = []
+    params = []
+    q = (q or '').strip()
+
+    if q:
+        if re.fullmatch(r'[\d.\-\s]+', q) and re.search(r'\d', q):
+            digitos = re.sub(r'\D', '', q)
+            formatado = _prefixo_cpf_formatado(digitos)
+            if formatado != digitos:
+                condicoes.append('(cpf LIKE %s OR cpf LIKE %s)')
+                params.extend([digitos + '%', formatado + '%'])
+            else:
+                condicoes.append('cpf LIKE %s')
+                params.append(digitos + '%')
+        elif '@' in q:
+            if os.getenv('DB_TYPE') == 'postgres':
+                condicoes.append('email ILIKE %s')
+            else:
+                condicoes.append('email LIKE %s')
+            params.append(_escapar_like(q) + '%')
+        elif os.getenv('DB_TYPE') == 'postgres':
+            condicoes.append('(nome ILIKE %s OR email ILIKE %s)')
+            termo = '%' + _escapar_like(q) + '%'
+            params.extend([termo, termo])
+        else:
+            palavras = re.findall(r'\w+', q)
+            if not trecho and palavras and all(len(p) >= 3 for p in palavras):
+                condicoes.append('MATCH(nome, email) AGAINST (%s IN BOOLEAN MODE)')
+                params.append(' '.join(f'+{p}*' for p in palavras))
+            else:
+                condicoes.append('(nome LIKE %s OR email LIKE %s)')
+                termo = '%' + _escapar_like(q) + '%'
+                params.extend([termo, termo])
+
+    if tipo_aluno:
+        condicoes.append('tipo_aluno = %s')
+        params.append(tipo_aluno)
+
+    return condicoes, params
+
 # API para listar alunos paginado
 @app.route('/api/alunos/pagina', methods=['GET'])
 @login_required
 def api_alunos_pagina():
-    """API para listar alunos com paginação"""
+    """API para listar alunos com paginação.
+
+    Dois modos:
+    - page/limit (padrão): OFFSET, mantido para a paginação numerada do front.
+    - cursor: passe ?cursor= (vazio na primeira página) e use o next_cursor da
+      resposta para seguir. Busca por (nome, id) no índice idx_alunos_nome_id,
+      então o custo não cresce com a profundidade da página. O total só é
+      devolvido com ?include_total=1.
+
+    No modo page/limit o total vem por padrão; ?include_total=0 omite total e
+    pages da resposta.
+
+    Filtros opcionais nos dois modos: q (nome, email ou CPF) e tipo_aluno.
+    """
     page = request.args.get('page', 1, type=int)
     limit = request.args.get('limit', 10, type=int)
-    offset = (page - 1) * limit
+    limit = max(1, min(limit, 500))
+    offset = (max(page, 1) - 1) * limit
+    modo_cursor = 'cursor' in request.args
+    token = request.args.get('cursor', '')
+    incluir_total = request.args.get('include_total', '0' if modo_cursor else '1') in ('1', 'true', 'True')
+    condicoes, params = filtro_busca_alunos(request.args.get('q'), request.args.get('tipo_aluno'))
+    
+    posicao = None
+    if modo_cursor and token:
+        try:
+            posicao = _decodificar_cursor(token)
+            nome_cursor, id_cursor = posicao[0], int(posicao[1])
+        except (ValueError, TypeError, IndexError, KeyError):
+            return jsonify({'success': False, 'message': 'Cursor inválido'}), 400
     
     conn = get_db_connection()
     if not conn:
@@ -1799,13 +2383,40 @@ def api_alunos_pagina():
     
     try:
         cursor = get_db_cursor(conn)
-        # Get total count
-        cursor.execute('SELECT COUNT(*) as total FROM alunos')
-        total = cursor.fetchone()['total']
-        
-        # Get paginated data
-        cursor.execute('SELECT * FROM alunos ORDER BY nome LIMIT %s OFFSET %s', (limit, offset))
-        alunos_data = cursor.fetchall()
+        if any(c.startswith('MATCH(') for c in condicoes):
+            # FULLTEXT só acha começo de palavra; sem nenhum resultado, busca o trecho com LIKE
+            cursor.execute(f"SELECT 1 FROM alunos WHERE {' AND '.join(condicoes)} LIMIT 1", tuple(params))
+            if cursor.fetchone() is None:
+                condicoes, params = filtro_busca_alunos(request.args.get('q'), request.args.get('tipo_aluno'),
+                                                        trecho=True)
+        where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+        
+        total = None
+        if incluir_total and condicoes:
+            cursor.execute(f'SELECT COUNT(*) as total FROM alunos {where}', tuple(params))
+            total = cursor.fetchone()['total']
+        elif incluir_total:
+            # Sem filtro o total vem do contador materializado, não de um COUNT(*) a cada página
+            total = total_alunos_cacheado(cursor)
+        
+        if modo_cursor:
+            # Busca uma linha a mais só para saber se existe próxima página
+            condicoes_pagina = list(condicoes)
+            params_pagina = list(params)
+            if posicao is not None:
+                # Comparação de linha: vira um seek em idx_alunos_nome_id (a forma com OR não)
+                condicoes_pagina.append('(nome, id) > (%s, %s)')
+                params_pagina.extend([nome_cursor, id_cursor])
+            where_pagina = f"WHERE {' AND '.join(condicoes_pagina)}" if condicoes_pagina else ''
+            cursor.execute(f'SELECT * FROM alunos {where_pagina} ORDER BY nome, id LIMIT %s',
+                           tuple(params_pagina) + (limit + 1,))
+            alunos_data = cursor.fetchall()
+            tem_mais = len(alunos_data) > limit
+            alunos_data = alunos_data[:limit]
+        else:
+            cursor.execute(f'SELECT * FROM alunos {where} ORDER BY nome, id LIMIT %s OFFSET %s',
+                           tuple(params) + (limit, offset))
+            alunos_data = cursor.fetchall()
         cursor.close()
         
         alunos_list = []
@@ -1826,14 +2437,29 @@ def api_alunos_pagina():
                 'curso': aluno.get('curso', 'Apple Developer Academy')
             })
         
-        return jsonify({
+        if modo_cursor:
+            ultimo = alunos_data[-1] if alunos_data else None
+            resposta = {
+                'success': True,
+                'data': alunos_list,
+                'limit': limit,
+                'next_cursor': _codificar_cursor(ultimo['nome'], ultimo['id']) if tem_mais else None
+            }
+            if total is not None:
+                resposta['total'] = total
+            return jsonify(resposta)
+        
+        resposta = {
             'success': True,
             'data': alunos_list,
-            'total': total,
             'page': page,
-            'limit': limit,
-            'pages': (total + limit - 1) // limit
-        })
+            'limit': limit
+        }
+        # Com ?include_total=0 a página sai sem total/pages, como no modo cursor
+        if total is not None:
+            resposta['total'] = total
+            resposta['pages'] = (total + limit - 1) // limit
+        return jsonify(resposta)
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro ao carregar alunos: {str(e)}'}), 500
     finally:
@@ -1920,6 +2546,8 @@ def criar_aluno():
                         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
                      (nome, cpf, telefone, email, endereco, tem_apple_id, apple_id, tipo_aluno, data_inicio, foto_path))
         
+        atualizar_contadores_dashboard(conn, contribuicao_aluno({'tipo_aluno': tipo_aluno}))
+        registrar_alteracao(conn, 'alunos')
         conn.commit()
         cursor.close()
         
@@ -2037,6 +2665,9 @@ def api_aluno(aluno_id):
                     file.save(os.path.join(alunos_upload_dir, filename))
                     foto_path = f"uploads/alunos/{filename}"
             
+            delta = DeltaContadores(conn)
+            delta.observar('alunos', 'id = %s', (aluno_id,))
+            
             # UPDATE único incluindo foto_path para garantir preservação
             cursor.execute('''UPDATE alunos SET 
                             nome = %s, cpf = %s, telefone = %s, email = %s, endereco = %s, 
@@ -2045,6 +2676,8 @@ def api_aluno(aluno_id):
                             WHERE id = %s''',
                          (nome, cpf, telefone, email, endereco, tem_apple_id, apple_id, tipo_aluno, data_inicio, foto_path, aluno_id))
             
+            delta.aplicar()
+            registrar_alteracao(conn, 'alunos')
             conn.commit()
             cursor.close()
             
@@ -2061,8 +2694,15 @@ def api_aluno(aluno_id):
             if emprestimo_ativo:
                 return jsonify({'success': False, 'message': 'Não é possível excluir um aluno que possui empréstimo ativo!'})
             
+            # Os empréstimos do aluno saem junto (ON DELETE CASCADE)
+            delta = DeltaContadores(conn)
+            delta.observar('alunos', 'id = %s', (aluno_id,))
+            delta.observar('emprestimos', 'aluno_id = %s', (aluno_id,))
+            
             cursor.execute("DELETE FROM alunos WHERE id = %s", (aluno_id,))
             
+            delta.aplicar()
+            registrar_alteracao(conn, 'alunos', 'emprestimos')
             conn.commit()
             cursor.close()
             
@@ -2107,6 +2747,10 @@ def bulk_delete_alunos():
                 'message': 'Não é possível excluir alunos com empréstimos ativos!'
             }), 400
             
+        delta = DeltaContadores(conn)
+        for tabela, coluna in (('emprestimos_livros', 'aluno_id'), ('emprestimos', 'aluno_id'), ('alunos', 'id')):
+            delta.observar(tabela, f"{coluna} IN ({format_strings})", aluno_ids)
+        
         # Delete related data in emprestimos_livros first
         cursor.execute(f"DELETE FROM emprestimos_livros WHERE aluno_id IN ({format_strings})", tuple(aluno_ids))
         
@@ -2116,6 +2760,8 @@ def bulk_delete_alunos():
         # Finally delete students
         cursor.execute(f"DELETE FROM alunos WHERE id IN ({format_strings})", tuple(aluno_ids))
         
+        delta.aplicar()
+        registrar_alteracao(conn, 'alunos', 'emprestimos', 'emprestimos_livros')
         conn.commit()
         cursor.close()
         
@@ -2131,6 +2777,43 @@ def bulk_delete_alunos():
 # ROTAS DE DEVICES ATUALIZADAS COM OBSERVAÇÃO (MYSQL)
 # =============================================================================
 
+# =============================================================================
+# FROTA EMPRESTÁVEL (devices + equipment_control)
+# =============================================================================
+
+def listar_frota_emprestavel(cursor, status=None, status_equipment=None):
+    """Devices para empréstimo mais os equipments que ainda não estão em devices.
+
+    Lê a view frota_emprestavel (criada em create_tables), que já resolve o
+    anti-join por numero_serie. Equipments vêm com id negativo para
+    identificar a origem.
+
+    status: filtra devices e equipments pelo status.
+    status_equipment: filtra só os equipments (devices de qualquer status).
+    """
+    condicoes = ["para_emprestimo = TRUE"]
+    params = []
+    if status:
+        condicoes.append("status = %s")
+        params.append(status)
+    if status_equipment and status_equipment != status:
+        condicoes.append("(origem = 'devices' OR status = %s)")
+        params.append(status_equipment)
+
+    cursor.execute(f'''
+        SELECT * FROM frota_emprestavel
+        WHERE {' AND '.join(condicoes)}
+        ORDER BY CASE WHEN origem = 'devices' THEN 0 ELSE 1 END, tipo, nome, numero_serie
+    ''', tuple(params))
+
+    frota = []
+    for row in cursor.fetchall():
+        item = dict(_linha_como_dict(cursor, row))
+        item.pop('origem', None)
+        item['para_emprestimo'] = bool(item['para_emprestimo'])
+        frota.append(item)
+    return frota
+
 @app.route('/devices')
 @login_required
 def devices():
@@ -2142,69 +2825,14 @@ def devices():
     try:
         cursor = get_db_cursor(conn)
         
-        # Buscar devices da tabela devices com para_emprestimo = true E status = 'Disponível'
-        cursor.execute('''SELECT * FROM devices WHERE para_emprestimo = 1 AND status = 'Disponível' ORDER BY tipo, nome''')
-        devices_data = cursor.fetchall()
-
-        # Buscar equipments do equipment_control com status='Disponível' e para_emprestimo=1
-        cursor.execute('''SELECT * FROM equipment_control 
-                          WHERE status = 'Disponível' AND para_emprestimo = 1 
-                          ORDER BY tipo_device, modelo''')
-        equipments_data = cursor.fetchall()
-        print(f"DEBUG equipment_control: Total de {len(equipments_data)} equipments encontrados")
-        if equipments_data:
-            print(f"DEBUG: Primeiro equipment: {equipments_data[0]}")
-        else:
-            print("DEBUG: NENHUM equipment encontrado na tabela equipment_control!")
-        
+        devices_list = []
+        for device in listar_frota_emprestavel(cursor, status='Disponível'):
+            # A página mostra vazio no lugar de None e Sim/Não no para_emprestimo
+            item = {chave: ('' if valor is None else valor) for chave, valor in device.items()}
+            item['para_emprestimo'] = 'Sim' if device['para_emprestimo'] else 'Não'
+            devices_list.append(item)
         cursor.close()
         
-        devices_list = []
-        
-        # Adicionar devices da tabela devices
-        for device in devices_data:
-            devices_list.append({
-                'id': device['id'],
-                'tipo': device['tipo'],
-                'modelo': device['modelo'] or '',
-                'cor': device['cor'] or '',
-                'polegadas': device['polegadas'] or '',
-                'ano': device['ano'] or '',
-                'nome': device['nome'] or '',
-                'chip': device['chip'] or '',
-                'memoria': device['memoria'] or '',
-                'numero_serie': device['numero_serie'],
-                'versao_os': device['versao_os'] or '',
-                'status': device['status'],
-                'para_emprestimo': 'Sim' if device['para_emprestimo'] else 'Não',
-                'observacao': device.get('observacao', '') or ''
-            })
-        
-        # Adicionar equipments do equipment_control que atendem aos critérios
-        for equipment in equipments_data:
-            # Verificar se já existe na lista (por número de série)
-            numero_serie_eq = equipment['numero_serie']
-            ja_existe = any(d.get('numero_serie') == numero_serie_eq for d in devices_list)
-            
-            # Só adicionar se não existir ainda
-            if not ja_existe:
-                devices_list.append({
-                    'id': -equipment['id'],  # ID negativo para identificar origem
-                    'tipo': equipment['tipo_device'] or 'Outro',
-                    'modelo': equipment.get('modelo', '') or '',
-                    'cor': equipment.get('cor', '') or '',
-                    'polegadas': equipment.get('polegadas', '') or '',
-                    'ano': equipment.get('ano', '') or '',
-                    'nome': (equipment.get('local') or equipment.get('responsavel') or f"{equipment['tipo_device']} - {equipment['numero_serie']}") or '',
-                    'chip': equipment.get('processador', '') or '',
-                    'memoria': equipment.get('memoria', '') or '',
-                    'numero_serie': equipment['numero_serie'],
-                    'versao_os': equipment.get('versao_os', '') or '',
-                    'status': equipment['status'],
-                    'para_emprestimo': 'Sim' if equipment['para_emprestimo'] else 'Não',
-                    'observacao': equipment.get('observacao', '') or ''
-                })
-        
         return render_template('devices.html', devices=devices_list)
     
     except Exception as e:
@@ -2223,64 +2851,11 @@ def criar_device():
     
     try:
         if request.method == 'GET':
-            # Retornar lista de devices (apenas com para_emprestimo = true)
+            # Devices para empréstimo + equipments emprestados que ainda não viraram device
             cursor = get_db_cursor(conn)
-            cursor.execute('''SELECT * FROM devices WHERE para_emprestimo = 1 ORDER BY tipo, nome''')
-            devices_data = cursor.fetchall()
-            
-            # Buscar equipments do equipment_control com status='Emprestado' e para_emprestimo=true
-            # Incluir TODOS os equipments com status='Emprestado' e para_emprestimo=true
-            cursor.execute('''
-                SELECT ec.*, 'equipment_control' as origem
-                FROM equipment_control ec
-                WHERE ec.status = 'Emprestado' 
-                AND (ec.para_emprestimo = 1 OR ec.para_emprestimo = TRUE)
-                ORDER BY ec.tipo_device, ec.numero_serie
-            ''')
-            equipments_data = cursor.fetchall()
-            
+            devices_list = listar_frota_emprestavel(cursor, status_equipment='Emprestado')
             cursor.close()
             
-            devices_list = []
-            
-            # Adicionar devices da tabela devices
-            for device in devices_data:
-                devices_list.append({
-                    'id': device['id'],
-                    'tipo': device['tipo'],
-                    'modelo': device['modelo'],
-                    'cor': device['cor'],
-                    'polegadas': device['polegadas'],
-                    'ano': device['ano'],
-                    'nome': device['nome'],
-                    'chip': device['chip'],
-                    'memoria': device['memoria'],
-                    'numero_serie': device['numero_serie'],
-                    'versao_os': device['versao_os'],
-                    'status': device['status'],
-                    'para_emprestimo': bool(device['para_emprestimo']),
-                    'observacao': device.get('observacao', '')
-                })
-            
-            # Adicionar equipments do equipment_control
-            for equipment in equipments_data:
-                devices_list.append({
-                    'id': -equipment['id'],  # ID negativo para identificar origem
-                    'tipo': equipment['tipo_device'] or 'Outro',
-                    'modelo': equipment.get('modelo', ''),
-                    'cor': equipment.get('cor', ''),
-                    'polegadas': equipment.get('polegadas', ''),
-                    'ano': equipment.get('ano', ''),
-                    'nome': equipment.get('local') or equipment.get('responsavel') or f"{equipment['tipo_device']} - {equipment['numero_serie']}",
-                    'chip': equipment.get('processador', ''),
-                    'memoria': equipment.get('memoria', ''),
-                    'numero_serie': equipment['numero_serie'],
-                    'versao_os': equipment.get('versao_os', ''),
-                    'status': equipment['status'],
-                    'para_emprestimo': bool(equipment['para_emprestimo']),
-                    'observacao': equipment.get('observacao', '')
-                })
-            
             return jsonify(devices_list)
         
         data = request.get_json()
@@ -2301,11 +2876,19 @@ def criar_device():
         
         cursor = conn.cursor()
         
+        # Um equipment com o mesmo número de série deixa de contar na frota
+        delta = DeltaContadores(conn)
+        delta.observar_frota([numero_serie])
+        if not numero_serie:
+            delta.somar(contribuicao_device({'tipo': tipo, 'status': status, 'para_emprestimo': para_emprestimo}))
+        
         cursor.execute('''INSERT INTO devices 
                         (tipo, modelo, cor, polegadas, ano, nome, chip, memoria, numero_serie, versao_os, status, para_emprestimo, observacao)
                         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
                      (tipo, modelo, cor, polegadas, ano, nome, chip, memoria, numero_serie, versao_os, status, para_emprestimo, observacao))
         
+        delta.aplicar()
+        registrar_alteracao(conn, 'devices')
         conn.commit()
         cursor.close()
         
@@ -2380,10 +2963,15 @@ def api_device(device_id):
             observacao = data.get('observacao', '')
             
             cursor = conn.cursor()
+            delta = DeltaContadores(conn)
             
             # Se para_emprestimo for false, remover o device da tabela
             if not para_emprestimo:
+                delta.observar_frota(device_ids=[device_id])
+                delta.observar('emprestimos', 'device_id = %s', (device_id,))
                 cursor.execute("DELETE FROM devices WHERE id = %s", (device_id,))
+                delta.aplicar()
+                registrar_alteracao(conn, 'devices', 'emprestimos')
                 conn.commit()
                 cursor.close()
                 return jsonify({'success': True, 'message': 'Device removido da lista de empréstimos!'})
@@ -2394,6 +2982,7 @@ def api_device(device_id):
             if existing:
                 return jsonify({'success': False, 'message': 'Número de série já cadastrado em outro device!'})
             
+            delta.observar_frota([numero_serie], [device_id])
             cursor.execute('''UPDATE devices SET 
                             tipo = %s, modelo = %s, cor = %s, polegadas = %s, ano = %s, nome = %s, 
                             chip = %s, memoria = %s, numero_serie = %s, versao_os = %s, status = %s, para_emprestimo = %s, observacao = %s
@@ -2401,6 +2990,8 @@ def api_device(device_id):
                          (tipo, modelo, cor, polegadas, ano, nome, chip, memoria, numero_serie, 
                           versao_os, status, para_emprestimo, observacao, device_id))
             
+            delta.aplicar()
+            registrar_alteracao(conn, 'devices')
             conn.commit()
             cursor.close()
             
@@ -2417,8 +3008,15 @@ def api_device(device_id):
             if emprestimo_ativo:
                 return jsonify({'success': False, 'message': 'Não é possível excluir um device que está em empréstimo ativo!'})
             
+            # Os empréstimos do device saem junto (ON DELETE CASCADE)
+            delta = DeltaContadores(conn)
+            delta.observar_frota(device_ids=[device_id])
+            delta.observar('emprestimos', 'device_id = %s', (device_id,))
+            
             cursor.execute("DELETE FROM devices WHERE id = %s", (device_id,))
             
+            delta.aplicar()
+            registrar_alteracao(conn, 'devices', 'emprestimos')
             conn.commit()
             cursor.close()
             
@@ -2458,7 +3056,14 @@ def delete_multiple_devices():
         if ativos:
             return jsonify({'success': False, 'message': 'Existe(m) device(s) com empréstimo ativo. Finalize antes de excluir.'}), 400
         
+        # Os empréstimos dos devices saem junto (ON DELETE CASCADE)
+        delta = DeltaContadores(conn)
+        delta.observar_frota(device_ids=device_ids)
+        delta.observar('emprestimos', f"device_id IN ({placeholders})", device_ids)
+        
         cursor.execute(f"DELETE FROM devices WHERE id IN ({placeholders})", device_ids)
+        delta.aplicar()
+        registrar_alteracao(conn, 'devices', 'emprestimos')
         conn.commit()
         cursor.close()
         
@@ -2474,6 +3079,10 @@ def delete_multiple_devices():
 # ROTAS DE EMPRÉSTIMOS (ATUALIZADAS COM ASSINATURA - MYSQL)
 # =============================================================================
 
+# Colunas das listagens de empréstimos: a assinatura vem como hash (ver assinaturas.py)
+COLUNAS_LISTA_EMPRESTIMOS = ("e.id, e.aluno_id, e.device_id, e.acessorios, e.data_retirada, "
+                             "e.data_devolucao, e.status, e.assinatura_hash")
+
 @app.route('/emprestimos')
 @login_required
 def emprestimos():
@@ -2486,7 +3095,7 @@ def emprestimos():
         cursor = get_db_cursor(conn)
         
         # Buscar empréstimos com informações dos alunos e devices
-        cursor.execute('''SELECT e.*, a.nome as aluno_nome, d.nome as device_nome, d.tipo as device_tipo
+        cursor.execute(f'''SELECT {COLUNAS_LISTA_EMPRESTIMOS}, a.nome as aluno_nome, d.nome as device_nome, d.tipo as device_tipo
                          FROM emprestimos e
                          LEFT JOIN alunos a ON e.aluno_id = a.id
                          LEFT JOIN devices d ON e.device_id = d.id
@@ -2513,7 +3122,7 @@ def emprestimos():
                 'acessorios': emp['acessorios'],
                 'data_retirada': emp['data_retirada'],
                 'data_devolucao': emp['data_devolucao'],
-                'assinatura': emp['assinatura'],
+                'assinatura': url_assinatura(emp['assinatura_hash']),
                 'status': emp['status'],
                 'aluno_nome': emp['aluno_nome'],
                 'device_nome': emp['device_nome'],
@@ -2541,7 +3150,7 @@ def api_emprestimos():
         
     try:
         cursor = get_db_cursor(conn)
-        cursor.execute('''SELECT e.*, a.nome as aluno_nome, d.nome as device_nome, d.tipo as device_tipo
+        cursor.execute(f'''SELECT {COLUNAS_LISTA_EMPRESTIMOS}, a.nome as aluno_nome, d.nome as device_nome, d.tipo as device_tipo
                          FROM emprestimos e
                          LEFT JOIN alunos a ON e.aluno_id = a.id
                          LEFT JOIN devices d ON e.device_id = d.id
@@ -2555,6 +3164,8 @@ def api_emprestimos():
                 emp['data_retirada'] = emp['data_retirada'].isoformat()
             if emp['data_devolucao']:
                  emp['data_devolucao'] = emp['data_devolucao'].isoformat()
+            # Só a URL: a imagem é buscada quando o detalhe do empréstimo é aberto
+            emp['assinatura'] = url_assinatura(emp['assinatura_hash'])
         
         return jsonify({'success': True, 'data': emprestimos})
 
@@ -2573,7 +3184,7 @@ def api_emprestimos_lista():
         
     try:
         cursor = get_db_cursor(conn)
-        cursor.execute('''SELECT e.*, a.nome as aluno_nome, d.nome as device_nome, d.tipo as device_tipo, d.numero_serie as device_numero_serie
+        cursor.execute(f'''SELECT {COLUNAS_LISTA_EMPRESTIMOS}, a.nome as aluno_nome, d.nome as device_nome, d.tipo as device_tipo, d.numero_serie as device_numero_serie
                          FROM emprestimos e
                          LEFT JOIN alunos a ON e.aluno_id = a.id
                          LEFT JOIN devices d ON e.device_id = d.id
@@ -2587,6 +3198,8 @@ def api_emprestimos_lista():
                 emp['data_retirada'] = emp['data_retirada'].isoformat()
             if emp['data_devolucao']:
                  emp['data_devolucao'] = emp['data_devolucao'].isoformat()
+            # Só a URL: a imagem é buscada quando o detalhe do empréstimo é aberto
+            emp['assinatura'] = url_assinatura(emp['assinatura_hash'])
         
         return jsonify({'success': True, 'data': emprestimos})
 
@@ -2627,15 +3240,22 @@ def criar_emprestimo():
         if not device:
             return jsonify({'success': False, 'message': 'Device não encontrado ou não disponível para empréstimo!'})
         
+        # Empréstimo novo entra como Ativo (não conta em concluidos); só o device muda de contagem
+        delta = DeltaContadores(conn)
+        delta.observar_frota(device_ids=[device_id])
+        
         # Criar empréstimo COM ASSINATURA
         cursor.execute('''INSERT INTO emprestimos 
-                        (aluno_id, device_id, acessorios, data_retirada, data_devolucao, assinatura, status)
+                        (aluno_id, device_id, acessorios, data_retirada, data_devolucao, assinatura_hash, status)
                         VALUES (%s, %s, %s, %s, %s, %s, 'Ativo')''',
-                     (aluno_id, device_id, acessorios, data_retirada, data_devolucao, assinatura))
+                     (aluno_id, device_id, acessorios, data_retirada, data_devolucao,
+                      salvar_assinatura(conn, assinatura)))
         
         # Atualizar status do device para "Emprestado"
         cursor.execute('''UPDATE devices SET status = 'Emprestado' WHERE id = %s''', (device_id,))
         
+        delta.aplicar()
+        registrar_alteracao(conn, 'emprestimos', 'devices')
         conn.commit()
         cursor.close()
         
@@ -2665,13 +3285,18 @@ def devolver_emprestimo(emprestimo_id):
         
         if result:
             device_id = result[0]
+            delta = DeltaContadores(conn)
+            delta.observar('emprestimos', 'id = %s', (emprestimo_id,))
+            delta.observar_frota(device_ids=[device_id])
             
             # Atualizar status do empréstimo
-            cursor.execute("UPDATE emprestimos SET status = 'Finalizado' WHERE id = %s", (emprestimo_id,))
+            cursor.execute("UPDATE emprestimos SET status = 'Finalizado', atualizado_em = CURRENT_TIMESTAMP WHERE id = %s", (emprestimo_id,))
             
             # Atualizar status do device para "Disponível"
             cursor.execute("UPDATE devices SET status = 'Disponível' WHERE id = %s", (device_id,))
             
+            delta.aplicar()
+            registrar_alteracao(conn, 'emprestimos', 'devices')
             conn.commit()
             cursor.close()
             
@@ -2715,9 +3340,10 @@ def adicionar_assinatura():
             return jsonify({'success': False, 'message': 'Empréstimo não encontrado!'})
         
         # Atualizar a assinatura no empréstimo
-        cursor.execute('''UPDATE emprestimos SET assinatura = %s WHERE id = %s''',
-                     (assinatura, emprestimo_id))
+        cursor.execute('''UPDATE emprestimos SET assinatura_hash = %s, atualizado_em = CURRENT_TIMESTAMP WHERE id = %s''',
+                     (salvar_assinatura(conn, assinatura), emprestimo_id))
         
+        registrar_alteracao(conn, 'emprestimos')
         conn.commit()
         cursor.close()
         
@@ -2731,6 +3357,28 @@ def adicionar_assinatura():
         if conn:
             conn.close()
 
+@app.route('/api/assinaturas/<hash_assinatura>', methods=['GET'])
+@login_required
+def obter_assinatura(hash_assinatura):
+    """Imagem da assinatura pelo hash do conteúdo (referenciada por emprestimos.assinatura_hash)."""
+    if not hash_valido(hash_assinatura):
+        return jsonify({'success': False, 'message': 'Assinatura não encontrada!'}), 404
+    if hash_assinatura in request.if_none_match:
+        return Response(status=304, headers={'ETag': f'"{hash_assinatura}"'})
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'success': False, 'message': 'Erro de conexão com o banco!'}), 500
+    try:
+        assinatura = buscar_assinatura(conn, hash_assinatura)
+    finally:
+        conn.close()
+    if assinatura is None:
+        return jsonify({'success': False, 'message': 'Assinatura não encontrada!'}), 404
+    
+    mimetype, conteudo = assinatura
+    return send_file(io.BytesIO(conteudo), mimetype=mimetype, etag=hash_assinatura)
+
 # =============================================================================
 # ROTA PARA EDITAR EMPRÉSTIMO
 # =============================================================================
@@ -2764,10 +3412,14 @@ def editar_emprestimo(emprestimo_id):
         new_status = data.get('status', emp['status'])
         
         cursor2 = conn.cursor()
+        delta = DeltaContadores(conn)
+        delta.observar('emprestimos', 'id = %s', (emprestimo_id,))
+        delta.observar_frota(device_ids=[old_device_id, new_device_id])
         
         cursor2.execute('''UPDATE emprestimos 
                         SET aluno_id = %s, device_id = %s, acessorios = %s, 
-                            data_retirada = %s, data_devolucao = %s, status = %s 
+                            data_retirada = %s, data_devolucao = %s, status = %s,
+                            atualizado_em = CURRENT_TIMESTAMP
                         WHERE id = %s''',
                      (new_aluno_id, new_device_id, new_acessorios,
                       new_data_retirada, new_data_devolucao, new_status, emprestimo_id))
@@ -2785,6 +3437,8 @@ def editar_emprestimo(emprestimo_id):
         elif new_status == 'Ativo' and old_status == 'Finalizado':
             cursor2.execute("UPDATE devices SET status = 'Em uso' WHERE id = %s", (new_device_id,))
         
+        delta.aplicar()
+        registrar_alteracao(conn, 'emprestimos', 'devices')
         conn.commit()
         cursor2.close()
         
@@ -2821,6 +3475,10 @@ def excluir_emprestimo(emprestimo_id):
         device_id = result[0]
         status_emprestimo = result[1]
         
+        delta = DeltaContadores(conn)
+        delta.observar('emprestimos', 'id = %s', (emprestimo_id,))
+        delta.observar_frota(device_ids=[device_id])
+        
         # Deletar o empréstimo
         cursor.execute('DELETE FROM emprestimos WHERE id = %s', (emprestimo_id,))
         
@@ -2828,6 +3486,8 @@ def excluir_emprestimo(emprestimo_id):
         if status_emprestimo == 'Ativo' and device_id:
             cursor.execute("UPDATE devices SET status = 'Disponível' WHERE id = %s", (device_id,))
         
+        delta.aplicar()
+        registrar_alteracao(conn, 'emprestimos', 'devices')
         conn.commit()
         cursor.close()
         
@@ -2871,6 +3531,10 @@ def delete_multiple_emprestimos():
         devices_ativos = cursor.fetchall()
         device_ids_ativos = [row[0] for row in devices_ativos if row[0]]
         
+        delta = DeltaContadores(conn)
+        delta.observar('emprestimos', f"id IN ({placeholders})", emprestimo_ids)
+        delta.observar_frota(device_ids=device_ids_ativos)
+        
         # Deletar os empréstimos
         cursor.execute(f"DELETE FROM emprestimos WHERE id IN ({placeholders})", emprestimo_ids)
         
@@ -2879,6 +3543,8 @@ def delete_multiple_emprestimos():
             device_placeholders = ','.join(['%s'] * len(device_ids_ativos))
             cursor.execute(f"UPDATE devices SET status = 'Disponível' WHERE id IN ({device_placeholders})", device_ids_ativos)
         
+        delta.aplicar()
+        registrar_alteracao(conn, 'emprestimos', 'devices')
         conn.commit()
         cursor.close()
         
@@ -2897,6 +3563,7 @@ def delete_multiple_emprestimos():
 
 @app.route('/api/admin', methods=['GET'])
 @login_required
+@response_cache.cached('admin')
 def api_admin():
     if current_user.role != 'admin':
         return jsonify({'success': False, 'message': 'Acesso não autorizado!'}), 403
@@ -3037,6 +3704,7 @@ def api_admin_users():
 
 @app.route('/admin/criar-usuario', methods=['POST'])
 @login_required
+@response_cache.invalidates('admin')
 def criar_usuario():
     if current_user.role != 'admin':
         return jsonify({'success': False, 'message': 'Acesso não autorizado!'})
@@ -3112,6 +3780,7 @@ def resetar_senha():
 
 @app.route('/admin/excluir-usuario/<int:user_id>', methods=['DELETE'])
 @login_required
+@response_cache.invalidates('admin')
 def excluir_usuario(user_id):
     if current_user.role != 'admin':
         return jsonify({'success': False, 'message': 'Acesso não autorizado!'})
@@ -3131,6 +3800,7 @@ def excluir_usuario(user_id):
         
         conn.commit()
         cursor.close()
+        user_cache.invalidate(user_id)
         
         return jsonify({'success': True, 'message': 'Usuário excluído com sucesso!'})
     
@@ -3323,6 +3993,142 @@ def delete_multiple_backups():
 # ROTAS DE IMPORTACAO (ATUALIZADAS COM OBSERVAÇÃO - MYSQL)
 # =============================================================================
 
+COLUNAS_IMPORTACAO_ALUNOS = ('nome', 'cpf', 'telefone', 'email', 'endereco', 'tem_apple_id', 'apple_id', 'tipo_aluno', 'data_inicio')
+
+def preparar_alunos_importacao(df, mapped_columns):
+    """Normaliza um bloco da planilha de alunos por coluna (sem iterrows).
+
+    Retorna (valores, regras) para importar_bloco: as colunas na ordem de
+    COLUNAS_IMPORTACAO_ALUNOS e as validações que rejeitam a linha antes de
+    ir ao banco.
+    """
+    nome = coluna_texto(df, mapped_columns.get('nome'))
+    email = coluna_texto(df, mapped_columns.get('email')).str.lower()
+
+    # Regular/Foundation sem diferenciar maiúsculas; o resto vira Foundation (padrão)
+    tipo_aluno = coluna_texto(df, mapped_columns.get('tipo_aluno')).str.capitalize()
+    tipo_aluno = tipo_aluno.where(tipo_aluno.isin(['Regular', 'Foundation']), 'Foundation')
+
+    tem_apple_id = coluna_booleana(df, mapped_columns.get('tem_apple_id'))
+    data_inicio, data_invalida = coluna_data(df, mapped_columns.get('data_inicio'), padrao=datetime.now().date())
+
+    valores = {
+        'nome': nome,
+        'cpf': coluna_texto(df, mapped_columns.get('cpf')),
+        'telefone': coluna_texto(df, mapped_columns.get('telefone')),
+        'email': email,
+        'endereco': coluna_texto(df, mapped_columns.get('endereco')),
+        'tem_apple_id': tem_apple_id,
+        'apple_id': coluna_texto(df, mapped_columns.get('apple_id')).where(tem_apple_id, None),
+        'tipo_aluno': tipo_aluno,
+        'data_inicio': data_inicio
+    }
+    regras = [
+        (nome.isna(), 'Nome não informado'),
+        (email.isna(), 'E-mail não informado'),
+        (data_invalida, 'Data de início inválida'),
+    ]
+    return valores, regras
+
+def processar_importacao_alunos(origem, filename, progresso=None, simular=False):
+    """Processa a planilha de alunos (caminho ou stream do upload); retorna o dict da resposta.
+
+    simular=True (?dry_run=1) valida tudo sem gravar nada.
+    """
+    # Ler em blocos (colunas já normalizadas); o primeiro bloco define o mapeamento
+    blocos = ler_em_blocos(origem, filename)
+    df = next(blocos)
+    
+    # MAPEAMENTO ATUALIZADO para as colunas do arquivo Foundation
+    column_mapping = {
+        'nome': ['nome', 'nome completo', 'name', 'aluno', 'student'],
+        'cpf': ['cpf', 'documento', 'document'],
+        'telefone': ['telefone', 'celular', 'phone', 'tel', 'contato'],
+        'email': ['email', 'e-mail', 'mail'],
+        'endereco': ['endereço', 'endereco', 'address', 'local', 'morada'],
+        'tipo_aluno': ['tipo_aluno', 'tipo', 'type', 'categoria', 'category'],
+        'tem_apple_id': ['tem_apple_id', 'apple_id', 'id_apple', 'has_apple_id'],
+        'apple_id': ['apple_id', 'id_apple', 'appleid'],
+        'data_inicio': ['data_inicio', 'data', 'inicio', 'start_date', 'data_início']
+    }
+    
+    # Encontrar colunas correspondentes
+    mapped_columns = {}
+    for standard_col, possible_names in column_mapping.items():
+        for possible in possible_names:
+            if possible in df.columns:
+                mapped_columns[standard_col] = possible
+                break
+    
+    # Verificar colunas obrigatórias (agora nome e email)
+    required_columns = ['nome', 'email']
+    missing_columns = [col for col in required_columns if col not in mapped_columns]
+    
+    if missing_columns:
+        return {
+            'success': False, 
+            'message': f'Colunas obrigatórias não encontradas: {", ".join(missing_columns)}'
+        }
+    
+    # Processar dados
+    conn = get_db_connection()
+    if not conn:
+        return {'success': False, 'message': 'Erro de conexão com o banco!'}
+    
+    inicio = time.perf_counter()
+    try:
+        indice = IndiceChaves(conn, 'alunos', ('email', 'cpf'))
+        delta = DeltaContadores(conn)
+        posicao_tipo = COLUNAS_IMPORTACAO_ALUNOS.index('tipo_aluno')
+        sucessos = 0
+        erros = []
+        total_linhas = 0
+        linhas_com_erro = []
+        for df in itertools.chain([df], blocos):
+            valores, regras = preparar_alunos_importacao(df, mapped_columns)
+            sucessos_bloco, erros_bloco, inseridas = importar_bloco(
+                conn, 'alunos', COLUNAS_IMPORTACAO_ALUNOS, df, valores, regras,
+                lambda v, e: (f"E-mail duplicado - {v[3]}" if 'email' in str(e) else
+                              f"CPF duplicado - {v[1]}" if 'cpf' in str(e) else
+                              "Dados duplicados"),
+                indice=indice, progresso=progresso, ja_processadas=total_linhas, simular=simular)
+            
+            # Só inserções: o delta sai dos valores gravados, sem reler a tabela
+            for _, valores_linha in inseridas:
+                delta.somar(contribuicao_aluno({'tipo_aluno': valores_linha[posicao_tipo]}))
+            
+            sucessos += sucessos_bloco
+            erros += erros_bloco
+            if simular:
+                aceitas = {numero_linha for numero_linha, _ in inseridas}
+                linhas_com_erro += [n for n in (df.index + 2).tolist() if n not in aceitas]
+            total_linhas += len(df)
+        
+        if simular:
+            conn.rollback()
+        else:
+            delta.aplicar()
+            registrar_alteracao(conn, 'alunos')
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    if simular:
+        return resultado_simulacao(sucessos, erros, total_linhas, linhas_com_erro, inicio)
+    
+    return {
+        'success': True,
+        'message': f'Importação concluída! {sucessos} alunos importados com sucesso.',
+        'detalhes': {
+            'sucessos': sucessos,
+            'erros': erros,
+            'total_linhas': total_linhas
+        }
+    }
+
 @app.route('/api/importar/alunos', methods=['POST'])
 @csrf.exempt
 @login_required
@@ -3339,135 +4145,158 @@ def importar_alunos():
             return jsonify({'success': False, 'message': 'Nenhum arquivo selecionado'})
         
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
-            # Ler arquivo baseado na extensão
-            if filename.endswith('.csv'):
-                df = pd.read_csv(filepath, encoding='utf-8')
-            else:
-                df = pd.read_excel(filepath)
-            
-            # Mapear colunas (case insensitive)
-            df.columns = [col.strip().lower() for col in df.columns]
-            
-            # MAPEAMENTO ATUALIZADO para as colunas do arquivo Foundation
-            column_mapping = {
-                'nome': ['nome', 'nome completo', 'name', 'aluno', 'student'],
-                'cpf': ['cpf', 'documento', 'document'],
-                'telefone': ['telefone', 'celular', 'phone', 'tel', 'contato'],
-                'email': ['email', 'e-mail', 'mail'],
-                'endereco': ['endereço', 'endereco', 'address', 'local', 'morada'],
-                'tipo_aluno': ['tipo_aluno', 'tipo', 'type', 'categoria', 'category'],
-                'tem_apple_id': ['tem_apple_id', 'apple_id', 'id_apple', 'has_apple_id'],
-                'apple_id': ['apple_id', 'id_apple', 'appleid'],
-                'data_inicio': ['data_inicio', 'data', 'inicio', 'start_date', 'data_início']
-            }
-            
-            # Encontrar colunas correspondentes
-            mapped_columns = {}
-            for standard_col, possible_names in column_mapping.items():
-                for possible in possible_names:
-                    if possible in df.columns:
-                        mapped_columns[standard_col] = possible
-                        break
-            
-            # Verificar colunas obrigatórias (agora nome e email)
-            required_columns = ['nome', 'email']
-            missing_columns = [col for col in required_columns if col not in mapped_columns]
-            
-            if missing_columns:
-                os.remove(filepath)
-                return jsonify({
-                    'success': False, 
-                    'message': f'Colunas obrigatórias não encontradas: {", ".join(missing_columns)}'
-                })
-            
-            # Processar dados
-            conn = get_db_connection()
-            if not conn:
-                os.remove(filepath)
-                return jsonify({'success': False, 'message': 'Erro de conexão com o banco!'})
-            
-            cursor = conn.cursor()
-            
-            sucessos = 0
-            erros = []
-            
-            for index, row in df.iterrows():
-                try:
-                    nome = str(row[mapped_columns['nome']]).strip()
-                    email = str(row[mapped_columns['email']]).strip().lower()
-                    
-                    # Novos campos
-                    cpf = str(row[mapped_columns['cpf']]).strip() if 'cpf' in mapped_columns else None
-                    telefone = str(row[mapped_columns['telefone']]).strip() if 'telefone' in mapped_columns else None
-                    endereco = str(row[mapped_columns['endereco']]).strip() if 'endereco' in mapped_columns else None
-                    
-                    # Campos existentes
-                    tipo_aluno = str(row[mapped_columns['tipo_aluno']]).strip() if 'tipo_aluno' in mapped_columns else 'Foundation'
-                    data_inicio = str(row[mapped_columns['data_inicio']]).split()[0] if 'data_inicio' in mapped_columns else datetime.now().strftime('%Y-%m-%d')
-                    
-                    # Processar tem_apple_id
-                    if 'tem_apple_id' in mapped_columns:
-                        tem_apple_id_val = row[mapped_columns['tem_apple_id']]
-                        if isinstance(tem_apple_id_val, bool):
-                            tem_apple_id = tem_apple_id_val
-                        else:
-                            tem_apple_id_str = str(tem_apple_id_val).lower().strip()
-                            tem_apple_id = tem_apple_id_str in ['sim', 'yes', 'true', '1', 's', 'y']
-                    else:
-                        tem_apple_id = False
-                    
-                    # Processar apple_id
-                    apple_id = None
-                    if tem_apple_id and 'apple_id' in mapped_columns:
-                        apple_id = str(row[mapped_columns['apple_id']]).strip()
-                    
-                    # Validar tipo de aluno
-                    if tipo_aluno not in ['Regular', 'Foundation']:
-                        tipo_aluno = 'Foundation'  # Default para Foundation
-                    
-                    # Inserir no banco COM NOVOS CAMPOS
-                    cursor.execute('''INSERT INTO alunos 
-                                    (nome, cpf, telefone, email, endereco, tem_apple_id, apple_id, tipo_aluno, data_inicio)
-                                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)''',
-                                 (nome, cpf, telefone, email, endereco, tem_apple_id, apple_id, tipo_aluno, data_inicio))
-                    
-                    sucessos += 1
-                    
-                except IntegrityError as e:
-                    if 'email' in str(e):
-                        erros.append(f"Linha {index + 2}: E-mail duplicado - {email}")
-                    elif 'cpf' in str(e):
-                        erros.append(f"Linha {index + 2}: CPF duplicado - {cpf}")
-                    else:
-                        erros.append(f"Linha {index + 2}: Dados duplicados")
-                except Exception as e:
-                    erros.append(f"Linha {index + 2}: {str(e)}")
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
-            os.remove(filepath)
-            
-            return jsonify({
-                'success': True,
-                'message': f'Importação concluída! {sucessos} alunos importados com sucesso.',
-                'detalhes': {
-                    'sucessos': sucessos,
-                    'erros': erros,
-                    'total_linhas': len(df)
-                }
-            })
-        
+            return executar_importacao('alunos', processar_importacao_alunos, file)
         else:
             return jsonify({'success': False, 'message': 'Tipo de arquivo não permitido'})
     
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro na importação: {str(e)}'})
 
+COLUNAS_IMPORTACAO_DEVICES = ('tipo', 'modelo', 'cor', 'polegadas', 'ano', 'nome', 'chip', 'memoria',
+                              'numero_serie', 'versao_os', 'status', 'para_emprestimo', 'observacao')
+
+def processar_importacao_devices(origem, filename, progresso=None, simular=False):
+    """Processa a planilha de devices (caminho ou stream do upload); retorna o dict da resposta.
+
+    simular=True (?dry_run=1) valida tudo sem gravar nada.
+    """
+    # Ler em blocos (colunas já normalizadas); o primeiro bloco define o mapeamento
+    blocos = ler_em_blocos(origem, filename)
+    df = next(blocos)
+    
+    # Mapeamento de colunas esperadas ATUALIZADO com observacao
+    column_mapping = {
+        'tipo': ['tipo', 'type', 'categoria', 'category'],
+        'modelo': ['modelo', 'model', 'device'],
+        'numero_serie': ['numero_serie', 'serial', 'serial_number', 'n_serie'],
+        'nome': ['nome', 'name', 'identificacao'],
+        'cor': ['cor', 'color', 'colour'],
+        'status': ['status', 'situacao', 'condition'],
+        'para_emprestimo': ['para_emprestimo', 'emprestimo', 'loan', 'disponivel'],
+        'observacao': ['observacao', 'observação', 'obs', 'notes', 'notas']  # Novo campo
+    }
+    
+    # Colunas opcionais
+    optional_columns = {
+        'polegadas': ['polegadas', 'tamanho', 'size'],
+        'ano': ['ano', 'year', 'fabricacao'],
+        'chip': ['chip', 'processador', 'processor'],
+        'memoria': ['memoria', 'memory', 'ram'],
+        'versao_os': ['versao_os', 'os', 'sistema', 'version']
+    }
+    
+    # Encontrar colunas correspondentes
+    mapped_columns = {}
+    for standard_col, possible_names in column_mapping.items():
+        for possible in possible_names:
+            if possible in df.columns:
+                mapped_columns[standard_col] = possible
+                break
+    
+    # Verificar colunas obrigatórias
+    required_columns = ['tipo', 'numero_serie']
+    missing_columns = [col for col in required_columns if col not in mapped_columns]
+    
+    if missing_columns:
+        return {
+            'success': False, 
+            'message': f'Colunas obrigatórias não encontradas: {", ".join(missing_columns)}'
+        }
+    
+    # Mapear colunas opcionais
+    for standard_col, possible_names in optional_columns.items():
+        for possible in possible_names:
+            if possible in df.columns:
+                mapped_columns[standard_col] = possible
+                break
+    
+    # Processar dados
+    conn = get_db_connection()
+    if not conn:
+        return {'success': False, 'message': 'Erro de conexão com o banco!'}
+    
+    inicio = time.perf_counter()
+    try:
+        indice = IndiceChaves(conn, 'devices', ('numero_serie',))
+        delta = DeltaContadores(conn)
+        sucessos = 0
+        erros = []
+        total_linhas = 0
+        linhas_com_erro = []
+        for df in itertools.chain([df], blocos):
+            tipo = coluna_texto(df, mapped_columns['tipo'])
+            numero_serie = coluna_texto(df, mapped_columns['numero_serie'])
+            status = coluna_texto(df, mapped_columns.get('status'), 'Disponível')
+    
+            # Validar tipo e status
+            tipos_validos = ['Macbook', 'Mac Mini', 'iPad', 'iPhone', 'Apple Watch', 'Vision Pro']
+            tipo_informado = tipo.notna()
+            tipo = tipo.where(tipo.isin(tipos_validos), 'iPad')  # Default
+            status = status.where(status.isin(['Disponível', 'Emprestado', 'Manutenção']), 'Disponível')
+    
+            # Ano: vazio vira NULL, texto que não é número é erro da linha
+            ano_texto = coluna_texto(df, mapped_columns.get('ano'))
+            ano = pd.to_numeric(ano_texto, errors='coerce')
+            ano_invalido = ano_texto.notna() & ano.isna()
+            ano = ano.map(lambda v: int(v) if pd.notna(v) else None).astype(object)
+    
+            valores = {
+                'tipo': tipo,
+                'numero_serie': numero_serie,
+                'status': status,
+                'ano': ano,
+                'para_emprestimo': coluna_booleana(df, mapped_columns.get('para_emprestimo'), True,
+                                                   verdadeiros=VALORES_VERDADEIROS + ['disponivel'])
+            }
+            for campo in ('modelo', 'cor', 'polegadas', 'nome', 'chip', 'memoria', 'versao_os', 'observacao'):
+                valores[campo] = coluna_texto(df, mapped_columns.get(campo))
+    
+            regras = [
+                (~tipo_informado, 'Tipo não informado'),
+                (numero_serie.isna(), 'Número de série não informado'),
+                (ano_invalido, 'Ano inválido'),
+            ]
+            # Equipments com o mesmo número de série deixam de contar na frota
+            if not simular:
+                delta.observar_frota(numero_serie.dropna().tolist())
+            
+            sucessos_bloco, erros_bloco, inseridas = importar_bloco(
+                conn, 'devices', COLUNAS_IMPORTACAO_DEVICES, df, valores, regras,
+                lambda v, e: f"Número de série duplicado - {v[8]}",
+                indice=indice, progresso=progresso, ja_processadas=total_linhas, simular=simular)
+            
+            sucessos += sucessos_bloco
+            erros += erros_bloco
+            if simular:
+                aceitas = {numero_linha for numero_linha, _ in inseridas}
+                linhas_com_erro += [n for n in (df.index + 2).tolist() if n not in aceitas]
+            total_linhas += len(df)
+        
+        if simular:
+            conn.rollback()
+        else:
+            delta.aplicar()
+            registrar_alteracao(conn, 'devices')
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    if simular:
+        return resultado_simulacao(sucessos, erros, total_linhas, linhas_com_erro, inicio)
+    
+    return {
+        'success': True,
+        'message': f'Importação concluída! {sucessos} devices importados com sucesso.',
+        'detalhes': {
+            'sucessos': sucessos,
+            'erros': erros,
+            'total_linhas': total_linhas
+        }
+    }
+
 @app.route('/api/importar/devices', methods=['POST'])
 @csrf.exempt
 @login_required
@@ -3484,142 +4313,7 @@ def importar_devices():
             return jsonify({'success': False, 'message': 'Nenhum arquivo selecionado'})
         
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
-            # Ler arquivo baseado na extensão
-            if filename.endswith('.csv'):
-                df = pd.read_csv(filepath, encoding='utf-8')
-            else:
-                df = pd.read_excel(filepath)
-            
-            # Mapear colunas (case insensitive)
-            df.columns = [col.strip().lower() for col in df.columns]
-            
-            # Mapeamento de colunas esperadas ATUALIZADO com observacao
-            column_mapping = {
-                'tipo': ['tipo', 'type', 'categoria', 'category'],
-                'modelo': ['modelo', 'model', 'device'],
-                'numero_serie': ['numero_serie', 'serial', 'serial_number', 'n_serie'],
-                'nome': ['nome', 'name', 'identificacao'],
-                'cor': ['cor', 'color', 'colour'],
-                'status': ['status', 'situacao', 'condition'],
-                'para_emprestimo': ['para_emprestimo', 'emprestimo', 'loan', 'disponivel'],
-                'observacao': ['observacao', 'observação', 'obs', 'notes', 'notas']  # Novo campo
-            }
-            
-            # Colunas opcionais
-            optional_columns = {
-                'polegadas': ['polegadas', 'tamanho', 'size'],
-                'ano': ['ano', 'year', 'fabricacao'],
-                'chip': ['chip', 'processador', 'processor'],
-                'memoria': ['memoria', 'memory', 'ram'],
-                'versao_os': ['versao_os', 'os', 'sistema', 'version']
-            }
-            
-            # Encontrar colunas correspondentes
-            mapped_columns = {}
-            for standard_col, possible_names in column_mapping.items():
-                for possible in possible_names:
-                    if possible in df.columns:
-                        mapped_columns[standard_col] = possible
-                        break
-            
-            # Verificar colunas obrigatórias
-            required_columns = ['tipo', 'numero_serie']
-            missing_columns = [col for col in required_columns if col not in mapped_columns]
-            
-            if missing_columns:
-                os.remove(filepath)
-                return jsonify({
-                    'success': False, 
-                    'message': f'Colunas obrigatórias não encontradas: {", ".join(missing_columns)}'
-                })
-            
-            # Mapear colunas opcionais
-            for standard_col, possible_names in optional_columns.items():
-                for possible in possible_names:
-                    if possible in df.columns:
-                        mapped_columns[standard_col] = possible
-                        break
-            
-            # Processar dados
-            conn = get_db_connection()
-            if not conn:
-                os.remove(filepath)
-                return jsonify({'success': False, 'message': 'Erro de conexão com o banco!'})
-            
-            cursor = conn.cursor()
-            
-            sucessos = 0
-            erros = []
-            
-            for index, row in df.iterrows():
-                try:
-                    tipo = str(row[mapped_columns['tipo']]).strip()
-                    numero_serie = str(row[mapped_columns['numero_serie']]).strip()
-                    
-                    # Valores padrão
-                    modelo = str(row[mapped_columns['modelo']]).strip() if 'modelo' in mapped_columns else None
-                    nome = str(row[mapped_columns['nome']]).strip() if 'nome' in mapped_columns else None
-                    cor = str(row[mapped_columns['cor']]).strip() if 'cor' in mapped_columns else None
-                    status = str(row[mapped_columns['status']]).strip() if 'status' in mapped_columns else 'Disponível'
-                    polegadas = str(row[mapped_columns['polegadas']]).strip() if 'polegadas' in mapped_columns else None
-                    ano = int(row[mapped_columns['ano']]) if 'ano' in mapped_columns and pd.notna(row[mapped_columns['ano']]) else None
-                    chip = str(row[mapped_columns['chip']]).strip() if 'chip' in mapped_columns else None
-                    memoria = str(row[mapped_columns['memoria']]).strip() if 'memoria' in mapped_columns else None
-                    versao_os = str(row[mapped_columns['versao_os']]).strip() if 'versao_os' in mapped_columns else None
-                    observacao = str(row[mapped_columns['observacao']]).strip() if 'observacao' in mapped_columns else None  # Novo campo
-                    
-                    # Processar para_emprestimo
-                    if 'para_emprestimo' in mapped_columns:
-                        para_emprestimo_val = row[mapped_columns['para_emprestimo']]
-                        if isinstance(para_emprestimo_val, bool):
-                            para_emprestimo = para_emprestimo_val
-                        else:
-                            para_emprestimo_str = str(para_emprestimo_val).lower().strip()
-                            para_emprestimo = para_emprestimo_str in ['sim', 'yes', 'true', '1', 's', 'y', 'disponivel']
-                    else:
-                        para_emprestimo = True
-                    
-                    # Validar status
-                    if status not in ['Disponível', 'Emprestado', 'Manutenção']:
-                        status = 'Disponível'
-                    
-                    # Validar tipo
-                    tipos_validos = ['Macbook', 'Mac Mini', 'iPad', 'iPhone', 'Apple Watch', 'Vision Pro']
-                    if tipo not in tipos_validos:
-                        tipo = 'iPad'  # Default
-                    
-                    # Inserir no banco COM OBSERVAÇÃO
-                    cursor.execute('''INSERT INTO devices 
-                                    (tipo, modelo, cor, polegadas, ano, nome, chip, memoria, numero_serie, versao_os, status, para_emprestimo, observacao)
-                                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
-                                 (tipo, modelo, cor, polegadas, ano, nome, chip, memoria, numero_serie, versao_os, status, para_emprestimo, observacao))
-                    
-                    sucessos += 1
-                    
-                except IntegrityError:
-                    erros.append(f"Linha {index + 2}: Número de série duplicado - {numero_serie}")
-                except Exception as e:
-                    erros.append(f"Linha {index + 2}: {str(e)}")
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
-            os.remove(filepath)
-            
-            return jsonify({
-                'success': True,
-                'message': f'Importação concluída! {sucessos} devices importados com sucesso.',
-                'detalhes': {
-                    'sucessos': sucessos,
-                    'erros': erros,
-                    'total_linhas': len(df)
-                }
-            })
-        
+            return executar_importacao('devices', processar_importacao_devices, file)
         else:
             return jsonify({'success': False, 'message': 'Tipo de arquivo não permitido'})
     
@@ -3708,8 +4402,9 @@ def export_data(entity):
                         ano AS Ano, nome AS Nome, chip AS Chip, memoria AS Memoria, 
                         numero_serie AS NumeroSerie, versao_os AS VersaoOS, status AS Status, 
                         para_emprestimo AS ParaEmprestimo, observacao AS Observacao
-                        FROM devices WHERE para_emprestimo = 1 ORDER BY tipo, nome''',
+                        FROM devices WHERE para_emprestimo = TRUE ORDER BY tipo, nome''',
             'filename': 'devices_export',
+            'tabelas': ['devices'],
             'requires_admin': False,
             'bool_columns': ['ParaEmprestimo']
         },
@@ -3719,6 +4414,7 @@ def export_data(entity):
                         local AS Local, convenio AS Convenio, observacao AS Observacao, data_cadastro AS DataCadastro
                         FROM equipment_control ORDER BY data_cadastro DESC''',
             'filename': 'equipment_control_export',
+            'tabelas': ['equipment_control'],
             'requires_admin': True,
             'bool_columns': ['ParaEmprestimo']
         },
@@ -3727,8 +4423,82 @@ def export_data(entity):
                         local AS Local, etiquetado AS Etiquetado, data_cadastro AS DataCadastro
                         FROM inventory ORDER BY data_cadastro DESC''',
             'filename': 'inventory_export',
+            'tabelas': ['inventory'],
             'requires_admin': True,
             'bool_columns': ['Etiquetado']
+        },
+        'alunos': {
+            'query': '''SELECT id AS Id, nome AS Nome, cpf AS CPF, telefone AS Telefone, email AS Email,
+                        endereco AS Endereco, tem_apple_id AS TemAppleId, apple_id AS AppleId,
+                        tipo_aluno AS TipoAluno, data_inicio AS DataInicio
+                        FROM alunos ORDER BY nome, id''',
+            'filename': 'alunos_export',
+            'tabelas': ['alunos'],
+            'requires_admin': True,
+            'bool_columns': ['TemAppleId']
+        },
+        'emprestimos': {
+            # Sem a coluna assinatura: a imagem em base64 não serve para análise
+            'query': '''SELECT e.id AS Id, e.aluno_id AS AlunoId, a.nome AS Aluno, e.device_id AS DeviceId,
+                        d.tipo AS TipoDevice, d.nome AS Device, d.numero_serie AS NumeroSerie,
+                        e.acessorios AS Acessorios, e.data_retirada AS DataRetirada,
+                        e.data_devolucao AS DataDevolucao, e.status AS Status
+                        FROM emprestimos e
+                        LEFT JOIN alunos a ON e.aluno_id = a.id
+                        LEFT JOIN devices d ON e.device_id = d.id
+                        ORDER BY e.id''',
+            'filename': 'emprestimos_export',
+            'tabelas': ['emprestimos', 'alunos', 'devices'],
+            'requires_admin': True,
+            'bool_columns': []
+        },
+        'emprestimos_livros': {
+            'query': '''SELECT el.id AS Id, el.aluno_id AS AlunoId, a.nome AS Aluno, el.exemplar_id AS ExemplarId,
+                        ex.codigo_barras AS CodigoBarras, l.titulo AS Livro, el.professor_id AS ProfessorId,
+                        el.data_retirada AS DataRetirada, el.data_previsao_devolucao AS DataPrevisaoDevolucao,
+                        el.data_devolucao_real AS DataDevolucaoReal, el.status AS Status,
+                        el.renovacoes AS Renovacoes, el.observacao AS Observacao
+                        FROM emprestimos_livros el
+                        LEFT JOIN alunos a ON el.aluno_id = a.id
+                        LEFT JOIN exemplares ex ON el.exemplar_id = ex.id
+                        LEFT JOIN livros l ON ex.livro_id = l.id
+                        ORDER BY el.id''',
+            'filename': 'emprestimos_livros_export',
+            'tabelas': ['emprestimos_livros', 'alunos', 'exemplares', 'livros'],
+            'requires_admin': True,
+            'bool_columns': []
+        },
+        'livros': {
+            'query': '''SELECT id AS Id, titulo AS Titulo, autor AS Autor, isbn AS ISBN, categoria AS Categoria,
+                        ano AS Ano, editora AS Editora, edicao AS Edicao, tags AS Tags,
+                        data_cadastro AS DataCadastro
+                        FROM livros ORDER BY id''',
+            'filename': 'livros_export',
+            'tabelas': ['livros'],
+            'requires_admin': False,
+            'bool_columns': []
+        },
+        'exemplares': {
+            'query': '''SELECT ex.id AS Id, ex.livro_id AS LivroId, l.titulo AS Livro, ex.codigo_barras AS CodigoBarras,
+                        ex.status AS Status, ex.localizacao AS Localizacao, ex.observacao AS Observacao,
+                        ex.data_aquisicao AS DataAquisicao
+                        FROM exemplares ex
+                        LEFT JOIN livros l ON ex.livro_id = l.id
+                        ORDER BY ex.id''',
+            'filename': 'exemplares_export',
+            'tabelas': ['exemplares', 'livros'],
+            'requires_admin': False,
+            'bool_columns': []
+        },
+        'eventos': {
+            'query': '''SELECT id AS Id, titulo AS Titulo, descricao AS Descricao, data_inicio AS DataInicio,
+                        data_fim AS DataFim, local AS Local, tipo AS Tipo, participantes AS Participantes,
+                        criado_por AS CriadoPor, sincronizado AS Sincronizado, data_criacao AS DataCriacao
+                        FROM eventos ORDER BY data_inicio, id''',
+            'filename': 'eventos_export',
+            'tabelas': ['eventos'],
+            'requires_admin': False,
+            'bool_columns': ['Sincronizado']
         }
     }
     
@@ -3739,40 +4509,85 @@ def export_data(entity):
     if config['requires_admin'] and current_user.role != 'admin':
         return jsonify({'success': False, 'message': 'Acesso não autorizado!'}), 403
     
+    formato = request.args.get('format', 'xlsx').lower()
+    if formato not in MIMETYPES:
+        return jsonify({'success': False, 'message': 'Formato inválido! Use xlsx, csv, csv.gz ou parquet.'}), 400
+    
     conn = get_db_connection()
     if not conn:
         return jsonify({'success': False, 'message': 'Erro de conexão com o banco!'}), 500
     
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = f"{config['filename']}_{timestamp}.{formato}"
+    
     try:
-        cursor = get_db_cursor(conn)
-        cursor.execute(config['query'])
-        rows = cursor.fetchall()
-        cursor.close()
-        
-        df = pd.DataFrame(rows)
-        for col in config.get('bool_columns', []):
-            if col in df.columns:
-                df[col] = df[col].apply(lambda val: 'Sim' if bool(val) else 'Não')
-        
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Dados', index=False)
+        # Versões lidas antes dos dados (ver export_cache.py); a chave também é o ETag
+        etag = ExportCache.etag(entity_key, formato, ler_versoes_tabelas(conn, config['tabelas']))
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        
+        cached = export_cache.buscar(etag, formato)
+        if cached:
+            return send_file(
+                cached,
+                as_attachment=True,
+                download_name=filename,
+                mimetype=MIMETYPES[formato],
+                etag=etag,
+                last_modified=os.fstat(cached.fileno()).st_mtime
+            )
         
-        output.seek(0)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{config['filename']}_{timestamp}.xlsx"
+        # No Parquet os booleanos seguem nativos; Sim/Não é só para planilhas
+        bool_columns = [] if formato == 'parquet' else config.get('bool_columns', [])
+        colunas, lotes = consultar_em_lotes(conn, config['query'], bool_columns=bool_columns)
+        
+        if formato in FORMATOS_STREAMING:
+            gerador = gerar_csv_gzip if formato == 'csv.gz' else gerar_csv
+            pedacos = gerador(colunas, lotes)
+            if export_cache.enabled:
+                pedacos = export_cache.gravar_streaming(pedacos, etag, formato)
+            # stream_with_context mantém a conexão da requisição aberta até o último lote
+            response = Response(
+                stream_with_context(pedacos),
+                mimetype=MIMETYPES[formato],
+                headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+            )
+            response.set_etag(etag)
+            response.last_modified = datetime.utcnow()
+            return response
+        
+        gerador = gerar_parquet if formato == 'parquet' else gerar_xlsx
+        if not export_cache.enabled:
+            return send_file(
+                gerador(colunas, lotes),
+                as_attachment=True,
+                download_name=filename,
+                mimetype=MIMETYPES[formato],
+                etag=etag
+            )
         
+        arquivo, tmp_path = export_cache.novo_arquivo()
+        try:
+            gerador(colunas, lotes, destino=arquivo)
+            publicado = export_cache.concluir(arquivo, tmp_path, etag, formato)
+        except Exception:
+            export_cache.descartar(arquivo, tmp_path)
+            raise
         return send_file(
-            output,
+            publicado,
             as_attachment=True,
             download_name=filename,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            mimetype=MIMETYPES[formato],
+            etag=etag,
+            last_modified=os.fstat(publicado.fileno()).st_mtime
         )
     except Exception as e:
+        conn.rollback()
         return jsonify({'success': False, 'message': f'Erro ao exportar dados: {str(e)}'}), 500
     finally:
-        if conn:
-            conn.close()
+        conn.close()
 
 # =============================================================================
 # API ENDPOINTS PARA DADOS (ATUALIZADOS PARA MYSQL)
@@ -3780,6 +4595,7 @@ def export_data(entity):
 
 @app.route('/api/dashboard/stats')
 @login_required
+@response_cache.cached('dashboard')
 def api_dashboard_stats():
     conn = get_db_connection()
     if not conn:
@@ -3788,63 +4604,8 @@ def api_dashboard_stats():
     try:
         cursor = get_db_cursor(conn)
         
-        # Estatísticas de alunos
-        cursor.execute("SELECT COUNT(*) as total FROM alunos")
-        total_alunos = cursor.fetchone()['total']
-        
-        cursor.execute("SELECT COUNT(*) as total FROM alunos WHERE tipo_aluno = 'Regular'")
-        alunos_regular = cursor.fetchone()['total']
-        
-        cursor.execute("SELECT COUNT(*) as total FROM alunos WHERE tipo_aluno = 'Foundation'")
-        alunos_foundation = cursor.fetchone()['total']
-        
-        # Foundation por trimestre atual (últimos 3 meses)
-        tres_meses_atras = datetime.now() - timedelta(days=90)
-        cursor.execute("SELECT COUNT(*) as total FROM alunos WHERE tipo_aluno = 'Foundation' AND data_inicio >= %s", (tres_meses_atras.date(),))
-        foundation_trimestre = cursor.fetchone()['total']
-        
-        # Foundation por ano atual
-        ano_atual = datetime.now().year
-        cursor.execute("SELECT COUNT(*) as total FROM alunos WHERE tipo_aluno = 'Foundation' AND EXTRACT(YEAR FROM data_inicio) = %s", (ano_atual,))
-        foundation_ano = cursor.fetchone()['total']
-        
-        # Estatísticas de devices - CORRIGIDAS PARA INCLUIR EQUIPMENT_CONTROL
-        # Para Empréstimo: devices com para_emprestimo=1 + equipments com status='Emprestado' e para_emprestimo=1 (que não estão em devices)
-        cursor.execute('''
-            SELECT 
-                (SELECT COUNT(*) FROM devices WHERE para_emprestimo = 1) +
-                (SELECT COUNT(*) FROM equipment_control ec
-                 LEFT JOIN devices d ON ec.numero_serie = d.numero_serie
-                 WHERE ec.status = 'Emprestado' AND ec.para_emprestimo = 1 AND d.id IS NULL)
-            as total
-        ''')
-        devices_emprestimo = cursor.fetchone()['total']
-        
-        # Emprestados: devices com status='Emprestado' + equipments com status='Emprestado' e para_emprestimo=1 (que não estão em devices)
-        cursor.execute('''
-            SELECT 
-                (SELECT COUNT(*) FROM devices WHERE status = 'Emprestado') +
-                (SELECT COUNT(*) FROM equipment_control ec
-                 LEFT JOIN devices d ON ec.numero_serie = d.numero_serie
-                 WHERE ec.status = 'Emprestado' AND ec.para_emprestimo = 1 AND d.id IS NULL)
-            as total
-        ''')
-        devices_emprestados = cursor.fetchone()['total']
-        
-        # Disponíveis: apenas devices com status='Disponível' e para_emprestimo=1
-        cursor.execute("SELECT COUNT(*) as total FROM devices WHERE status = 'Disponível' AND para_emprestimo = 1")
-        devices_disponiveis = cursor.fetchone()['total']
-        
-        # Devices em Manutenção: devices + equipments com status='Manutenção' (que não estão em devices)
-        cursor.execute('''
-            SELECT 
-                (SELECT COUNT(*) FROM devices WHERE status = 'Manutenção') +
-                (SELECT COUNT(*) FROM equipment_control ec
-                 LEFT JOIN devices d ON ec.numero_serie = d.numero_serie
-                 WHERE ec.status = 'Manutenção' AND d.id IS NULL)
-            as total
-        ''')
-        devices_manutencao = cursor.fetchone()['total']
+        # Contadores vêm de dashboard_counters (mesma fonte do /api/dashboard)
+        contadores = coletar_contadores_dashboard(cursor)
         
         # Empréstimos Recentes
         cursor.execute('''SELECT e.data_retirada, a.nome as aluno_nome, d.nome as device_nome, d.tipo as device_tipo 
@@ -3883,15 +4644,15 @@ def api_dashboard_stats():
         
         return jsonify({
             'success': True,
-            'total_alunos': total_alunos,
-            'alunos_regular': alunos_regular,
-            'alunos_foundation': alunos_foundation,
-            'foundation_trimestre': foundation_trimestre,
-            'foundation_ano': foundation_ano,
-            'devices_emprestimo': devices_emprestimo,
-            'devices_emprestados': devices_emprestados,
-            'devices_disponiveis': devices_disponiveis,
-            'devices_manutencao': devices_manutencao,
+            'total_alunos': contadores['alunos']['total'],
+            'alunos_regular': contadores['alunos']['regular'],
+            'alunos_foundation': contadores['alunos']['foundation'],
+            'foundation_trimestre': contadores['alunos']['foundation_trimestre'],
+            'foundation_ano': contadores['alunos']['foundation_ano'],
+            'devices_emprestimo': contadores['devices']['total_emprestimo'],
+            'devices_emprestados': contadores['devices']['emprestados'],
+            'devices_disponiveis': contadores['devices']['disponiveis'],
+            'devices_manutencao': contadores['devices']['manutencao'],
             'emprestimos_recentes': emprestimos_recentes,
             'devices_mais_utilizados': devices_mais_utilizados
         })
@@ -3909,6 +4670,7 @@ def api_dashboard_stats():
 @app.route('/api/tipos-devices', methods=['GET', 'POST'])
 @csrf.exempt
 @login_required
+@response_cache.invalidates('admin')
 def api_tipos_devices():
     if current_user.role != 'admin':
         return jsonify({'success': False, 'message': 'Acesso não autorizado!'})
@@ -3973,6 +4735,7 @@ def api_tipos_devices():
 
 @app.route('/api/tipos-devices/<int:tipo_id>', methods=['GET', 'PUT', 'DELETE'])
 @login_required
+@response_cache.invalidates('admin')
 def api_tipo_device(tipo_id):
     if current_user.role != 'admin':
         return jsonify({'success': False, 'message': 'Acesso não autorizado!'})
@@ -4093,6 +4856,108 @@ def api_tipos_devices_lista():
 # ROTAS DE IMPORTACAO PARA TIPOS DE DEVICES (MYSQL)
 # =============================================================================
 
+COLUNAS_IMPORTACAO_TIPOS_DEVICES = ('nome', 'categoria', 'descricao', 'para_emprestimo')
+
+def processar_importacao_tipos_devices(origem, filename, progresso=None, simular=False):
+    """Processa a planilha de tipos de devices (caminho ou stream do upload); retorna o dict da resposta.
+
+    simular=True (?dry_run=1) valida tudo sem gravar nada.
+    """
+    # Ler em blocos (colunas já normalizadas); o primeiro bloco define o mapeamento
+    blocos = ler_em_blocos(origem, filename)
+    df = next(blocos)
+    
+    # Mapeamento de colunas esperadas
+    column_mapping = {
+        'nome': ['nome', 'name', 'tipo', 'type'],
+        'categoria': ['categoria', 'category', 'classe'],
+        'descricao': ['descricao', 'descrição', 'description', 'obs'],
+        'para_emprestimo': ['para_emprestimo', 'emprestimo', 'loan', 'disponivel']
+    }
+    
+    # Encontrar colunas correspondentes
+    mapped_columns = {}
+    for standard_col, possible_names in column_mapping.items():
+        for possible in possible_names:
+            if possible in df.columns:
+                mapped_columns[standard_col] = possible
+                break
+    
+    # Verificar colunas obrigatórias
+    required_columns = ['nome']
+    missing_columns = [col for col in required_columns if col not in mapped_columns]
+    
+    if missing_columns:
+        return {
+            'success': False, 
+            'message': f'Colunas obrigatórias não encontradas: {", ".join(missing_columns)}'
+        }
+    
+    # Processar dados
+    conn = get_db_connection()
+    if not conn:
+        return {'success': False, 'message': 'Erro de conexão com o banco!'}
+    
+    inicio = time.perf_counter()
+    try:
+        indice = IndiceChaves(conn, 'tipos_devices', ('nome',))
+        sucessos = 0
+        erros = []
+        total_linhas = 0
+        linhas_com_erro = []
+        for df in itertools.chain([df], blocos):
+            nome = coluna_texto(df, mapped_columns['nome'])
+    
+            # Validar categoria
+            categorias_validas = ['Smartphone', 'Tablet', 'Notebook', 'Desktop', 'Wearable', 'VR/AR', 'Acessório', 'Áudio', 'Outros']
+            categoria = coluna_texto(df, mapped_columns.get('categoria'), 'Outros')
+            categoria = categoria.where(categoria.isin(categorias_validas), 'Outros')
+    
+            valores = {
+                'nome': nome,
+                'categoria': categoria,
+                'descricao': coluna_texto(df, mapped_columns.get('descricao')),
+                'para_emprestimo': coluna_booleana(df, mapped_columns.get('para_emprestimo'), True,
+                                                   verdadeiros=VALORES_VERDADEIROS + ['disponivel'])
+            }
+            regras = [(nome.isna(), 'Nome não informado')]
+            
+            sucessos_bloco, erros_bloco, inseridas = importar_bloco(
+                conn, 'tipos_devices', COLUNAS_IMPORTACAO_TIPOS_DEVICES, df, valores, regras,
+                lambda v, e: f"Nome duplicado - {v[0]}",
+                indice=indice, progresso=progresso, ja_processadas=total_linhas, simular=simular)
+            
+            sucessos += sucessos_bloco
+            erros += erros_bloco
+            if simular:
+                aceitas = {numero_linha for numero_linha, _ in inseridas}
+                linhas_com_erro += [n for n in (df.index + 2).tolist() if n not in aceitas]
+            total_linhas += len(df)
+        
+        if simular:
+            conn.rollback()
+        else:
+            conn.commit()
+            response_cache.invalidate_after_request('admin')
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    if simular:
+        return resultado_simulacao(sucessos, erros, total_linhas, linhas_com_erro, inicio)
+    
+    return {
+        'success': True,
+        'message': f'Importação concluída! {sucessos} tipos importados com sucesso.',
+        'detalhes': {
+            'sucessos': sucessos,
+            'erros': erros,
+            'total_linhas': total_linhas
+        }
+    }
+
 @app.route('/api/importar/tipos-devices', methods=['POST'])
 @login_required
 def importar_tipos_devices():
@@ -4111,108 +4976,7 @@ def importar_tipos_devices():
             return jsonify({'success': False, 'message': 'Nenhum arquivo selecionado'})
         
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
-            # Ler arquivo baseado na extensão
-            if filename.endswith('.csv'):
-                df = pd.read_csv(filepath, encoding='utf-8')
-            else:
-                df = pd.read_excel(filepath)
-            
-            # Mapear colunas (case insensitive)
-            df.columns = [col.strip().lower() for col in df.columns]
-            
-            # Mapeamento de colunas esperadas
-            column_mapping = {
-                'nome': ['nome', 'name', 'tipo', 'type'],
-                'categoria': ['categoria', 'category', 'classe'],
-                'descricao': ['descricao', 'descrição', 'description', 'obs'],
-                'para_emprestimo': ['para_emprestimo', 'emprestimo', 'loan', 'disponivel']
-            }
-            
-            # Encontrar colunas correspondentes
-            mapped_columns = {}
-            for standard_col, possible_names in column_mapping.items():
-                for possible in possible_names:
-                    if possible in df.columns:
-                        mapped_columns[standard_col] = possible
-                        break
-            
-            # Verificar colunas obrigatórias
-            required_columns = ['nome']
-            missing_columns = [col for col in required_columns if col not in mapped_columns]
-            
-            if missing_columns:
-                os.remove(filepath)
-                return jsonify({
-                    'success': False, 
-                    'message': f'Colunas obrigatórias não encontradas: {", ".join(missing_columns)}'
-                })
-            
-            # Processar dados
-            conn = get_db_connection()
-            if not conn:
-                os.remove(filepath)
-                return jsonify({'success': False, 'message': 'Erro de conexão com o banco!'})
-            
-            cursor = conn.cursor()
-            
-            sucessos = 0
-            erros = []
-            
-            for index, row in df.iterrows():
-                try:
-                    nome = str(row[mapped_columns['nome']]).strip()
-                    
-                    # Valores padrão
-                    categoria = str(row[mapped_columns['categoria']]).strip() if 'categoria' in mapped_columns else 'Outros'
-                    descricao = str(row[mapped_columns['descricao']]).strip() if 'descricao' in mapped_columns else None
-                    
-                    # Processar para_emprestimo
-                    if 'para_emprestimo' in mapped_columns:
-                        para_emprestimo_val = row[mapped_columns['para_emprestimo']]
-                        if isinstance(para_emprestimo_val, bool):
-                            para_emprestimo = para_emprestimo_val
-                        else:
-                            para_emprestimo_str = str(para_emprestimo_val).lower().strip()
-                            para_emprestimo = para_emprestimo_str in ['sim', 'yes', 'true', '1', 's', 'y', 'disponivel']
-                    else:
-                        para_emprestimo = True
-                    
-                    # Validar categoria
-                    categorias_validas = ['Smartphone', 'Tablet', 'Notebook', 'Desktop', 'Wearable', 'VR/AR', 'Acessório', 'Áudio', 'Outros']
-                    if categoria not in categorias_validas:
-                        categoria = 'Outros'
-                    
-                    # Inserir no banco
-                    cursor.execute('''INSERT INTO tipos_devices (nome, categoria, descricao, para_emprestimo)
-                                    VALUES (%s, %s, %s, %s)''',
-                                 (nome, categoria, descricao, para_emprestimo))
-                    
-                    sucessos += 1
-                    
-                except IntegrityError:
-                    erros.append(f"Linha {index + 2}: Nome duplicado - {nome}")
-                except Exception as e:
-                    erros.append(f"Linha {index + 2}: {str(e)}")
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
-            os.remove(filepath)
-            
-            return jsonify({
-                'success': True,
-                'message': f'Importação concluída! {sucessos} tipos importados com sucesso.',
-                'detalhes': {
-                    'sucessos': sucessos,
-                    'erros': erros,
-                    'total_linhas': len(df)
-                }
-            })
-        
+            return executar_importacao('tipos_devices', processar_importacao_tipos_devices, file)
         else:
             return jsonify({'success': False, 'message': 'Tipo de arquivo não permitido'})
     
@@ -4275,7 +5039,9 @@ def emprestimos_livros_page():
         cursor = get_db_cursor(conn)
         
         # Atualizar status de empréstimos atrasados
-        cursor.execute("UPDATE emprestimos_livros SET status = 'Atrasado' WHERE status = 'Ativo' AND data_previsao_devolucao < CURDATE()")
+        cursor.execute("UPDATE emprestimos_livros SET status = 'Atrasado', atualizado_em = CURRENT_TIMESTAMP WHERE status = 'Ativo' AND data_previsao_devolucao < CURDATE()")
+        if cursor.rowcount:
+            registrar_alteracao(conn, 'emprestimos_livros')
         conn.commit()
         
         # Carregar empréstimos ativos
@@ -4310,7 +5076,9 @@ def api_listar_emprestimos_livros():
         cursor = get_db_cursor(conn)
         
         # Atualizar status de empréstimos atrasados
-        cursor.execute("UPDATE emprestimos_livros SET status = 'Atrasado' WHERE status = 'Ativo' AND data_previsao_devolucao < CURRENT_DATE")
+        cursor.execute("UPDATE emprestimos_livros SET status = 'Atrasado', atualizado_em = CURRENT_TIMESTAMP WHERE status = 'Ativo' AND data_previsao_devolucao < CURRENT_DATE")
+        if cursor.rowcount:
+            registrar_alteracao(conn, 'emprestimos_livros')
         conn.commit()
         
         # Carregar empréstimos ativos e atrasados
@@ -4397,6 +5165,7 @@ def atualizar_perfil():
         
         conn.commit()
         cursor.close()
+        user_cache.invalidate(current_user.id)
         
         return jsonify({'success': True, 'message': 'Perfil atualizado com sucesso!'})
         
@@ -4449,9 +5218,10 @@ def criar_emprestimo_livro():
             professor_id = current_user.id if current_user.role == 'professor' else data.get('professor_id')
 
             cursor.execute('''
-                INSERT INTO emprestimos_livros (aluno_id, exemplar_id, data_retirada, data_previsao_devolucao, status, criado_por, assinatura, observacao, professor_id)
+                INSERT INTO emprestimos_livros (aluno_id, exemplar_id, data_retirada, data_previsao_devolucao, status, criado_por, assinatura_hash, observacao, professor_id)
                 VALUES (%s, %s, %s, %s, 'Ativo', %s, %s, %s, %s)
-            ''', (aluno_id, exemplar['id'], data_retirada, data_previsao, current_user.id, data.get('assinatura'), data.get('observacao'), professor_id))
+            ''', (aluno_id, exemplar['id'], data_retirada, data_previsao, current_user.id,
+                  salvar_assinatura(conn, data.get('assinatura')), data.get('observacao'), professor_id))
             
             cursor.execute("UPDATE exemplares SET status = 'Emprestado' WHERE id = %s", (exemplar['id'],))
             
@@ -4462,6 +5232,8 @@ def criar_emprestimo_livro():
             cursor.execute("SELECT titulo FROM livros WHERE id = %s", (exemplar['livro_id'],))
             livro = cursor.fetchone()
             
+            atualizar_contadores_dashboard(conn, contribuicao_emprestimo_livro({'status': 'Ativo'}))
+            registrar_alteracao(conn, 'emprestimos_livros', 'exemplares')
             conn.commit()
             
             # Enviar e-mail de notificação para o aluno
@@ -4546,14 +5318,18 @@ def devolver_livro():
         emp = cursor.fetchone()
         if not emp: return jsonify({'success': False}), 404
         
+        delta = DeltaContadores(conn)
+        delta.observar('emprestimos_livros', 'id = %s', (emprestimo_id,))
         cursor.execute('''
             UPDATE emprestimos_livros 
-            SET status = 'Finalizado', data_devolucao_real = NOW() 
+            SET status = 'Finalizado', data_devolucao_real = NOW(), atualizado_em = CURRENT_TIMESTAMP
             WHERE id = %s
         ''', (emprestimo_id,))
         
         cursor.execute('UPDATE exemplares SET status = "Disponível" WHERE id = %s', (emp['exemplar_id'],))
         
+        delta.aplicar()
+        registrar_alteracao(conn, 'emprestimos_livros', 'exemplares')
         conn.commit()
         return jsonify({'success': True, 'message': 'Devolução realizada!'})
         
@@ -4693,6 +5469,7 @@ def listar_eventos():
 @app.route('/api/eventos', methods=['POST'])
 @csrf.exempt
 @login_required
+@response_cache.invalidates('eventos', 'dashboard')
 def criar_evento():
     """Criar novo evento"""
     conn = get_db_connection()
@@ -4730,6 +5507,7 @@ def criar_evento():
             current_user.id
         ))
         
+        registrar_alteracao(conn, 'eventos')
         if os.getenv('DB_TYPE') == 'postgres':
              evento_id = cursor.fetchone()['id']
              conn.commit()
@@ -4796,6 +5574,7 @@ def buscar_evento(evento_id):
 @app.route('/api/eventos/<int:evento_id>', methods=['PUT'])
 @csrf.exempt
 @login_required
+@response_cache.invalidates('eventos', 'dashboard')
 def atualizar_evento(evento_id):
     """Atualizar evento"""
     conn = get_db_connection()
@@ -4811,7 +5590,8 @@ def atualizar_evento(evento_id):
         cursor.execute('''
             UPDATE eventos SET 
             titulo = %s, descricao = %s, data_inicio = %s, data_fim = %s,
-            local = %s, cor = %s, tipo = %s, participantes = %s
+            local = %s, cor = %s, tipo = %s, participantes = %s,
+            atualizado_em = CURRENT_TIMESTAMP
             WHERE id = %s
         ''', (
             data.get('titulo'),
@@ -4825,6 +5605,7 @@ def atualizar_evento(evento_id):
             evento_id
         ))
         
+        registrar_alteracao(conn, 'eventos')
         conn.commit()
         cursor.close()
         
@@ -4843,6 +5624,7 @@ def atualizar_evento(evento_id):
 @app.route('/api/eventos/<int:evento_id>', methods=['DELETE'])
 @csrf.exempt
 @login_required
+@response_cache.invalidates('eventos', 'dashboard')
 def excluir_evento(evento_id):
     """Excluir evento"""
     conn = get_db_connection()
@@ -4852,6 +5634,7 @@ def excluir_evento(evento_id):
     try:
         cursor = get_db_cursor(conn)
         cursor.execute('DELETE FROM eventos WHERE id = %s', (evento_id,))
+        registrar_alteracao(conn, 'eventos')
         conn.commit()
         cursor.close()
         
@@ -4869,6 +5652,7 @@ def excluir_evento(evento_id):
 
 @app.route('/api/eventos/dashboard', methods=['GET'])
 @login_required
+@response_cache.cached('eventos')
 def eventos_dashboard():
     """Listar próximos 5 eventos para o dashboard"""
     conn = get_db_connection()
@@ -5151,6 +5935,8 @@ def api_livros():
                     INSERT INTO livros (titulo, autor, isbn, categoria, ano, editora, edicao, descricao, tags, foto_path)
                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                 ''', (titulo, autor, isbn, categoria, data.get('ano'), data.get('editora'), data.get('edicao'), data.get('descricao'), tags, foto_path))
+                atualizar_contadores_dashboard(conn, {'livros.total_livros': 1})
+                registrar_alteracao(conn, 'livros')
                 conn.commit()
                 return jsonify({'success': True, 'message': 'Livro cadastrado com sucesso!'})
             except Exception as e:
@@ -5191,6 +5977,7 @@ def api_livros():
                 WHERE id=%s
             ''', [titulo, autor, data.get('isbn'), data.get('categoria'), data.get('ano'), 
                   data.get('editora'), data.get('edicao'), data.get('descricao'), tags] + foto_params + [livro_id])
+            registrar_alteracao(conn, 'livros')
             conn.commit()
             return jsonify({'success': True, 'message': 'Livro atualizado com sucesso!'})
 
@@ -5208,7 +5995,11 @@ def api_livros():
             if result and result['count'] > 0:
                 return jsonify({'success': False, 'message': 'Não é possível excluir um livro que possui exemplares cadastrados.'}), 400
 
+            delta = DeltaContadores(conn)
+            delta.observar('livros', 'id = %s', (livro_id,))
             cursor.execute('DELETE FROM livros WHERE id = %s', (livro_id,))
+            delta.aplicar()
+            registrar_alteracao(conn, 'livros', 'exemplares')
             conn.commit()
             return jsonify({'success': True, 'message': 'Livro excluído com sucesso!'})
 
@@ -5240,6 +6031,8 @@ def api_exemplares():
                  
             cursor.execute('INSERT INTO exemplares (livro_id, codigo_barras, localizacao, observacao) VALUES (%s, %s, %s, %s)',
                          (livro_id, codigo_barras, data.get('localizacao'), data.get('observacao')))
+            atualizar_contadores_dashboard(conn, {'livros.total_exemplares': 1})
+            registrar_alteracao(conn, 'exemplares')
             conn.commit()
             return jsonify({'success': True, 'message': 'Exemplar adicionado!'})
             
@@ -5281,6 +6074,7 @@ def api_exemplares():
             valores.append(exemplar_id)
             query = f"UPDATE exemplares SET {', '.join(campos)} WHERE id = %s"
             cursor.execute(query, tuple(valores))
+            registrar_alteracao(conn, 'exemplares')
             conn.commit()
             return jsonify({'success': True, 'message': 'Exemplar atualizado!'})
 
@@ -5289,7 +6083,11 @@ def api_exemplares():
             exemplar_id = request.args.get('id')
             
             try:
+                delta = DeltaContadores(conn)
+                delta.observar('exemplares', 'id = %s', (exemplar_id,))
                 cursor.execute('DELETE FROM exemplares WHERE id = %s', (exemplar_id,))
+                delta.aplicar()
+                registrar_alteracao(conn, 'exemplares')
                 conn.commit()
                 return jsonify({'success': True, 'message': 'Exemplar removido!'})
             except mysql.connector.errors.IntegrityError:
@@ -5311,160 +6109,222 @@ def system_backup():
     if current_user.role != 'admin':
         return jsonify({'success': False, 'message': 'Acesso não autorizado!'}), 403
     
+    timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    if request.args.get('paralelo') == '1':
+        return backup_paralelo(timestamp)
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'success': False, 'message': 'Erro de conexão!'}), 500
+    
+    # Gerar nome do arquivo (?gzip=0 devolve o .sql sem compressão)
+    comprimir = request.args.get('gzip', '1') != '0'
+    extensao = '.sql' + ('.gz' if comprimir else '')
+    
+    # Streaming: cada lote de cada tabela sai assim que é lido (ver backup.py)
+    if request.args.get('incremental') == '1':
+        # Só o que mudou desde o último backup registrado (completo ou incremental)
+        base = ultimo_backup(conn)
+        if base is None:
+            return jsonify({'success': False,
+                            'message': 'Nenhum backup anterior registrado (ou houve restauração depois dele). '
+                                       'Gere um backup completo primeiro.'}), 409
+        filename = f"backup_apple_academy_{timestamp}_incremental{extensao}"
+        pedacos = gerar_incremental(conn, base, timestamp)
+    else:
+        filename = f"backup_apple_academy_{timestamp}{extensao}"
+        pedacos = gerar_dump(conn, timestamp)
+    if comprimir:
+        pedacos = comprimir_gzip(pedacos)
+    else:
+        pedacos = (pedaco.encode('utf-8') for pedaco in pedacos)
+    
+    # stream_with_context mantém a conexão da requisição aberta até a última tabela
+    return Response(
+        stream_with_context(pedacos),
+        mimetype='application/gzip' if comprimir else 'application/sql',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+def concluir_restauracao(conn):
+    """Depois de qualquer restore (sem commit): as tabelas foram reescritas por fora das rotas."""
+    recalcular_contadores_dashboard(conn)
+    registrar_alteracao(conn, 'alunos', 'devices', 'emprestimos', 'equipment_control', 'inventory',
+                        'livros', 'exemplares', 'emprestimos_livros', 'eventos')
+    # O banco voltou no tempo: nenhum backup anterior serve de base para incremental
+    limpar_historico_backup(conn)
+
+def backup_paralelo(timestamp):
+    """?paralelo=1: uma tabela por conexão no mesmo snapshot, entregue como .tar (ver backup.py).
+
+    As tabelas são gravadas em disco pelos workers e o .tar só sai no fim,
+    então o download começa depois do dump (diferente do .sql.gz em streaming).
+    """
+    diretorio = tempfile.mkdtemp(prefix='backup_paralelo_')
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'success': False, 'message': 'Erro de conexão!'}), 500
-        
-        # Gerar nome do arquivo
-        timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-        filename = f"backup_apple_academy_{timestamp}.sql"
-        
-        output = io.StringIO()
-        output.write(f"-- Backup Apple Academy Manager\n")
-        output.write(f"-- Data: {timestamp}\n\n")
-        
-        if os.getenv('DB_TYPE') == 'postgres':
-             cursor = conn.cursor()
-             
-             # Listar tabelas
-             cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'")
-             tables = [row[0] for row in cursor.fetchall()]
-             
-             for table in tables:
-                output.write(f"\n-- Tabela: {table}\n")
-                output.write(f"TRUNCATE TABLE {table} CASCADE;\n")
-                
-                cursor.execute(f"SELECT * FROM {table}")
-                rows = cursor.fetchall()
-                
-                if rows:
-                    # Obter nomes das colunas
-                    col_names = [desc[0] for desc in cursor.description]
-                    cols_str = ', '.join(col_names)
-                    
-                    for row in rows:
-                        vals = []
-                        for val in row:
-                            if val is None:
-                                vals.append('NULL')
-                            elif isinstance(val, (int, float)):
-                                vals.append(str(val))
-                            elif isinstance(val, bool):
-                                vals.append('TRUE' if val else 'FALSE')
-                            else:
-                                # Escape simple single quotes
-                                val_str = str(val).replace("'", "''")
-                                vals.append(f"'{val_str}'")
-                        
-                        vals_str = ', '.join(vals)
-                        output.write(f"INSERT INTO {table} ({cols_str}) VALUES ({vals_str});\n")
-
-             cursor.close()
-             
-        else: # MySQL Fallback (embora estejamos usando Postgres agora)
-             pass 
+        dump_paralelo(get_worker_connection, diretorio, cabecalho=timestamp)
+        arquivo = tempfile.TemporaryFile()
+        empacotar_tar(diretorio, arquivo)
+        arquivo.seek(0)
+    except Exception as e:
+        app.logger.error(f"Erro no backup paralelo: {e}")
+        return jsonify({'success': False, 'message': f'Erro no backup: {str(e)}'}), 500
+    finally:
+        shutil.rmtree(diretorio, ignore_errors=True)
+    
+    return send_file(arquivo, mimetype='application/x-tar', as_attachment=True,
+                     download_name=f"backup_apple_academy_{timestamp}.tar")
+
+def processar_restauracao_paralela(origem, filename, progresso=None, simular=False):
+    """Restaura um backup paralelo (.tar): tabelas em paralelo, por nível de chave estrangeira.
 
+    Não é uma transação só: cada tabela é confirmada ao terminar de carregar
+    e, se uma falhar, os níveis seguintes não são carregados.
+    """
+    if simular:
+        return {'success': False, 'message': 'Validação (dry_run) só está disponível para backups .sql/.sql.gz.'}
+    
+    conn = get_db_connection()
+    if not conn:
+        return {'success': False, 'message': 'Erro de conexão!'}
+    # Encerra a transação da requisição (ex.: leitura do load_user): o TRUNCATE
+    # das conexões do restore ficaria esperando pelo lock dela
+    conn.rollback()
+    
+    inicio = time.perf_counter()
+    diretorio = tempfile.mkdtemp(prefix='restore_paralelo_')
+    try:
+        bruto = open(origem, 'rb') if isinstance(origem, str) else origem
+        try:
+            extrair_tar(bruto, diretorio)
+        finally:
+            if bruto is not origem:
+                bruto.close()
+        resultado = restaurar_paralelo(get_worker_connection, diretorio, progresso=progresso)
+    except ValueError as e:
         conn.close()
-        
-        # Preparar download
-        mem_file = io.BytesIO()
-        mem_file.write(output.getvalue().encode('utf-8'))
-        mem_file.seek(0)
-        
-        return send_file(
-            mem_file,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='application/sql'
-        )
+        return {'success': False, 'message': f'Backup inválido, nada foi alterado. {e}'}
+    except Exception:
+        conn.close()
+        raise
+    finally:
+        shutil.rmtree(diretorio, ignore_errors=True)
+    
+    # Mesmo com erro parcial as tabelas mudaram: recalcula contadores e versões
+    try:
+        concluir_restauracao(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    export_cache.clear()
+    
+    resultado['total_linhas'] = resultado['comandos'] + resultado['linhas_copy']
+    resultado['tempo_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+    if resultado['erros']:
+        falhas = '; '.join(f"{tabela}: {erro}" for tabela, erro in resultado['erros'].items())
+        return {
+            'success': False,
+            'message': f'Restauração parcial: {resultado["tabelas"]} tabela(s) carregada(s), '
+                       f'falha em {falhas}. Tabelas dependentes não foram carregadas.',
+            'detalhes': resultado
+        }
+    return {
+        'success': True,
+        'message': f'Restauração concluída. Tabelas: {resultado["tabelas"]}. '
+                   f'Comandos executados: {resultado["comandos"]}. '
+                   f'Linhas carregadas via COPY: {resultado["linhas_copy"]}. Recarregue a página.',
+        'detalhes': resultado
+    }
 
-    except Exception as e:
-        return jsonify({'success': False, 'message': f'Erro ao gerar backup: {str(e)}'}), 500
+def processar_restauracao(origem, filename, progresso=None, simular=False):
+    """Aplica o backup (caminho ou stream do upload, .sql ou .sql.gz) numa transação só.
+
+    Qualquer erro desfaz tudo e o banco fica como estava (ver Restauracao em backup.py).
+    simular=True (?dry_run=1) executa o arquivo inteiro e desfaz no final.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return {'success': False, 'message': 'Erro de conexão!'}
+    
+    inicio = time.perf_counter()
+    restauracao = Restauracao(conn, progresso=progresso)
+    arquivo = abrir_arquivo_sql(origem, filename)
+    try:
+        restauracao.aplicar(arquivo)
+        if simular:
+            conn.rollback()
+            return {
+                'success': True,
+                'dry_run': True,
+                'message': f'Validação concluída! {restauracao.comandos} comando(s) e '
+                           f'{restauracao.linhas_copy} linha(s) de COPY aplicados e desfeitos. Nada foi alterado.',
+                'detalhes': {'comandos': restauracao.comandos, 'linhas_copy': restauracao.linhas_copy,
+                             'total_linhas': restauracao.comandos + restauracao.linhas_copy,
+                             'tempo_ms': round((time.perf_counter() - inicio) * 1000, 1)}
+            }
+        # O restore reescreve as tabelas por fora das rotas: recalcula tudo
+        concluir_restauracao(conn)
+        conn.commit()
+    except ErroRestauracao as e:
+        conn.rollback()
+        return {'success': False, 'message': f'Restauração desfeita, nada foi alterado. {e}'}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        arquivo.close()
+        conn.close()
+    export_cache.clear()
+    
+    detalhes = {
+        'comandos': restauracao.comandos,
+        'linhas_copy': restauracao.linhas_copy,
+        'ignorados': restauracao.ignorados,
+        'indices_recriados': restauracao.indices_recriados,
+        'indices_com_erro': restauracao.indices_com_erro,
+        'total_linhas': restauracao.comandos + restauracao.linhas_copy,
+        'tempo_ms': round((time.perf_counter() - inicio) * 1000, 1)
+    }
+    return {
+        'success': True,
+        'message': f'Restauração concluída. Comandos executados: {restauracao.comandos}. '
+                   f'Linhas carregadas via COPY: {restauracao.linhas_copy}. '
+                   f'Ignorados: {restauracao.ignorados}. Recarregue a página.',
+        'detalhes': detalhes
+    }
 
 @app.route('/api/system/restore', methods=['POST'])
 @csrf.exempt  # Exempt from CSRF for file upload
 @login_required
 def system_restore():
+    """Restaura um backup. Com ?async=1 vira job em segundo plano e o andamento
+    é consultado em /api/importar/jobs/<job_id>, como nas importações."""
     if current_user.role != 'admin':
         return jsonify({'success': False, 'message': 'Acesso não autorizado!'}), 403
         
-    try:
-        if 'file' not in request.files:
-            return jsonify({'success': False, 'message': 'Nenhum arquivo enviado'}), 400
-            
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'success': False, 'message': 'Nenhum arquivo selecionado'}), 400
-
-        if not file.filename.endswith('.sql'):
-             return jsonify({'success': False, 'message': 'Apenas arquivos .sql são permitidos'}), 400
-
-        # Ler conteúdo
-        content = file.read().decode('utf-8')
+    if 'file' not in request.files:
+        return jsonify({'success': False, 'message': 'Nenhum arquivo enviado'}), 400
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'success': False, 'message': 'Nenhum arquivo selecionado'}), 400
 
-        # Estratégia simples: Dividir por ; e executar
-        # Filtros de compatibilidade MySQL -> Postgres
-        statements = content.split(';')
-        
-        sucessos = 0
-        erros = 0
-        
-        for statement in statements:
-            stmt = statement.strip()
-            if not stmt: continue
-            
-            # Ignorar comentários e configurações de lock do MySQL
-            if stmt.startswith('LOCK TABLES') or stmt.startswith('UNLOCK TABLES') or stmt.startswith('/*!'):
-                continue
-                
-            # Limpeza básica de sintaxe MySQL se detectado
-            if '`' in stmt:
-                stmt = stmt.replace('`', '"') # Backticks para quotes
-            
-            if 'ENGINE=InnoDB' in stmt:
-                # Remover definições de engine do MySQL no create table
-                stmt = re.sub(r'ENGINE=\w+\s*', '', stmt)
-                stmt = re.sub(r'DEFAULT CHARSET=\w+\s*', '', stmt)
-                stmt = re.sub(r'COLLATE=\w+\s*', '', stmt)
-                
-            if 'int NOT NULL AUTO_INCREMENT' in stmt:
-                 # Converter auto_increment para SERIAL (simplificado)
-                 stmt = stmt.replace('int NOT NULL AUTO_INCREMENT', 'SERIAL')
-                 
-            try:
-                cursor.execute(stmt)
-                sucessos += 1
-            except Exception as e:
-                print(f"Erro no statement: {stmt[:50]}... -> {e}")
-                erros += 1
-                # Não abortar, tentar o próximo (permissivo)
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        return jsonify({
-            'success': True, 
-            'message': f'Restauração concluída. Comandos executados: {sucessos}. Erros/Ignorados: {erros}. Recarregue a página.'
-        })
+    if not file.filename.endswith(('.sql', '.sql.gz', '.tar')):
+         return jsonify({'success': False, 'message': 'Apenas arquivos .sql, .sql.gz ou .tar (backup paralelo) são permitidos'}), 400
 
+    processador = processar_restauracao_paralela if file.filename.endswith('.tar') else processar_restauracao
+    try:
+        return executar_importacao('restore', processador, file)
     except Exception as e:
-        return jsonify({'success': False, 'message': f'Erro crítico no restore: {str(e)}'}), 500
-    finally:
-         if 'conn' in locals() and conn: conn.close()
-
-# if __name__ == '__main__':
-#     app.run(host='0.0.0.0', port=5001, debug=True)
-# Admin User Management Routes
-from werkzeug.security import generate_password_hash
+        return jsonify({'success': False, 'message': f'Erro na restauração: {str(e)}'}), 500
 
 @app.route('/api/admin/users', methods=['POST'])
 @csrf.exempt
 @login_required
+@response_cache.invalidates('admin')
 def api_create_user():
     """Create new user"""
     if current_user.role != 'admin':
@@ -5516,6 +6376,7 @@ def api_create_user():
 @app.route('/api/admin/users/<int:user_id>', methods=['PUT'])
 @csrf.exempt
 @login_required
+@response_cache.invalidates('admin')
 def api_update_user(user_id):
     """Update existing user"""
     if current_user.role != 'admin':
@@ -5560,6 +6421,7 @@ def api_update_user(user_id):
         
         conn.commit()
         cursor.close()
+        user_cache.invalidate(user_id)
         
         return jsonify({'success': True, 'message': 'Usuário atualizado com sucesso!'})
         
@@ -5573,6 +6435,7 @@ def api_update_user(user_id):
 @app.route('/api/admin/users/<int:user_id>', methods=['DELETE'])
 @csrf.exempt
 @login_required
+@response_cache.invalidates('admin')
 def api_delete_user(user_id):
     """Delete user"""
     if current_user.role != 'admin':
@@ -5591,6 +6454,7 @@ def api_delete_user(user_id):
         cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
         conn.commit()
         cursor.close()
+        user_cache.invalidate(user_id)
         
         return jsonify({'success': True, 'message': 'Usuário excluído com sucesso!'})
         
@@ -5606,6 +6470,7 @@ def api_delete_user(user_id):
 @app.route('/api/admin/tipos-devices', methods=['POST'])
 @csrf.exempt
 @login_required
+@response_cache.invalidates('admin')
 def api_create_device_type():
     """Create new device type"""
     if current_user.role != 'admin':
@@ -5652,6 +6517,7 @@ def api_create_device_type():
 @app.route('/api/admin/tipos-devices/<int:tipo_id>', methods=['PUT'])
 @csrf.exempt
 @login_required
+@response_cache.invalidates('admin')
 def api_update_device_type(tipo_id):
     """Update existing device type"""
     if current_user.role != 'admin':
@@ -5698,6 +6564,7 @@ def api_update_device_type(tipo_id):
 @app.route('/api/admin/tipos-devices/<int:tipo_id>', methods=['DELETE'])
 @csrf.exempt
 @login_required
+@response_cache.invalidates('admin')
 def api_delete_device_type(tipo_id):
     """Delete device type"""
     if current_user.role != 'admin':
@@ -5764,6 +6631,7 @@ def upload_user_foto(user_id):
         )
         conn.commit()
         cursor.close()
+        user_cache.invalidate(user_id)
         
         return jsonify({
             'success': True,
@@ -0,0 +1,139 @@
+import os
+import re
+import zlib
+import base64
+import hashlib
+from urllib.parse import unquote_to_bytes
+
+# =============================================================================
+# ASSINATURAS POR CONTEÚDO (/api/assinaturas/<hash>)
+# =============================================================================
+#
+# As assinaturas chegam do canvas como data URL (data:image/png;base64,...).
+# Em vez de ficarem inteiras na linha do empréstimo, vão decodificadas para a
+# tabela assinaturas, com o sha256 do conteúdo como chave: a mesma imagem é
+# gravada uma vez só. emprestimos e emprestimos_livros guardam apenas
+# assinatura_hash, e as listagens devolvem a URL /api/assinaturas/<hash>, que
+# o navegador só busca quando a imagem é exibida (e guarda em cache: o
+# conteúdo de um hash nunca muda).
+#
+# O conteúdo vai com zlib quando isso reduz o tamanho (SVG, PNG sem
+# compressão); PNG e JPEG já comprimidos ficam como estão.
+#
+# As colunas assinatura antigas continuam no schema, mas ficam NULL:
+# migrar_assinaturas (chamada no create_tables) move o que ainda estiver nelas.
+
+TAMANHO_LOTE_MIGRACAO = 200
+_DATA_URL = re.compile(r'^data:([\w.+-]+/[\w.+-]+)?((?:;[^,;]*)*),', re.I)
+_HASH = re.compile(r'^[0-9a-f]{64}$')
+# Tipos servidos como estão; qualquer outro (ex.: text/html ou SVG com script
+# vindos de uma data URL forjada) sai como download binário
+MIMETYPES_SEGUROS = ('image/png', 'image/jpeg', 'image/gif', 'image/webp')
+
+
+def _postgres():
+    return os.getenv('DB_TYPE', 'mysql') == 'postgres'
+
+
+def hash_valido(valor):
+    return bool(valor) and bool(_HASH.match(valor))
+
+
+def url_assinatura(hash_assinatura):
+    return f"/api/assinaturas/{hash_assinatura}" if hash_assinatura else None
+
+
+def decodificar(valor):
+    """(mimetype, bytes) de uma data URL ou de base64 puro.
+
+    Texto em qualquer outro formato é guardado como está (text/plain), para
+    a migração nunca perder uma assinatura antiga.
+    """
+    encontrado = _DATA_URL.match(valor)
+    if encontrado:
+        mimetype = encontrado.group(1) or 'text/plain'
+        dados = valor[encontrado.end():]
+        if ';base64' in encontrado.group(2).lower():
+            try:
+                return mimetype, base64.b64decode(dados)
+            except ValueError:
+                pass
+        else:
+            return mimetype, unquote_to_bytes(dados)
+    try:
+        return 'image/png', base64.b64decode(valor, validate=True)
+    except ValueError:
+        return 'text/plain', valor.encode('utf-8')
+
+
+def salvar_assinatura(conn, valor):
+    """Grava a assinatura (se o conteúdo ainda não existir) e retorna o hash; None se vazia.
+
+    Não faz commit: entra na transação do empréstimo.
+    """
+    if not valor:
+        return None
+    mimetype, conteudo = decodificar(valor)
+    hash_assinatura = hashlib.sha256(conteudo).hexdigest()
+    comprimido = zlib.compress(conteudo, 6)
+    compressao = 'zlib' if len(comprimido) < len(conteudo) else None
+    if _postgres():
+        sql = '''INSERT INTO assinaturas (hash, mimetype, compressao, tamanho, conteudo)
+                 VALUES (%s, %s, %s, %s, %s) ON CONFLICT (hash) DO NOTHING'''
+    else:
+        sql = '''INSERT IGNORE INTO assinaturas (hash, mimetype, compressao, tamanho, conteudo)
+                 VALUES (%s, %s, %s, %s, %s)'''
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, (hash_assinatura, mimetype, compressao, len(conteudo),
+                             comprimido if compressao else conteudo))
+    finally:
+        cursor.close()
+    return hash_assinatura
+
+
+def buscar_assinatura(conn, hash_assinatura):
+    """(mimetype para servir, bytes) da assinatura ou None."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT mimetype, compressao, conteudo FROM assinaturas WHERE hash = %s",
+                       (hash_assinatura,))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    if row is None:
+        return None
+    mimetype, compressao, conteudo = row
+    conteudo = bytes(conteudo)
+    if compressao == 'zlib':
+        conteudo = zlib.decompress(conteudo)
+    if mimetype not in MIMETYPES_SEGUROS:
+        mimetype = 'application/octet-stream'
+    return mimetype, conteudo
+
+
+def migrar_assinaturas(conn, tabela):
+    """Move as assinaturas em base64 ainda gravadas em <tabela>.assinatura para a tabela assinaturas.
+
+    Confirma a cada lote; retorna quantas linhas foram migradas (0 depois da
+    primeira execução).
+    """
+    migradas = 0
+    cursor = conn.cursor()
+    try:
+        while True:
+            cursor.execute(f"""SELECT id, assinatura FROM {tabela}
+                               WHERE assinatura IS NOT NULL ORDER BY id LIMIT %s""",
+                           (TAMANHO_LOTE_MIGRACAO,))
+            linhas = cursor.fetchall()
+            if not linhas:
+                break
+            for id_, valor in linhas:
+                cursor.execute(f"""UPDATE {tabela} SET assinatura_hash = %s, assinatura = NULL,
+                                   atualizado_em = CURRENT_TIMESTAMP WHERE id = %s""",
+                               (salvar_assinatura(conn, valor), id_))
+            conn.commit()
+            migradas += len(linhas)
+    finally:
+        cursor.close()
+    return migradas
@@ -0,0 +1,1194 @@
+import io
+import gzip
+import os
+import re
+import json
+import zlib
+import uuid
+import queue
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, date, time as dtime, timedelta
+from decimal import Decimal
+from exportacao import abrir_cursor_streaming, ler_em_lotes
+
+# =============================================================================
+# BACKUP LÓGICO EM STREAMING (/api/system/backup)
+# =============================================================================
+#
+# Variáveis de ambiente:
+#   BACKUP_BATCH_SIZE        linhas lidas do banco por vez e máximo de linhas
+#                            por INSERT (padrão 500)
+#   BACKUP_MAX_INSERT_BYTES  fecha o INSERT antes deste tamanho, para não
+#                            estourar o max_allowed_packet do MySQL com as
+#                            assinaturas em base64 (padrão 1 MB)
+#   BACKUP_GZIP_LEVEL        nível do gzip (padrão 6)
+#
+# O dump roda numa transação de leitura com snapshot consistente
+# (REPEATABLE READ no Postgres, WITH CONSISTENT SNAPSHOT no MySQL), lê cada
+# tabela por cursor do lado do servidor e vai emitindo os dados, já
+# comprimidos, conforme os lotes chegam: blocos COPY ... FROM stdin no
+# Postgres, INSERTs de várias linhas no MySQL. Nada do banco inteiro fica em
+# memória.
+#
+# O arquivo só tem dados: a estrutura vem do create_tables(). Ele começa
+# esvaziando todas as tabelas e insere na ordem das chaves estrangeiras
+# (pais antes dos filhos), então pode ser aplicado sobre um banco já em uso.
+# No MySQL o esvaziamento é DELETE (TRUNCATE faria commit implícito e o
+# restore deixaria de ser uma transação só).
+
+TAMANHO_LOTE_BACKUP = int(os.getenv('BACKUP_BATCH_SIZE', 500))
+MAX_BYTES_INSERT = int(os.getenv('BACKUP_MAX_INSERT_BYTES', 1024 * 1024))
+NIVEL_GZIP_BACKUP = int(os.getenv('BACKUP_GZIP_LEVEL', 6))
+# Histórico dos próprios backups: restaurá-lo apontaria para backups que não valem mais
+TABELAS_FORA_DO_BACKUP = ('backup_historico',)
+
+
+def _postgres():
+    return os.getenv('DB_TYPE', 'mysql') == 'postgres'
+
+
+def listar_tabelas(conn):
+    """Tabelas de dados do banco (sem views como frota_emprestavel)."""
+    cursor = conn.cursor()
+    try:
+        if _postgres():
+            cursor.execute("""SELECT table_name FROM information_schema.tables
+                              WHERE table_schema = 'public' AND table_type = 'BASE TABLE'""")
+        else:
+            cursor.execute("""SELECT table_name FROM information_schema.tables
+                              WHERE table_schema = DATABASE() AND table_type = 'BASE TABLE'""")
+        return sorted(row[0] for row in cursor.fetchall() if row[0] not in TABELAS_FORA_DO_BACKUP)
+    finally:
+        cursor.close()
+
+
+def dependencias_tabelas(conn):
+    """{tabela: {tabelas que ela referencia por chave estrangeira}}."""
+    cursor = conn.cursor()
+    try:
+        if _postgres():
+            cursor.execute("""SELECT tc.table_name, ccu.table_name
+                              FROM information_schema.table_constraints tc
+                              JOIN information_schema.constraint_column_usage ccu
+                                ON ccu.constraint_name = tc.constraint_name
+                               AND ccu.constraint_schema = tc.constraint_schema
+                              WHERE tc.constraint_type = 'FOREIGN KEY' AND tc.table_schema = 'public'""")
+        else:
+            cursor.execute("""SELECT table_name, referenced_table_name
+                              FROM information_schema.key_column_usage
+                              WHERE table_schema = DATABASE() AND referenced_table_name IS NOT NULL""")
+        dependencias = {}
+        for tabela, referenciada in cursor.fetchall():
+            if tabela != referenciada:
+                dependencias.setdefault(tabela, set()).add(referenciada)
+        return dependencias
+    finally:
+        cursor.close()
+
+
+def niveis_dependencia(tabelas, dependencias):
+    """Agrupa as tabelas em níveis: cada nível só referencia tabelas dos níveis anteriores.
+
+    Tabelas do mesmo nível podem ser carregadas em paralelo. Ciclos (não
+    existem no schema atual) não travam: as tabelas restantes viram o último
+    nível.
+    """
+    pendentes = {t: {d for d in dependencias.get(t, ()) if d in tabelas} for t in tabelas}
+    niveis = []
+    while pendentes:
+        prontas = sorted(t for t, deps in pendentes.items() if not deps)
+        if not prontas:
+            prontas = sorted(pendentes)
+        for tabela in prontas:
+            del pendentes[tabela]
+        for deps in pendentes.values():
+            deps.difference_update(prontas)
+        niveis.append(prontas)
+    return niveis
+
+
+def ordenar_por_dependencia(tabelas, dependencias):
+    """Ordena as tabelas com os pais antes dos filhos (ordem alfabética dentro de cada nível)."""
+    return [tabela for nivel in niveis_dependencia(tabelas, dependencias) for tabela in nivel]
+
+
+def colunas_serial(conn, tabelas):
+    """Postgres: {tabela: coluna} das colunas com sequence (SERIAL), para o setval no fim do dump."""
+    if not _postgres():
+        return {}
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""SELECT table_name, column_name FROM information_schema.columns
+                          WHERE table_schema = 'public' AND column_default LIKE 'nextval(%'""")
+        return {tabela: coluna for tabela, coluna in cursor.fetchall() if tabela in tabelas}
+    finally:
+        cursor.close()
+
+
+def literal_sql(valor):
+    """Valor Python como literal SQL do banco configurado."""
+    if valor is None:
+        return 'NULL'
+    if isinstance(valor, bool):
+        return 'TRUE' if valor else 'FALSE'
+    if isinstance(valor, (int, float, Decimal)):
+        return str(valor)
+    if isinstance(valor, (datetime, date, dtime)):
+        return f"'{valor.isoformat()}'"
+    if isinstance(valor, timedelta):
+        # MySQL devolve colunas TIME como timedelta
+        total = int(valor.total_seconds())
+        sinal = '-' if total < 0 else ''
+        total = abs(total)
+        return f"'{sinal}{total // 3600:02d}:{total % 3600 // 60:02d}:{total % 60:02d}'"
+    if isinstance(valor, (bytes, bytearray, memoryview)):
+        hexa = bytes(valor).hex()
+        return f"'\\x{hexa}'::bytea" if _postgres() else f"X'{hexa}'"
+    texto = str(valor)
+    if _postgres():
+        # standard_conforming_strings (padrão desde o 9.1): só a aspa é especial
+        return "'" + texto.replace("'", "''") + "'"
+    # No MySQL a barra invertida também é escape
+    return "'" + texto.replace('\\', '\\\\').replace("'", "''").replace('\x00', '\\0') + "'"
+
+
+def iniciar_snapshot(conn, snapshot=None):
+    """Abre uma transação somente leitura com visão consistente de todas as tabelas.
+
+    snapshot: no Postgres, id de pg_export_snapshot() de outra conexão, para
+    que várias conexões enxerguem exatamente os mesmos dados.
+    """
+    # Encerra o que a requisição já tenha aberto (ex.: a leitura do load_user)
+    conn.rollback()
+    cursor = conn.cursor()
+    try:
+        if _postgres():
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            if snapshot:
+                cursor.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+        else:
+            cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY")
+    finally:
+        cursor.close()
+
+
+def gerar_inserts(tabela, colunas, linhas, sufixo=''):
+    """INSERTs de várias linhas, cada um com até BACKUP_BATCH_SIZE linhas e ~BACKUP_MAX_INSERT_BYTES.
+
+    sufixo vai depois dos VALUES (ex.: ON CONFLICT ... do backup incremental).
+    """
+    inicio = f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES\n"
+    valores = []
+    tamanho = 0
+    for row in linhas:
+        tupla = '(' + ', '.join(literal_sql(v) for v in row) + ')'
+        if valores and tamanho + len(tupla) > MAX_BYTES_INSERT:
+            yield inicio + ',\n'.join(valores) + sufixo + ';\n'
+            valores = []
+            tamanho = 0
+        valores.append(tupla)
+        tamanho += len(tupla)
+    if valores:
+        yield inicio + ',\n'.join(valores) + sufixo + ';\n'
+
+
+def valor_copy(valor):
+    """Valor no formato texto do COPY (\\N = NULL)."""
+    if valor is None:
+        return '\\N'
+    if isinstance(valor, bool):
+        return 't' if valor else 'f'
+    if isinstance(valor, (bytes, bytearray, memoryview)):
+        # bytea em hex; a barra do \x é escapada como qualquer outra
+        return '\\\\x' + bytes(valor).hex()
+    texto = valor.isoformat() if hasattr(valor, 'isoformat') else str(valor)
+    return (texto.replace('\\', '\\\\').replace('\t', '\\t')
+                 .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def gerar_copy(linhas):
+    """Linhas de dados de um bloco COPY (sem o cabeçalho e sem o terminador \\.)."""
+    return ''.join('\t'.join(valor_copy(v) for v in row) + '\n' for row in linhas)
+
+
+def dump_tabela(conn, tabela):
+    """Gera o SQL de dados de uma tabela, lote a lote, por cursor do lado do servidor."""
+    cursor = abrir_cursor_streaming(conn)
+    try:
+        cursor.execute(f"SELECT * FROM {tabela}")
+        colunas = None
+        for lote in ler_em_lotes(cursor, TAMANHO_LOTE_BACKUP):
+            if colunas is None:
+                # No cursor nomeado do Postgres a descrição só existe depois da 1ª busca
+                colunas = [d[0] for d in cursor.description]
+                if _postgres():
+                    yield f"COPY {tabela} ({', '.join(colunas)}) FROM stdin;\n"
+            if _postgres():
+                yield gerar_copy(lote)
+            else:
+                yield from gerar_inserts(tabela, colunas, lote)
+        if colunas is not None and _postgres():
+            yield "\\.\n"
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            # Download interrompido: o MySQL reclama das linhas não lidas
+            pass
+
+
+def gerar_dump(conn, cabecalho=None):
+    """Gera o backup completo em texto SQL, um pedaço por lote de cada tabela.
+
+    Ao terminar, registra o backup em backup_historico como base para o
+    próximo incremental (download interrompido não é registrado).
+    """
+    cabecalho = cabecalho or datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    backup_id = novo_id_backup(cabecalho)
+    # Lido antes do snapshot: nada que entre no backup é mais novo que a marca
+    marca_tempo = agora_banco(conn)
+    iniciar_snapshot(conn)
+    versoes = ler_versoes(conn)
+    tabelas = ordenar_por_dependencia(listar_tabelas(conn), dependencias_tabelas(conn))
+    seriais = colunas_serial(conn, tabelas)
+
+    yield "-- Backup Apple Academy Manager\n"
+    yield f"-- Data: {cabecalho}\n"
+    yield f"-- Banco: {os.getenv('DB_TYPE', 'mysql')}\n"
+    yield f"-- Backup-Id: {backup_id}\n\n"
+
+    if _postgres():
+        if tabelas:
+            yield f"TRUNCATE TABLE {', '.join(tabelas)} CASCADE;\n"
+    else:
+        yield "SET FOREIGN_KEY_CHECKS = 0;\n"
+        for tabela in tabelas:
+            yield f"DELETE FROM {tabela};\n"
+
+    try:
+        for tabela in tabelas:
+            yield f"\n-- Tabela: {tabela}\n"
+            yield from dump_tabela(conn, tabela)
+    finally:
+        conn.rollback()
+
+    if _postgres():
+        # Sem isso o próximo INSERT pela aplicação colide com os ids restaurados
+        for tabela, coluna in sorted(seriais.items()):
+            yield (f"SELECT setval(pg_get_serial_sequence('{tabela}', '{coluna}'), "
+                   f"COALESCE(MAX({coluna}), 1), MAX({coluna}) IS NOT NULL) FROM {tabela};\n")
+    else:
+        yield "SET FOREIGN_KEY_CHECKS = 1;\n"
+
+    registrar_backup(conn, backup_id, 'completo', None, marca_tempo, versoes)
+
+
+def comprimir_gzip(pedacos, nivel=None):
+    """Comprime um gerador de texto em gzip sem montar o arquivo inteiro."""
+    compressor = zlib.compressobj(nivel if nivel is not None else NIVEL_GZIP_BACKUP, zlib.DEFLATED, 31)
+    for pedaco in pedacos:
+        comprimido = compressor.compress(pedaco.encode('utf-8'))
+        if comprimido:
+            yield comprimido
+    yield compressor.flush()
+
+
+# =============================================================================
+# RESTAURAÇÃO EM STREAMING (/api/system/restore)
+# =============================================================================
+#
+# Variáveis de ambiente:
+#   RESTORE_BATCH_SIZE      linhas de um bloco COPY enviadas por vez (padrão 5000)
+#   RESTORE_BATCH_COMANDOS  comandos SQL enviados juntos num execute no
+#                           Postgres (padrão 100; no MySQL é um por vez)
+#
+# O arquivo é lido linha a linha (descomprimindo .gz no caminho) por
+# LeitorSQL, que separa os comandos no ';' respeitando aspas, identificadores,
+# comentários e dollar quotes, e entrega os blocos COPY ... FROM stdin com as
+# linhas de dados. Tudo roda numa transação só: qualquer erro desfaz a
+# restauração inteira e o banco fica como estava.
+#
+# No Postgres os índices secundários (os que não sustentam PK/UNIQUE) são
+# removidos antes da carga e recriados no fim, dentro da mesma transação, e
+# as tabelas passam por ANALYZE. No MySQL as checagens de chave estrangeira e
+# de unicidade ficam desligadas durante a carga; índices não são mexidos,
+# porque DDL no MySQL faz commit implícito.
+
+TAMANHO_LOTE_RESTORE = int(os.getenv('RESTORE_BATCH_SIZE', 5000))
+COMANDOS_POR_EXECUTE = int(os.getenv('RESTORE_BATCH_COMANDOS', 100))
+
+_INICIO_COPY = re.compile(r"^\s*COPY\s+.+\s+FROM\s+stdin\b", re.I | re.S)
+_ESPECIAIS = re.compile(r"""'|"|`|--|/\*|\$[A-Za-z_]?[A-Za-z0-9_]*\$|;""")
+
+
+class ErroRestauracao(Exception):
+    """Falha num comando do arquivo; traz a linha onde o comando começa."""
+
+    def __init__(self, linha, comando, erro):
+        super().__init__(f"Linha {linha}: {erro} (comando: {comando[:80]}...)")
+        self.linha = linha
+
+
+class LeitorSQL:
+    """Separa um arquivo SQL em comandos, lendo uma linha por vez.
+
+    Itera em tuplas (linha_inicial, comando, dados), onde dados é None para
+    comandos comuns e, para COPY ... FROM stdin, um gerador das linhas do
+    bloco (consumir antes de pedir o próximo comando; o que sobrar é
+    descartado). barra_escapa: a barra invertida escapa caracteres dentro de
+    strings (MySQL).
+    """
+
+    def __init__(self, linhas, barra_escapa=False):
+        self.linhas = iter(linhas)
+        self.numero_linha = 0
+        self._fim_string = re.compile(r"\\.|'", re.S) if barra_escapa else re.compile("'")
+
+    def _dados_copy(self):
+        for linha in self.linhas:
+            self.numero_linha += 1
+            if linha.rstrip('\r\n') == '\\.':
+                return
+            yield linha
+
+    def __iter__(self):
+        partes = []
+        fechamento = None  # None = fora de string/comentário
+        inicio = None
+        for linha in self.linhas:
+            self.numero_linha += 1
+            pos = 0
+            tamanho = len(linha)
+            while pos < tamanho:
+                if fechamento is None:
+                    m = _ESPECIAIS.search(linha, pos)
+                    if not m:
+                        partes.append(linha[pos:])
+                        break
+                    token = m.group()
+                    if token == '--':
+                        partes.append(linha[pos:m.start()] + '\n')
+                        break
+                    if token == ';':
+                        partes.append(linha[pos:m.start()])
+                        comando = ''.join(partes).strip()
+                        partes = []
+                        pos = m.end()
+                        if not comando:
+                            continue
+                        linha_comando, inicio = inicio or self.numero_linha, None
+                        if _INICIO_COPY.match(comando):
+                            # Os dados começam na próxima linha
+                            dados = self._dados_copy()
+                            yield linha_comando, comando, dados
+                            for _ in dados:
+                                pass
+                            break
+                        yield linha_comando, comando, None
+                        continue
+                    if inicio is None and (linha[pos:m.start()].strip() or token != '/*'):
+                        inicio = self.numero_linha
+                    if token == '/*':
+                        partes.append(linha[pos:m.start()] + ' ')
+                        fechamento = '*/'
+                    else:
+                        partes.append(linha[pos:m.end()])
+                        fechamento = token
+                    pos = m.end()
+                elif fechamento == "'":
+                    m = self._fim_string.search(linha, pos)
+                    if not m:
+                        partes.append(linha[pos:])
+                        break
+                    if m.group() == "'":
+                        fechamento = None
+                    partes.append(linha[pos:m.end()])
+                    pos = m.end()
+                else:
+                    fim = linha.find(fechamento, pos)
+                    if fim < 0:
+                        if fechamento != '*/':
+                            partes.append(linha[pos:])
+                        break
+                    if fechamento != '*/':
+                        partes.append(linha[pos:fim + len(fechamento)])
+                    pos = fim + len(fechamento)
+                    fechamento = None
+            if inicio is None and ''.join(partes).strip():
+                inicio = self.numero_linha
+        comando = ''.join(partes).strip()
+        if comando:
+            yield inicio or self.numero_linha, comando, None
+
+
+def abrir_arquivo_sql(origem, filename):
+    """Linhas de texto do arquivo (caminho ou stream do upload), descomprimindo .gz."""
+    bruto = open(origem, 'rb') if isinstance(origem, str) else origem
+    if filename.endswith('.gz'):
+        bruto = gzip.GzipFile(fileobj=bruto, mode='rb')
+    # newline='\n': só quebra em \n e não traduz \r\n dentro de strings
+    return io.TextIOWrapper(bruto, encoding='utf-8', newline='\n')
+
+
+def compatibilizar_postgres(comando):
+    """Ajustes mínimos para aplicar comandos de um mysqldump no Postgres."""
+    if '`' in comando:
+        comando = comando.replace('`', '"')
+    if 'ENGINE=' in comando:
+        comando = re.sub(r'ENGINE=\w+\s*', '', comando)
+        comando = re.sub(r'DEFAULT CHARSET=\w+\s*', '', comando)
+        comando = re.sub(r'COLLATE=\w+\s*', '', comando)
+    if 'int NOT NULL AUTO_INCREMENT' in comando:
+        comando = comando.replace('int NOT NULL AUTO_INCREMENT', 'SERIAL')
+    return comando
+
+
+def _criar_indice_se_nao_existe(definicao):
+    return definicao.replace(' INDEX ', ' INDEX IF NOT EXISTS ', 1)
+
+
+def indices_secundarios(conn):
+    """Postgres: [(nome, definição)] dos índices que não sustentam PK/UNIQUE/exclusão."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""SELECT ci.relname, pg_get_indexdef(ix.indexrelid)
+                          FROM pg_index ix
+                          JOIN pg_class ci ON ci.oid = ix.indexrelid
+                          JOIN pg_class ct ON ct.oid = ix.indrelid
+                          JOIN pg_namespace n ON n.oid = ct.relnamespace
+                          WHERE n.nspname = 'public' AND NOT ix.indisprimary
+                            AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = ix.indexrelid)
+                          ORDER BY ci.relname""")
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+class Restauracao:
+    """Aplica um arquivo de backup numa transação, em lotes, com progresso.
+
+    progresso(processadas) é chamado com o total de comandos + linhas de COPY
+    aplicados até o momento (mesmo callback dos jobs de importação).
+    recriar_indices=False deixa os índices do Postgres como estão (quem
+    chama remove e recria, como em restaurar_paralelo).
+    """
+
+    def __init__(self, conn, progresso=None, recriar_indices=True):
+        self.conn = conn
+        self.progresso = progresso
+        self.postgres = _postgres()
+        # False quando quem chama cuida dos índices (restauração paralela)
+        self.recriar_indices = recriar_indices
+        self.comandos = 0
+        self.linhas_copy = 0
+        self.ignorados = 0
+        self.indices_recriados = 0
+        self.indices_com_erro = []
+        self._pendentes = []
+        self._indices = []
+
+    def _avisar(self):
+        if self.progresso:
+            self.progresso(self.comandos + self.linhas_copy)
+
+    def _executar(self, cursor, linha, comando):
+        try:
+            cursor.execute(comando)
+        except Exception as e:
+            raise ErroRestauracao(linha, comando, e) from e
+
+    def _enviar_pendentes(self, cursor):
+        """Postgres: manda os comandos acumulados num único execute (uma ida ao servidor)."""
+        if not self._pendentes:
+            return
+        linha = self._pendentes[0][0]
+        self._executar(cursor, linha, ';\n'.join(c for _, c in self._pendentes))
+        self.comandos += len(self._pendentes)
+        self._pendentes = []
+        self._avisar()
+
+    def _copiar(self, cursor, linha, comando, dados):
+        if not self.postgres:
+            raise ErroRestauracao(linha, comando, 'blocos COPY só podem ser restaurados no Postgres')
+        lote = []
+        for registro in dados:
+            lote.append(registro)
+            if len(lote) >= TAMANHO_LOTE_RESTORE:
+                self._enviar_copy(cursor, linha, comando, lote)
+                lote = []
+        if lote:
+            self._enviar_copy(cursor, linha, comando, lote)
+        self.comandos += 1
+
+    def _enviar_copy(self, cursor, linha, comando, lote):
+        try:
+            cursor.copy_expert(comando, io.StringIO(''.join(lote)))
+        except Exception as e:
+            raise ErroRestauracao(linha, comando, e) from e
+        self.linhas_copy += len(lote)
+        self._avisar()
+
+    def _preparar(self, cursor):
+        if self.postgres:
+            if not self.recriar_indices:
+                return
+            self._indices = indices_secundarios(self.conn)
+            for nome, _ in self._indices:
+                cursor.execute(f"DROP INDEX {nome}")
+        else:
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+            cursor.execute("SET UNIQUE_CHECKS = 0")
+
+    def _finalizar(self, cursor):
+        if self.postgres:
+            if not self.recriar_indices:
+                return
+            for nome, definicao in self._indices:
+                # O arquivo pode ter recriado a tabela (ex.: dump com DROP/CREATE)
+                # e o índice já existir ou não caber mais: não derruba o restore
+                cursor.execute("SAVEPOINT restaurar_indice")
+                try:
+                    cursor.execute(_criar_indice_se_nao_existe(definicao))
+                    cursor.execute("RELEASE SAVEPOINT restaurar_indice")
+                    self.indices_recriados += 1
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT restaurar_indice")
+                    self.indices_com_erro.append(f"{nome}: {e}")
+            cursor.execute("ANALYZE")
+        else:
+            cursor.execute("SET UNIQUE_CHECKS = 1")
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+
+    def aplicar(self, linhas):
+        """Executa o arquivo; não faz commit nem rollback (fica com quem chamou)."""
+        cursor = self.conn.cursor()
+        try:
+            self._preparar(cursor)
+            for linha, comando, dados in LeitorSQL(linhas, barra_escapa=not self.postgres):
+                if dados is not None:
+                    self._enviar_pendentes(cursor)
+                    self._copiar(cursor, linha, comando, dados)
+                    continue
+                # Configurações de lock do mysqldump não se aplicam aqui
+                if comando.upper().startswith(('LOCK TABLES', 'UNLOCK TABLES')):
+                    self.ignorados += 1
+                    continue
+                if self.postgres:
+                    self._pendentes.append((linha, compatibilizar_postgres(comando)))
+                    if len(self._pendentes) >= COMANDOS_POR_EXECUTE:
+                        self._enviar_pendentes(cursor)
+                else:
+                    self._executar(cursor, linha, comando)
+                    self.comandos += 1
+                    if self.comandos % COMANDOS_POR_EXECUTE == 0:
+                        self._avisar()
+            self._enviar_pendentes(cursor)
+            self._finalizar(cursor)
+            self._avisar()
+        finally:
+            cursor.close()
+
+
+# =============================================================================
+# BACKUP E RESTAURAÇÃO PARALELOS, UM ARQUIVO POR TABELA
+# =============================================================================
+#
+# Variáveis de ambiente:
+#   BACKUP_WORKERS  conexões/threads usadas no dump e na restauração
+#                   paralelos (padrão 4; limitado ao número de tabelas)
+#
+# O backup é um diretório (ou um .tar com o mesmo conteúdo) com um
+# <tabela>.sql.gz por tabela, no mesmo formato do dump de arquivo único (COPY
+# no Postgres, INSERTs no MySQL), e um manifest.json com a ordem das chaves
+# estrangeiras e as colunas SERIAL. Cada tabela é lida por uma conexão
+# própria, e todas enxergam o mesmo instante do banco:
+#   - Postgres: uma conexão coordenadora abre a transação e exporta o
+#     snapshot (pg_export_snapshot); as demais importam com SET TRANSACTION
+#     SNAPSHOT. A coordenadora fica aberta até o fim para o snapshot valer.
+#   - MySQL: a coordenadora segura FLUSH TABLES WITH READ LOCK (ou, sem o
+#     privilégio RELOAD, LOCK TABLES ... READ em todas as tabelas) só enquanto
+#     as conexões abrem START TRANSACTION WITH CONSISTENT SNAPSHOT; como
+#     nenhuma escrita passa nesse intervalo, todas partem do mesmo ponto.
+#
+# A restauração lê o manifesto, esvazia as tabelas numa transação da
+# coordenadora e carrega as tabelas por nível de dependência (todas as
+# tabelas de um nível em paralelo, cada uma na sua conexão e transação, e o
+# nível seguinte só depois). No Postgres os índices secundários saem antes
+# e são recriados em paralelo no fim, seguidos de setval e ANALYZE.
+# Diferente do arquivo único, não é uma transação só: se uma tabela falhar,
+# as já carregadas ficam, os níveis seguintes não são carregados e o erro
+# volta no resultado. Para restauração atômica, usar o .sql.gz.
+
+WORKERS_BACKUP = int(os.getenv('BACKUP_WORKERS', 4))
+FORMATO_PARALELO = 'apple-academy-backup-paralelo'
+MANIFESTO = 'manifest.json'
+_ARQUIVO_TABELA = re.compile(r'^[A-Za-z0-9_]+\.sql\.gz$')
+
+
+def _nova_conexao(abrir_conexao):
+    conn = abrir_conexao()
+    if conn is None:
+        raise RuntimeError('Sem conexão disponível no pool para o backup paralelo')
+    return conn
+
+
+def _fechar(conn):
+    try:
+        conn.rollback()
+    except Exception:
+        pass
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _travar_mysql(conn, tabelas):
+    """MySQL: bloqueia escritas enquanto as conexões do dump (já abertas) iniciam o snapshot."""
+    cursor = conn.cursor()
+    try:
+        try:
+            cursor.execute("FLUSH TABLES WITH READ LOCK")
+        except Exception:
+            # Sem privilégio RELOAD: trava só as tabelas do dump
+            cursor.execute("LOCK TABLES " + ', '.join(f"{t} READ" for t in tabelas))
+    finally:
+        cursor.close()
+
+
+def _destravar_mysql(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UNLOCK TABLES")
+    finally:
+        cursor.close()
+
+
+def _abrir_snapshot_compartilhado(coordenadora, abrir_conexao, tabelas, quantidade):
+    """Abre `quantidade` conexões, todas lendo o mesmo snapshot do banco."""
+    conexoes = []
+    try:
+        if _postgres():
+            iniciar_snapshot(coordenadora)
+            cursor = coordenadora.cursor()
+            try:
+                cursor.execute("SELECT pg_export_snapshot()")
+                snapshot = cursor.fetchone()[0]
+            finally:
+                cursor.close()
+            for _ in range(quantidade):
+                conexoes.append(_nova_conexao(abrir_conexao))
+                iniciar_snapshot(conexoes[-1], snapshot)
+        else:
+            # Todas as conexões saem do pool antes da trava: se o pool estiver
+            # curto, a espera por DB_POOL_TIMEOUT não bloqueia as escritas
+            for _ in range(quantidade):
+                conexoes.append(_nova_conexao(abrir_conexao))
+            coordenadora.rollback()
+            _travar_mysql(coordenadora, tabelas)
+            try:
+                for conn in conexoes:
+                    iniciar_snapshot(conn)
+            finally:
+                _destravar_mysql(coordenadora)
+    except Exception:
+        for conn in conexoes:
+            _fechar(conn)
+        raise
+    return conexoes
+
+
+def gravar_tabela(conn, tabela, diretorio):
+    """Grava <tabela>.sql.gz no diretório; retorna o nome e o tamanho do arquivo."""
+    nome = f"{tabela}.sql.gz"
+    with open(os.path.join(diretorio, nome), 'wb') as arquivo:
+        for pedaco in comprimir_gzip(dump_tabela(conn, tabela)):
+            arquivo.write(pedaco)
+    return {'arquivo': nome, 'bytes': os.path.getsize(os.path.join(diretorio, nome))}
+
+
+def dump_paralelo(abrir_conexao, diretorio, workers=None, cabecalho=None):
+    """Backup de todas as tabelas em paralelo, um arquivo por tabela, no mesmo snapshot.
+
+    abrir_conexao() devolve uma conexão nova a cada chamada (close() a
+    libera). Retorna o manifesto, também gravado em manifest.json.
+    """
+    os.makedirs(diretorio, exist_ok=True)
+    coordenadora = _nova_conexao(abrir_conexao)
+    conexoes = []
+    try:
+        coordenadora.rollback()
+        dependencias = dependencias_tabelas(coordenadora)
+        tabelas = ordenar_por_dependencia(listar_tabelas(coordenadora), dependencias)
+        seriais = colunas_serial(coordenadora, tabelas)
+        quantidade = max(1, min(workers or WORKERS_BACKUP, len(tabelas)))
+        cabecalho = cabecalho or datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        backup_id = novo_id_backup(cabecalho)
+        marca_tempo = agora_banco(coordenadora)
+        conexoes = _abrir_snapshot_compartilhado(coordenadora, abrir_conexao, tabelas, quantidade)
+        # Qualquer conexão do snapshot serve: todas enxergam o mesmo instante
+        versoes = ler_versoes(conexoes[0])
+
+        livres = queue.Queue()
+        for conn in conexoes:
+            livres.put(conn)
+
+        def dump_uma(tabela):
+            conn = livres.get()
+            try:
+                return tabela, gravar_tabela(conn, tabela, diretorio)
+            finally:
+                livres.put(conn)
+
+        with ThreadPoolExecutor(max_workers=quantidade, thread_name_prefix='backup') as pool:
+            arquivos = dict(pool.map(dump_uma, tabelas))
+
+        coordenadora.rollback()
+        registrar_backup(coordenadora, backup_id, 'completo', None, marca_tempo, versoes)
+    finally:
+        for conn in conexoes:
+            _fechar(conn)
+        _fechar(coordenadora)
+
+    manifesto = {
+        'formato': FORMATO_PARALELO,
+        'versao': 1,
+        'id': backup_id,
+        'banco': os.getenv('DB_TYPE', 'mysql'),
+        'data': cabecalho,
+        'ordem': tabelas,
+        'dependencias': {t: sorted(d for d in dependencias.get(t, ()) if d in tabelas) for t in tabelas},
+        'seriais': seriais,
+        'arquivos': arquivos,
+    }
+    with open(os.path.join(diretorio, MANIFESTO), 'w', encoding='utf-8') as arquivo:
+        json.dump(manifesto, arquivo, ensure_ascii=False, indent=2)
+    return manifesto
+
+
+def empacotar_tar(diretorio, destino):
+    """Junta manifesto + arquivos das tabelas num .tar (sem compressão: cada tabela já é .gz)."""
+    with open(os.path.join(diretorio, MANIFESTO), encoding='utf-8') as arquivo:
+        manifesto = json.load(arquivo)
+    with tarfile.open(fileobj=destino, mode='w') as tar:
+        tar.add(os.path.join(diretorio, MANIFESTO), arcname=MANIFESTO)
+        for tabela in manifesto['ordem']:
+            nome = manifesto['arquivos'][tabela]['arquivo']
+            tar.add(os.path.join(diretorio, nome), arcname=nome)
+
+
+def extrair_tar(origem, diretorio):
+    """Extrai um backup paralelo (.tar) lendo em sequência; ignora qualquer outro nome de arquivo."""
+    with tarfile.open(fileobj=origem, mode='r|*') as tar:
+        for membro in tar:
+            if not membro.isfile():
+                continue
+            if membro.name != MANIFESTO and not _ARQUIVO_TABELA.match(membro.name):
+                continue
+            conteudo = tar.extractfile(membro)
+            with open(os.path.join(diretorio, membro.name), 'wb') as arquivo:
+                while True:
+                    pedaco = conteudo.read(1024 * 1024)
+                    if not pedaco:
+                        break
+                    arquivo.write(pedaco)
+
+
+def ler_manifesto(diretorio):
+    try:
+        with open(os.path.join(diretorio, MANIFESTO), encoding='utf-8') as arquivo:
+            manifesto = json.load(arquivo)
+    except FileNotFoundError:
+        raise ValueError('Backup paralelo sem manifest.json')
+    if manifesto.get('formato') != FORMATO_PARALELO:
+        raise ValueError('manifest.json não é de um backup paralelo')
+    banco = os.getenv('DB_TYPE', 'mysql')
+    if manifesto.get('banco') != banco:
+        raise ValueError(f"Backup gerado em {manifesto.get('banco')}, banco atual é {banco}")
+    for tabela in manifesto['ordem']:
+        if not _ARQUIVO_TABELA.match(manifesto['arquivos'][tabela]['arquivo']):
+            raise ValueError(f'Nome de arquivo inválido no manifesto: {tabela}')
+    return manifesto
+
+
+def restaurar_paralelo(abrir_conexao, diretorio, workers=None, progresso=None):
+    """Restaura um backup paralelo, carregando as tabelas por nível de chave estrangeira.
+
+    progresso(processadas) recebe a soma de comandos + linhas de todas as
+    tabelas, como em Restauracao. Retorna os totais e os erros por tabela.
+    """
+    manifesto = ler_manifesto(diretorio)
+    tabelas = manifesto['ordem']
+    niveis = niveis_dependencia(tabelas, {t: set(d) for t, d in manifesto['dependencias'].items()})
+    quantidade = max(1, min(workers or WORKERS_BACKUP, len(tabelas)))
+
+    lock = threading.Lock()
+    por_tabela = {}
+
+    def avisar(tabela, processadas):
+        if progresso:
+            with lock:
+                por_tabela[tabela] = processadas
+                progresso(sum(por_tabela.values()))
+
+    def carregar(tabela):
+        conn = _nova_conexao(abrir_conexao)
+        try:
+            restauracao = Restauracao(conn, lambda n: avisar(tabela, n), recriar_indices=False)
+            nome = manifesto['arquivos'][tabela]['arquivo']
+            linhas = abrir_arquivo_sql(os.path.join(diretorio, nome), nome)
+            try:
+                restauracao.aplicar(linhas)
+            finally:
+                linhas.close()
+            conn.commit()
+            return restauracao
+        finally:
+            _fechar(conn)
+
+    def recriar_indice(indice):
+        nome, definicao = indice
+        conn = _nova_conexao(abrir_conexao)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(_criar_indice_se_nao_existe(definicao))
+            cursor.close()
+            conn.commit()
+            return None
+        except Exception as e:
+            return f"{nome}: {e}"
+        finally:
+            _fechar(conn)
+
+    resultado = {'tabelas': 0, 'comandos': 0, 'linhas_copy': 0, 'ignorados': 0,
+                 'indices_recriados': 0, 'indices_com_erro': [], 'erros': {}}
+    coordenadora = _nova_conexao(abrir_conexao)
+    try:
+        coordenadora.rollback()
+        cursor = coordenadora.cursor()
+        indices = []
+        if _postgres():
+            indices = indices_secundarios(coordenadora)
+            for nome, _ in indices:
+                cursor.execute(f"DROP INDEX {nome}")
+            if tabelas:
+                cursor.execute(f"TRUNCATE TABLE {', '.join(tabelas)} CASCADE")
+        else:
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+            for tabela in tabelas:
+                cursor.execute(f"DELETE FROM {tabela}")
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+        coordenadora.commit()
+
+        with ThreadPoolExecutor(max_workers=quantidade, thread_name_prefix='restore') as pool:
+            for nivel in niveis:
+                futuros = {pool.submit(carregar, tabela): tabela for tabela in nivel}
+                for futuro in as_completed(futuros):
+                    tabela = futuros[futuro]
+                    try:
+                        restauracao = futuro.result()
+                    except Exception as e:
+                        resultado['erros'][tabela] = str(e)
+                        continue
+                    resultado['tabelas'] += 1
+                    resultado['comandos'] += restauracao.comandos
+                    resultado['linhas_copy'] += restauracao.linhas_copy
+                    resultado['ignorados'] += restauracao.ignorados
+                if resultado['erros']:
+                    # Os filhos dependem do que falhou: para aqui
+                    break
+
+            # Recria os índices mesmo com erro, para não deixar o banco sem eles
+            for erro in pool.map(recriar_indice, indices):
+                if erro:
+                    resultado['indices_com_erro'].append(erro)
+                else:
+                    resultado['indices_recriados'] += 1
+
+        if _postgres():
+            for tabela, coluna in sorted(manifesto.get('seriais', {}).items()):
+                cursor.execute(f"SELECT setval(pg_get_serial_sequence('{tabela}', '{coluna}'), "
+                               f"COALESCE(MAX({coluna}), 1), MAX({coluna}) IS NOT NULL) FROM {tabela}")
+            cursor.execute("ANALYZE")
+        coordenadora.commit()
+        cursor.close()
+    finally:
+        _fechar(coordenadora)
+    return resultado
+
+
+# =============================================================================
+# BACKUP INCREMENTAL (/api/system/backup?incremental=1)
+# =============================================================================
+#
+# Variáveis de ambiente:
+#   BACKUP_INCREMENTAL_MARGEM  segundos de sobreposição com o backup anterior
+#                              (padrão 300), para pegar transações que gravaram
+#                              atualizado_em antes da marca e confirmaram depois
+#
+# Todo backup (completo, paralelo ou incremental) grava em backup_historico a
+# hora do banco logo antes do snapshot (marca_tempo) e as versões de
+# tabela_versoes lidas no snapshot. O incremental parte do último registro e,
+# tabela a tabela:
+#   - versão igual à da base: nada mudou, fica de fora;
+#   - emprestimos, emprestimos_livros e eventos: só as linhas com
+#     atualizado_em >= marca da base - margem;
+#   - demais tabelas com versão alterada, ou sem versão (users,
+#     tipos_devices, reservas_livros, email_config; todas pequenas): inteiras.
+# Exclusões, inclusive as em cascata, aparecem como intervalos de id que não
+# existem mais: o arquivo traz os DELETEs desses intervalos dos filhos para
+# os pais e depois os INSERTs com upsert (ON CONFLICT / ON DUPLICATE KEY) dos
+# pais para os filhos. Reaplicar uma linha não muda nada, e é isso que
+# permite a margem.
+#
+# O incremental é SQL comum, aplicado pelo mesmo motor da restauração (uma
+# transação). restaurar_backup.py aplica o completo e a cadeia conferindo o
+# Backup-Id/Base de cada arquivo. Qualquer restauração apaga o histórico, e o
+# backup seguinte precisa ser completo.
+#
+# assinaturas (ver assinaturas.py) só recebe inserções e é endereçada pelo
+# hash: entram as criadas desde a marca, com ON CONFLICT DO NOTHING, e nada é
+# excluído. As outras tabelas sem coluna id (dashboard_counters,
+# tabela_versoes) ficam de fora: quem restaura recalcula os contadores e
+# incrementa as versões.
+
+TABELAS_POR_LINHA = ('emprestimos', 'emprestimos_livros', 'eventos')
+# {tabela: chave} das tabelas endereçadas por conteúdo (só inserção, por criado_em)
+TABELAS_POR_CONTEUDO = {'assinaturas': 'hash'}
+MARGEM_INCREMENTAL = int(os.getenv('BACKUP_INCREMENTAL_MARGEM', 300))
+CONDICOES_POR_DELETE = 500
+
+
+def novo_id_backup(cabecalho):
+    return f"{cabecalho}-{uuid.uuid4().hex[:8]}"
+
+
+def agora_banco(conn):
+    """Hora atual do banco, na mesma referência do atualizado_em das linhas."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT LOCALTIMESTAMP" if _postgres() else "SELECT CURRENT_TIMESTAMP")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def ler_versoes(conn):
+    """{tabela: 'versao@atualizado_em'} de tabela_versoes, como ficam no histórico."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT tabela, versao, atualizado_em FROM tabela_versoes")
+        return {tabela: f"{int(versao)}@{atualizado_em}" for tabela, versao, atualizado_em in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def registrar_backup(conn, backup_id, tipo, base_id, marca_tempo, versoes):
+    """Grava o backup em backup_historico e confirma (chamado depois do snapshot de leitura)."""
+    conn.rollback()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""INSERT INTO backup_historico (id, tipo, base_id, marca_tempo, versoes)
+                          VALUES (%s, %s, %s, %s, %s)""",
+                       (backup_id, tipo, base_id, marca_tempo, json.dumps(versoes, sort_keys=True)))
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def ultimo_backup(conn):
+    """Último backup registrado (base do próximo incremental) ou None."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""SELECT id, marca_tempo, versoes FROM backup_historico
+                          ORDER BY criado_em DESC, id DESC LIMIT 1""")
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    if row is None:
+        return None
+    return {'id': row[0], 'marca_tempo': row[1], 'versoes': json.loads(row[2] or '{}')}
+
+
+def limpar_historico_backup(conn):
+    """Depois de uma restauração nenhum backup anterior serve de base (sem commit)."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM backup_historico")
+    finally:
+        cursor.close()
+
+
+def colunas_por_tabela(conn, tabelas):
+    """{tabela: [colunas na ordem da tabela]}."""
+    cursor = conn.cursor()
+    try:
+        if _postgres():
+            cursor.execute("""SELECT table_name, column_name FROM information_schema.columns
+                              WHERE table_schema = 'public' ORDER BY table_name, ordinal_position""")
+        else:
+            cursor.execute("""SELECT table_name, column_name FROM information_schema.columns
+                              WHERE table_schema = DATABASE() ORDER BY table_name, ordinal_position""")
+        colunas = {}
+        for tabela, coluna in cursor.fetchall():
+            if tabela in tabelas:
+                colunas.setdefault(tabela, []).append(coluna)
+        return colunas
+    finally:
+        cursor.close()
+
+
+def _sufixo_upsert(colunas, chave='id', atualizar=True):
+    outras = [c for c in colunas if c != chave] if atualizar else []
+    if _postgres():
+        if not outras:
+            return f"\nON CONFLICT ({chave}) DO NOTHING"
+        return f"\nON CONFLICT ({chave}) DO UPDATE SET " + ', '.join(f"{c} = EXCLUDED.{c}" for c in outras)
+    return "\nON DUPLICATE KEY UPDATE " + ', '.join(f"{c} = VALUES({c})" for c in (outras or [chave]))
+
+
+def _ler_ids(conn, tabela):
+    cursor = abrir_cursor_streaming(conn)
+    try:
+        cursor.execute(f"SELECT id FROM {tabela} ORDER BY id")
+        for lote in ler_em_lotes(cursor, TAMANHO_LOTE_RESTORE):
+            for (id_,) in lote:
+                yield id_
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+
+def gerar_remocoes(tabela, ids):
+    """DELETEs dos intervalos de id que não existem mais (ids em ordem crescente)."""
+    condicoes = []
+    anterior = None
+    for id_ in ids:
+        if anterior is None:
+            condicoes.append(f"id < {id_}")
+        elif id_ > anterior + 1:
+            condicoes.append(f"id BETWEEN {anterior + 1} AND {id_ - 1}")
+        anterior = id_
+        if len(condicoes) >= CONDICOES_POR_DELETE:
+            yield f"DELETE FROM {tabela} WHERE {' OR '.join(condicoes)};\n"
+            condicoes = []
+    if anterior is None:
+        yield f"DELETE FROM {tabela};\n"
+        return
+    condicoes.append(f"id > {anterior}")
+    yield f"DELETE FROM {tabela} WHERE {' OR '.join(condicoes)};\n"
+
+
+def dump_upsert(conn, tabela, colunas, desde=None):
+    """INSERTs com upsert das linhas da tabela (só as alteradas/criadas desde `desde`, se informado)."""
+    chave = TABELAS_POR_CONTEUDO.get(tabela, 'id')
+    coluna_tempo = 'criado_em' if tabela in TABELAS_POR_CONTEUDO else 'atualizado_em'
+    cursor = abrir_cursor_streaming(conn)
+    try:
+        sql = f"SELECT {', '.join(colunas)} FROM {tabela}"
+        if desde is None:
+            cursor.execute(sql)
+        else:
+            cursor.execute(sql + f" WHERE {coluna_tempo} >= %s", (desde,))
+        # O conteúdo de um hash nunca muda: o que já existe fica como está
+        sufixo = _sufixo_upsert(colunas, chave, atualizar=tabela not in TABELAS_POR_CONTEUDO)
+        for lote in ler_em_lotes(cursor, TAMANHO_LOTE_BACKUP):
+            yield from gerar_inserts(tabela, colunas, lote, sufixo)
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+
+def gerar_incremental(conn, base, cabecalho=None):
+    """Gera o backup incremental em relação a base (ver ultimo_backup) em texto SQL."""
+    cabecalho = cabecalho or datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    backup_id = novo_id_backup(cabecalho)
+    marca_tempo = agora_banco(conn)
+    iniciar_snapshot(conn)
+    versoes = ler_versoes(conn)
+    tabelas = ordenar_por_dependencia(listar_tabelas(conn), dependencias_tabelas(conn))
+    colunas = colunas_por_tabela(conn, tabelas)
+    seriais = colunas_serial(conn, tabelas)
+    desde = base['marca_tempo'] - timedelta(seconds=MARGEM_INCREMENTAL)
+
+    incluidas = []
+    for tabela in tabelas:
+        if tabela in TABELAS_POR_CONTEUDO and 'criado_em' in colunas.get(tabela, ()):
+            incluidas.append((tabela, desde))
+            continue
+        if 'id' not in colunas.get(tabela, ()):
+            continue
+        versionada = tabela in versoes or tabela in base['versoes']
+        if versionada and versoes.get(tabela) == base['versoes'].get(tabela):
+            continue
+        por_linha = tabela in TABELAS_POR_LINHA and 'atualizado_em' in colunas[tabela]
+        incluidas.append((tabela, desde if por_linha else None))
+
+    yield "-- Backup incremental Apple Academy Manager\n"
+    yield f"-- Data: {cabecalho}\n"
+    yield f"-- Banco: {os.getenv('DB_TYPE', 'mysql')}\n"
+    yield f"-- Backup-Id: {backup_id}\n"
+    yield f"-- Base: {base['id']}\n"
+    descricao = ', '.join(f"{t} (alteradas desde {d})" if d else t for t, d in incluidas)
+    yield f"-- Tabelas: {descricao or 'nenhuma alteração'}\n\n"
+
+    try:
+        for tabela, _ in reversed(incluidas):
+            if tabela in TABELAS_POR_CONTEUDO:
+                continue
+            yield f"\n-- Exclusões: {tabela}\n"
+            yield from gerar_remocoes(tabela, _ler_ids(conn, tabela))
+        for tabela, desde_tabela in incluidas:
+            yield f"\n-- Tabela: {tabela}\n"
+            yield from dump_upsert(conn, tabela, colunas[tabela], desde_tabela)
+    finally:
+        conn.rollback()
+
+    if _postgres():
+        for tabela, _ in incluidas:
+            if tabela in seriais:
+                coluna = seriais[tabela]
+                yield (f"SELECT setval(pg_get_serial_sequence('{tabela}', '{coluna}'), "
+                       f"COALESCE(MAX({coluna}), 1), MAX({coluna}) IS NOT NULL) FROM {tabela};\n")
+
+    registrar_backup(conn, backup_id, 'incremental', base['id'], marca_tempo, versoes)
+
+
+def ler_cabecalho(linhas):
+    """{'Backup-Id': ..., 'Base': ...} dos comentários do início do arquivo."""
+    cabecalho = {}
+    for linha in linhas:
+        if not linha.startswith('--'):
+            if linha.strip():
+                break
+            continue
+        chave, separador, valor = linha[2:].partition(':')
+        if separador:
+            cabecalho[chave.strip()] = valor.strip()
+    return cabecalho
+
+
+def conferir_cadeia(cabecalhos):
+    """Confere que o 1º arquivo é completo e que cada incremental parte do anterior.
+
+    cabecalhos: [(nome_do_arquivo, cabecalho)] na ordem de aplicação.
+    Levanta ValueError descrevendo o primeiro elo quebrado.
+    """
+    anterior = None
+    for posicao, (nome, cabecalho) in enumerate(cabecalhos):
+        base = cabecalho.get('Base')
+        if posicao == 0 and base:
+            raise ValueError(f"{nome} é incremental; a cadeia começa por um backup completo")
+        if posicao > 0 and not base:
+            raise ValueError(f"{nome} não é um backup incremental")
+        if posicao > 0 and base != anterior:
+            raise ValueError(f"{nome} foi gerado a partir de {base}, mas o arquivo anterior é {anterior}")
+        anterior = cabecalho.get('Backup-Id')
+        if not anterior and posicao < len(cabecalhos) - 1:
+            raise ValueError(f"{nome} não tem Backup-Id (gerado antes dos backups incrementais)")
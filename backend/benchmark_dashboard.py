@@ -0,0 +1,119 @@
+"""
+Benchmark das estatísticas do /api/dashboard.
+
+Compara as ~20 consultas COUNT antigas com coletar_contadores_dashboard(),
+recalculando tudo por agregação condicional e lendo os contadores
+materializados em dashboard_counters. Mede idas ao banco e latência no
+banco configurado no .env (DB_TYPE, DB_HOST, ...).
+
+Uso: python benchmark_dashboard.py [iteracoes]
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+
+from app import coletar_contadores_dashboard
+from database import get_db_connection, get_db_cursor
+
+
+class CursorContador:
+    """Envolve o cursor e conta quantas consultas foram enviadas ao banco."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.consultas = 0
+
+    def execute(self, query, params=None):
+        self.consultas += 1
+        if params: return self._cursor.execute(query, params)
+        return self._cursor.execute(query)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def contadores_legado(cursor):
+    """As consultas que o /api/dashboard fazia antes, uma por contador."""
+    hoje = datetime.now().date()
+    tres_dias = hoje + timedelta(days=3)
+    tres_meses_atras = datetime.now() - timedelta(days=90)
+
+    consultas = [
+        ("SELECT COUNT(*) as total FROM alunos", None),
+        ("SELECT COUNT(*) as total FROM alunos WHERE tipo_aluno = 'Regular'", None),
+        ("SELECT COUNT(*) as total FROM alunos WHERE tipo_aluno = 'Foundation'", None),
+        ("SELECT COUNT(*) as total FROM alunos WHERE tipo_aluno = 'Foundation' AND data_inicio >= %s", (tres_meses_atras.date(),)),
+        ("SELECT COUNT(*) as total FROM alunos WHERE tipo_aluno = 'Foundation' AND EXTRACT(YEAR FROM data_inicio) = %s", (datetime.now().year,)),
+        ('''SELECT (SELECT COUNT(*) FROM devices WHERE para_emprestimo = TRUE) +
+                   (SELECT COUNT(*) FROM equipment_control ec
+                    LEFT JOIN devices d ON ec.numero_serie = d.numero_serie
+                    WHERE ec.status = 'Emprestado' AND ec.para_emprestimo = TRUE AND d.id IS NULL) as total''', None),
+        ('''SELECT (SELECT COUNT(*) FROM devices WHERE status = 'Emprestado') +
+                   (SELECT COUNT(*) FROM equipment_control ec
+                    LEFT JOIN devices d ON ec.numero_serie = d.numero_serie
+                    WHERE ec.status = 'Emprestado' AND ec.para_emprestimo = TRUE AND d.id IS NULL) as total''', None),
+        ("SELECT COUNT(*) as total FROM devices WHERE status = 'Disponível' AND para_emprestimo = TRUE", None),
+        ("SELECT COUNT(*) as total FROM devices WHERE tipo IN ('Macbook', 'Mac Mini') AND para_emprestimo = TRUE", None),
+        ("SELECT COUNT(*) as total FROM devices WHERE tipo IN ('iPad', 'iPhone') AND para_emprestimo = TRUE", None),
+        ("SELECT COUNT(*) as total FROM emprestimos WHERE status = 'Finalizado'", None),
+        ("SELECT COUNT(*) as total FROM emprestimos_livros WHERE status = 'Finalizado'", None),
+        ("SELECT COUNT(*) as total FROM livros", None),
+        ("SELECT COUNT(*) as total FROM exemplares", None),
+        ("SELECT COUNT(*) as total FROM emprestimos_livros WHERE status IN ('Ativo', 'Atrasado')", None),
+        ("SELECT COUNT(*) as total FROM emprestimos_livros WHERE status IN ('Ativo', 'Atrasado') AND data_previsao_devolucao < %s", (hoje,)),
+        ("SELECT COUNT(*) as total FROM emprestimos_livros WHERE status = 'Ativo' AND data_previsao_devolucao = %s", (hoje,)),
+        ("SELECT COUNT(*) as total FROM emprestimos_livros WHERE status = 'Ativo' AND data_previsao_devolucao > %s AND data_previsao_devolucao <= %s", (hoje, tres_dias)),
+        ("SELECT COUNT(*) as total FROM emprestimos WHERE status = 'Ativo' AND data_devolucao < %s", (hoje,)),
+        ("SELECT COUNT(*) as total FROM emprestimos WHERE status = 'Ativo' AND data_devolucao = %s", (hoje,)),
+        ("SELECT COUNT(*) as total FROM emprestimos WHERE status = 'Ativo' AND data_devolucao > %s AND data_devolucao <= %s", (hoje, tres_dias)),
+    ]
+    for query, params in consultas:
+        cursor.execute(query, params)
+        cursor.fetchone()
+
+
+def medir(nome, funcao, conn, iteracoes):
+    tempos = []
+    consultas = 0
+    for _ in range(iteracoes):
+        cursor = CursorContador(get_db_cursor(conn))
+        inicio = time.perf_counter()
+        funcao(cursor)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+        consultas = cursor.consultas
+        cursor.close()
+        conn.rollback()
+
+    tempos.sort()
+    media = sum(tempos) / len(tempos)
+    p95 = tempos[min(len(tempos) - 1, int(len(tempos) * 0.95))]
+    print(f"{nome:<25} | {consultas:>9} | {media:>10.2f} | {p95:>10.2f}")
+    return media
+
+
+def main():
+    iteracoes = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    conn = get_db_connection()
+    if not conn:
+        print("❌ Falha ao conectar ao banco")
+        return
+
+    try:
+        print(f"📊 Benchmark do dashboard ({iteracoes} iterações)")
+        print(f"{'Estratégia':<25} | {'Consultas':>9} | {'Média (ms)':>10} | {'p95 (ms)':>10}")
+        print("-" * 65)
+        legado = medir("COUNTs separados", contadores_legado, conn, iteracoes)
+        agregado = medir("Agregação condicional",
+                         lambda cursor: coletar_contadores_dashboard(cursor, materializados=False),
+                         conn, iteracoes)
+        materializado = medir("Contadores materializados", coletar_contadores_dashboard, conn, iteracoes)
+        print("-" * 65)
+        if agregado and materializado:
+            print(f"Ganho: {legado / agregado:.1f}x (agregação) / {legado / materializado:.1f}x (materializado)")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
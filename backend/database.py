@@ -1,8 +1,14 @@
 import os
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from flask import g, has_request_context
 from werkzeug.security import generate_password_hash
+from assinaturas import migrar_assinaturas
 try:
     import psycopg2
+    import psycopg2.pool
     from psycopg2 import Error as PgError
     from psycopg2.extras import RealDictCursor
 except ImportError:
@@ -11,6 +17,7 @@ except ImportError:
     RealDictCursor = None
 try:
     import mysql.connector
+    import mysql.connector.pooling
     from mysql.connector import Error
     from mysql.connector.errors import IntegrityError
 except ImportError:
@@ -24,35 +31,36 @@ load_dotenv()
 if os.getenv('DB_TYPE') == 'postgres':
     from psycopg2.errors import IntegrityError
 
-def get_db_connection():
-    """
-    Estabelece conexão com o banco de dados (MySQL ou Postgres)
-    """
-    db_type = os.getenv('DB_TYPE', 'mysql')
-    
+def _connection_params(db_type):
+    """Parâmetros de conexão lidos do .env para o banco configurado"""
+    if db_type == 'postgres':
+        return {
+            'host': os.getenv('DB_HOST', 'postgres'),
+            'user': os.getenv('DB_USER', 'postgres'),
+            'password': os.getenv('DB_PASSWORD', 'password'),
+            'dbname': os.getenv('DB_NAME', 'apple_academy'),
+            'port': os.getenv('DB_PORT', '5432')
+        }
+    return {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'user': os.getenv('DB_USER', 'apple_user'),
+        'password': os.getenv('DB_PASSWORD', ''),
+        'database': os.getenv('DB_NAME', 'apple_academy'),
+        'port': os.getenv('DB_PORT', '3306')
+    }
+
+def _connect_direct(db_type):
+    """Abre uma conexão nova, sem pool (comportamento original)"""
     if db_type == 'postgres':
         try:
             # Note: client_encoding needed sometimes? Usually utf8 default.
-            conn = psycopg2.connect(
-                host=os.getenv('DB_HOST', 'postgres'),
-                user=os.getenv('DB_USER', 'postgres'),
-                password=os.getenv('DB_PASSWORD', 'password'),
-                dbname=os.getenv('DB_NAME', 'apple_academy'),
-                port=os.getenv('DB_PORT', '5432')
-            )
-            return conn
+            return psycopg2.connect(**_connection_params(db_type))
         except PgError as e:
             print(f"❌ Erro ao conectar com Postgres: {e}")
             return None
     else:
         try:
-            conn = mysql.connector.connect(
-                host=os.getenv('DB_HOST', 'localhost'),
-                user=os.getenv('DB_USER', 'apple_user'),
-                password=os.getenv('DB_PASSWORD', ''),
-                database=os.getenv('DB_NAME', 'apple_academy'),
-                port=os.getenv('DB_PORT', '3306')
-            )
+            conn = mysql.connector.connect(**_connection_params(db_type))
             if conn.is_connected():
                 print("✅ Conexão com MySQL estabelecida com sucesso!")
             return conn
@@ -60,6 +68,305 @@ def get_db_connection():
             print(f"❌ Erro ao conectar com MySQL: {e}")
             return None
 
+# =============================================================================
+# POOL DE CONEXÕES
+# =============================================================================
+# Configuração via .env:
+#   DB_POOL_ENABLED    - 'true' (padrão) ou 'false' para abrir uma conexão por chamada
+#   DB_POOL_MIN        - conexões mantidas abertas no Postgres (padrão 1)
+#   DB_POOL_MAX        - máximo de conexões simultâneas por processo (padrão 10)
+#                        No MySQL o pool é criado já com DB_POOL_MAX conexões.
+#   DB_POOL_TIMEOUT    - segundos aguardando uma conexão livre (padrão 30)
+#   DB_POOL_PING_AFTER - segundos ociosa antes de validar a conexão no checkout (padrão 30, 0 = sempre)
+
+class PooledConnection:
+    """
+    Conexão emprestada do pool. Repassa tudo para a conexão real, mas close()
+    devolve a conexão ao pool em vez de encerrá-la, então as rotas existentes
+    (get_db_connection() ... conn.close()) funcionam sem alteração.
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._conn = raw
+
+    def close(self):
+        if self._conn is not None:
+            raw, self._conn = self._conn, None
+            self._pool.release(raw)
+
+    @property
+    def closed(self):
+        # Mantém compatibilidade com o atributo do psycopg2
+        if self._conn is None:
+            return True
+        return getattr(self._conn, 'closed', False)
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise AttributeError(f"Conexão já devolvida ao pool: {name}")
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __del__(self):
+        # Garante que uma conexão esquecida volte ao pool
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """Pool de conexões por processo (psycopg2 ThreadedConnectionPool ou pooling do mysql-connector)"""
+
+    def __init__(self, db_type):
+        self.db_type = db_type
+        self.min_size = max(int(os.getenv('DB_POOL_MIN', 1)), 0)
+        self.max_size = max(int(os.getenv('DB_POOL_MAX', 10)), 1, self.min_size)
+        if db_type != 'postgres':
+            self.max_size = min(self.max_size, mysql.connector.pooling.CNX_POOL_MAXSIZE)
+        self.timeout = float(os.getenv('DB_POOL_TIMEOUT', 30))
+        self.ping_after = float(os.getenv('DB_POOL_PING_AFTER', 30))
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._last_used = {}
+
+        params = _connection_params(db_type)
+        if db_type == 'postgres':
+            self._pool = psycopg2.pool.ThreadedConnectionPool(self.min_size, self.max_size, **params)
+        else:
+            self._pool = mysql.connector.pooling.MySQLConnectionPool(
+                pool_name=f"apple_academy_{os.getpid()}",
+                pool_size=self.max_size,
+                pool_reset_session=True,
+                **params
+            )
+        print(f"✅ Pool de conexões ({db_type}) criado: min={self.min_size}, max={self.max_size}")
+
+    def acquire(self):
+        """Retira uma conexão saudável do pool, aguardando até DB_POOL_TIMEOUT segundos"""
+        if not self._slots.acquire(timeout=self.timeout):
+            print(f"❌ Pool de conexões esgotado após {self.timeout}s")
+            return None
+        try:
+            # Uma tentativa extra caso a primeira conexão retirada esteja morta
+            for _ in range(2):
+                raw = self._checkout()
+                if raw is not None and self._is_healthy(raw):
+                    return PooledConnection(self, raw)
+                if raw is not None:
+                    self._discard(raw)
+        except (PgError, Error) as e:
+            print(f"❌ Erro ao obter conexão do pool: {e}")
+        self._slots.release()
+        return None
+
+    def release(self, raw):
+        """Devolve a conexão ao pool, descartando transações pendentes"""
+        try:
+            if self.db_type == 'postgres':
+                self._last_used[id(raw)] = time.monotonic()
+                # putconn faz rollback de transações abertas e fecha conexões quebradas
+                self._pool.putconn(raw)
+            else:
+                try:
+                    raw.rollback()
+                except Error:
+                    pass
+                # PooledMySQLConnection.close() reseta a sessão e devolve ao pool
+                raw.close()
+        except Exception as e:
+            print(f"Aviso: falha ao devolver conexão ao pool: {e}")
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        try:
+            if self.db_type == 'postgres':
+                self._pool.closeall()
+            else:
+                self._pool._remove_connections()
+        except Exception:
+            pass
+
+    def _checkout(self):
+        if self.db_type == 'postgres':
+            return self._pool.getconn()
+        # O pooling do mysql-connector já valida (ping) e reconecta no checkout
+        return self._pool.get_connection()
+
+    def _discard(self, raw):
+        if self.db_type == 'postgres':
+            self._last_used.pop(id(raw), None)
+            try:
+                self._pool.putconn(raw, close=True)
+            except Exception:
+                pass
+        else:
+            try:
+                raw.close()
+            except Exception:
+                pass
+
+    def _is_healthy(self, raw):
+        """Health check no checkout do Postgres: só faz round trip se a conexão ficou ociosa por muito tempo"""
+        if self.db_type != 'postgres':
+            return True
+        if raw.closed:
+            return False
+        last_used = self._last_used.get(id(raw))
+        if last_used is not None and time.monotonic() - last_used < self.ping_after:
+            return True
+        try:
+            cursor = raw.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            raw.rollback()
+            return True
+        except Exception as e:
+            print(f"Aviso: conexão do pool inválida, descartando: {e}")
+            return False
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def _pool_enabled():
+    return os.getenv('DB_POOL_ENABLED', 'true').lower() not in ('false', '0', 'no')
+
+def get_pool():
+    """Retorna o pool do processo atual, criando-o na primeira chamada (seguro após fork do gunicorn)"""
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            db_type = os.getenv('DB_TYPE', 'mysql')
+            try:
+                _pool = ConnectionPool(db_type)
+                _pool_pid = os.getpid()
+            except (PgError, Error) as e:
+                print(f"❌ Erro ao criar pool de conexões ({db_type}): {e}")
+                _pool = None
+        return _pool
+
+def close_pool():
+    """Fecha todas as conexões do pool do processo atual"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+        _pool_pid = None
+
+def _acquire_connection(db_type):
+    if not _pool_enabled():
+        return _connect_direct(db_type)
+
+    pool = get_pool()
+    if pool is None:
+        return None
+    return pool.acquire()
+
+# =============================================================================
+# CONEXÃO POR REQUISIÇÃO
+# =============================================================================
+
+class RequestConnection:
+    """
+    Conexão compartilhada por toda a requisição (load_user, rota e helpers).
+    close() não faz nada: a conexão é devolvida uma única vez no teardown.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def close(self):
+        pass
+
+    def release(self, rollback=False):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        try:
+            if rollback:
+                conn.rollback()
+        except Exception:
+            pass
+        finally:
+            conn.close()
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise AttributeError(f"Conexão da requisição já liberada: {name}")
+        return getattr(self._conn, name)
+
+def get_request_connection():
+    """Retorna (abrindo na primeira chamada) a conexão ligada ao flask.g da requisição atual"""
+    conn = g.get('_db_conn')
+    if conn is None:
+        raw = _acquire_connection(os.getenv('DB_TYPE', 'mysql'))
+        if raw is None:
+            return None
+        conn = RequestConnection(raw)
+        g._db_conn = conn
+    return conn
+
+def close_request_connection(exc=None):
+    """Teardown: devolve a conexão da requisição (rollback se houve exceção não tratada)"""
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        conn.release(rollback=exc is not None)
+
+def get_db_connection():
+    """
+    Estabelece conexão com o banco de dados (MySQL ou Postgres).
+    Dentro de uma requisição Flask retorna a conexão compartilhada da requisição;
+    fora dela (scripts, threads) retorna uma conexão do pool, devolvida em conn.close().
+    """
+    if has_request_context():
+        return get_request_connection()
+    return _acquire_connection(os.getenv('DB_TYPE', 'mysql'))
+
+def get_worker_connection():
+    """
+    Conexão própria do pool mesmo dentro de uma requisição, para trabalhos que
+    abrem várias conexões ao mesmo tempo (backup/restauração paralelos).
+    Devolvida ao pool em conn.close().
+    """
+    return _acquire_connection(os.getenv('DB_TYPE', 'mysql'))
+
+@contextmanager
+def db_connection():
+    """
+    Context manager para uso em rotas e scripts:
+
+        with db_connection() as conn:
+            cursor = get_db_cursor(conn)
+            ...
+
+    Faz rollback em caso de exceção e sempre devolve a conexão ao pool.
+    """
+    conn = get_db_connection()
+    try:
+        yield conn
+    except Exception:
+        if conn:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+        raise
+    finally:
+        if conn:
+            conn.close()
+
 def get_db_cursor(conn):
     """
     Returns a dictionary-like cursor for the given connection.
@@ -77,8 +384,85 @@ def init_app(app):
     Função para inicializar o banco de dados com a aplicação Flask
     """
     print("🚀 Inicializando banco de dados...")
+    app.teardown_appcontext(close_request_connection)
     create_tables()
 
+def criar_indice(cursor, nome, tabela, colunas, metodo=None):
+    """
+    CREATE INDEX idempotente (o MySQL não aceita IF NOT EXISTS em índices).
+    metodo: no Postgres vira USING <metodo> (ex.: gin); no MySQL é o tipo
+    do índice (ex.: FULLTEXT).
+    """
+    if os.getenv('DB_TYPE', 'mysql') == 'postgres':
+        using = f" USING {metodo}" if metodo else ""
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {nome} ON {tabela}{using} ({colunas})")
+        return
+
+    cursor.execute("""SELECT COUNT(*) FROM information_schema.statistics
+                      WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s""",
+                   (tabela, nome))
+    if cursor.fetchone()[0] == 0:
+        tipo = f"{metodo} " if metodo else ""
+        cursor.execute(f"CREATE {tipo}INDEX {nome} ON {tabela} ({colunas})")
+
+def adicionar_coluna(cursor, tabela, coluna, definicao):
+    """
+    ALTER TABLE ... ADD COLUMN idempotente, para colunas novas em tabelas que
+    já existem (o MySQL não aceita IF NOT EXISTS em colunas).
+    """
+    if os.getenv('DB_TYPE', 'mysql') == 'postgres':
+        cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN IF NOT EXISTS {coluna} {definicao}")
+        return
+
+    cursor.execute("""SELECT COUNT(*) FROM information_schema.columns
+                      WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s""",
+                   (tabela, coluna))
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {definicao}")
+
+# =============================================================================
+# VERSÃO DAS TABELAS (tabela_versoes)
+# =============================================================================
+#
+# Cada rota que grava numa tabela chama registrar_alteracao(conn, 'tabela')
+# antes do commit. O incremento entra na mesma transação, então a versão só
+# muda se a escrita for confirmada. Quem guarda algo derivado de uma tabela
+# (ex.: os arquivos de exportação em export_cache.py) compara as versões para
+# saber se ainda vale.
+
+def registrar_alteracao(conn, *tabelas):
+    """Incrementa a versão das tabelas alteradas dentro da transação atual (sem commit)."""
+    if not tabelas:
+        return
+    if os.getenv('DB_TYPE', 'mysql') == 'postgres':
+        sql = '''INSERT INTO tabela_versoes (tabela, versao, atualizado_em) VALUES (%s, 1, CURRENT_TIMESTAMP)
+                 ON CONFLICT (tabela) DO UPDATE SET versao = tabela_versoes.versao + 1,
+                                                    atualizado_em = CURRENT_TIMESTAMP'''
+    else:
+        sql = '''INSERT INTO tabela_versoes (tabela, versao, atualizado_em) VALUES (%s, 1, CURRENT_TIMESTAMP)
+                 ON DUPLICATE KEY UPDATE versao = versao + 1, atualizado_em = CURRENT_TIMESTAMP'''
+    cursor = conn.cursor()
+    try:
+        # Ordem fixa: duas transações travando as mesmas linhas não entram em deadlock
+        cursor.executemany(sql, [(t,) for t in sorted(set(tabelas))])
+    finally:
+        cursor.close()
+
+def ler_versoes_tabelas(conn, tabelas):
+    """Retorna {tabela: (versao, atualizado_em)}; tabela nunca alterada vem como (0, None)."""
+    tabelas = sorted(set(tabelas))
+    versoes = {t: (0, None) for t in tabelas}
+    cursor = conn.cursor()
+    try:
+        placeholders = ', '.join(['%s'] * len(tabelas))
+        cursor.execute(f"SELECT tabela, versao, atualizado_em FROM tabela_versoes WHERE tabela IN ({placeholders})",
+                       tabelas)
+        for tabela, versao, atualizado_em in cursor.fetchall():
+            versoes[tabela] = (int(versao), atualizado_em)
+    finally:
+        cursor.close()
+    return versoes
+
 def create_tables():
     """
     Cria todas as tabelas necessárias (MySQL ou Postgres)
@@ -270,6 +654,104 @@ def create_tables():
                           email_template_emprestimo TEXT,
                           atualizado_em {TIMESTAMP_TYPE} DEFAULT CURRENT_TIMESTAMP)""")
 
+        # Contadores materializados do dashboard ("grupo.nome" -> valor)
+        cursor.execute(f"""CREATE TABLE IF NOT EXISTS dashboard_counters
+                         (nome VARCHAR(100) PRIMARY KEY,
+                          valor INT NOT NULL DEFAULT 0,
+                          atualizado_em {TIMESTAMP_TYPE} DEFAULT CURRENT_TIMESTAMP)""")
+
+        # Versão de cada tabela: registrar_alteracao() incrementa na transação da escrita
+        cursor.execute(f"""CREATE TABLE IF NOT EXISTS tabela_versoes
+                         (tabela VARCHAR(100) PRIMARY KEY,
+                          versao BIGINT NOT NULL DEFAULT 0,
+                          atualizado_em {TIMESTAMP_TYPE} DEFAULT CURRENT_TIMESTAMP)""")
+
+        # Manifesto de cada backup gerado; o último é a base do próximo incremental
+        # (ver BACKUP INCREMENTAL em backup.py). Fica fora dos próprios backups.
+        cursor.execute(f"""CREATE TABLE IF NOT EXISTS backup_historico
+                         (id VARCHAR(64) PRIMARY KEY,
+                          tipo VARCHAR(20) NOT NULL,
+                          base_id VARCHAR(64),
+                          marca_tempo {TIMESTAMP_TYPE} NOT NULL,
+                          versoes TEXT,
+                          criado_em {TIMESTAMP_TYPE} DEFAULT CURRENT_TIMESTAMP)""")
+
+        # Última alteração de cada linha das tabelas que mais mudam, para o
+        # backup incremental. As rotas gravam atualizado_em = CURRENT_TIMESTAMP
+        # nos UPDATEs; no MySQL o ON UPDATE cobre também o que vier de fora delas
+        ATUALIZADO_EM = (f"{TIMESTAMP_TYPE} DEFAULT CURRENT_TIMESTAMP"
+                         + ("" if db_type == 'postgres' else " ON UPDATE CURRENT_TIMESTAMP"))
+        for tabela in ('emprestimos', 'emprestimos_livros', 'eventos'):
+            adicionar_coluna(cursor, tabela, 'atualizado_em', ATUALIZADO_EM)
+            criar_indice(cursor, f'idx_{tabela}_atualizado_em', tabela, 'atualizado_em')
+
+        # Assinaturas dos empréstimos, uma vez por conteúdo (ver assinaturas.py);
+        # os empréstimos guardam só o hash
+        BLOB_TYPE = "BYTEA" if db_type == 'postgres' else "LONGBLOB"
+        cursor.execute(f"""CREATE TABLE IF NOT EXISTS assinaturas
+                         (hash CHAR(64) PRIMARY KEY,
+                          mimetype VARCHAR(100) NOT NULL,
+                          compressao VARCHAR(10),
+                          tamanho INT NOT NULL,
+                          conteudo {BLOB_TYPE} NOT NULL,
+                          criado_em {TIMESTAMP_TYPE} DEFAULT CURRENT_TIMESTAMP)""")
+        criar_indice(cursor, 'idx_assinaturas_criado_em', 'assinaturas', 'criado_em')
+        for tabela in ('emprestimos', 'emprestimos_livros'):
+            adicionar_coluna(cursor, tabela, 'assinatura_hash', 'CHAR(64)')
+
+        # Frota emprestável: devices + equipment_control sem device correspondente.
+        # O device é a fonte da verdade de um numero_serie; o equipment só entra
+        # enquanto upsert_device_from_equipment ainda não criou o device.
+        cursor.execute("""CREATE OR REPLACE VIEW frota_emprestavel AS
+                         SELECT d.id, d.tipo, d.modelo, d.cor, d.polegadas, d.ano, d.nome,
+                                d.chip, d.memoria, d.numero_serie, d.versao_os, d.status,
+                                d.para_emprestimo, d.observacao, 'devices' AS origem
+                         FROM devices d
+                         UNION ALL
+                         SELECT -ec.id, COALESCE(ec.tipo_device, 'Outro'), ec.modelo, ec.cor, NULL, NULL,
+                                COALESCE(ec.local, ec.responsavel, CONCAT(ec.tipo_device, ' - ', ec.numero_serie)),
+                                ec.processador, ec.memoria, ec.numero_serie, NULL, ec.status,
+                                ec.para_emprestimo, ec.observacao, 'equipment_control' AS origem
+                         FROM equipment_control ec
+                         WHERE NOT EXISTS (SELECT 1 FROM devices d2 WHERE d2.numero_serie = ec.numero_serie)""")
+
+        # Índices usados pelos filtros da frota (status, para_emprestimo, tipo)
+        criar_indice(cursor, 'idx_devices_frota', 'devices', 'status, para_emprestimo, tipo')
+        criar_indice(cursor, 'idx_equipment_frota', 'equipment_control', 'status, para_emprestimo, tipo_device')
+
+        # Índices para os contadores do dashboard que dependem da data
+        criar_indice(cursor, 'idx_alunos_tipo_inicio', 'alunos', 'tipo_aluno, data_inicio')
+        criar_indice(cursor, 'idx_emprestimos_status_devolucao', 'emprestimos', 'status, data_devolucao')
+        criar_indice(cursor, 'idx_emprestimos_livros_status_previsao', 'emprestimos_livros', 'status, data_previsao_devolucao')
+
+        # Paginação por cursor de /api/alunos/pagina (ORDER BY nome, id)
+        criar_indice(cursor, 'idx_alunos_nome_id', 'alunos', 'nome, id')
+
+        # Busca de alunos (filtro_busca_alunos em app.py)
+        criar_indice(cursor, 'idx_alunos_tipo_nome_id', 'alunos', 'tipo_aluno, nome, id')
+        if db_type == 'postgres':
+            # Trigram para ILIKE '%termo%'; pg_trgm pode não estar disponível
+            # (ex.: sem permissão), então tenta sob SAVEPOINT e segue sem ele
+            try:
+                cursor.execute("SAVEPOINT pg_trgm")
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                criar_indice(cursor, 'idx_alunos_nome_trgm', 'alunos', 'nome gin_trgm_ops', metodo='gin')
+                criar_indice(cursor, 'idx_alunos_email_trgm', 'alunos', 'email gin_trgm_ops', metodo='gin')
+                cursor.execute("RELEASE SAVEPOINT pg_trgm")
+            except Exception as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT pg_trgm")
+                print(f"⚠️ pg_trgm indisponível, busca de alunos sem índice trigram: {e}")
+        else:
+            criar_indice(cursor, 'idx_alunos_busca_fulltext', 'alunos', 'nome, email', metodo='FULLTEXT')
+
+        # Assinaturas que ainda estão em base64 na linha do empréstimo
+        # (idempotente: depois da primeira vez não encontra nada)
+        for tabela in ('emprestimos', 'emprestimos_livros'):
+            migradas = migrar_assinaturas(conn, tabela)
+            if migradas:
+                registrar_alteracao(conn, tabela)
+                print(f"🖋️ {migradas} assinatura(s) de {tabela} movida(s) para a tabela assinaturas")
+
         # Criar usuário admin padrão
         try:
             admin_password = generate_password_hash(os.getenv('ADMIN_PASSWORD', 'admin123'))
@@ -0,0 +1,173 @@
+import os
+import time
+import hashlib
+import tempfile
+import threading
+
+# =============================================================================
+# CACHE DE ARQUIVOS DE EXPORTAÇÃO (/api/export/<entity>)
+# =============================================================================
+#
+# Variáveis de ambiente:
+#   EXPORT_CACHE_ENABLED  'true' (padrão) ou 'false'
+#   EXPORT_CACHE_DIR      onde ficam os arquivos (padrão: diretório temporário
+#                         do sistema; compartilhado pelos workers da máquina)
+#   EXPORT_CACHE_MAX_MB   tamanho máximo do diretório; acima disso os arquivos
+#                         usados há mais tempo são removidos (padrão 512)
+#   EXPORT_CACHE_TTL      segundos que um arquivo vale mesmo sem mudança de
+#                         versão, para cobrir escritas feitas fora das rotas
+#                         (scripts, SQL manual); padrão 86400
+#
+# A chave é entidade + formato + versão de cada tabela lida pela consulta
+# (tabela_versoes, ver registrar_alteracao em database.py). Enquanto nenhuma
+# dessas tabelas muda, o mesmo arquivo é servido; a primeira escrita troca a
+# chave e o arquivo antigo só sai pelo LRU. A chave também é o ETag, então um
+# navegador que já tem o arquivo recebe 304 sem nada ser gerado.
+#
+# As versões são lidas antes dos dados: se uma escrita acontecer no meio da
+# exportação, o arquivo fica com dados mais novos que a chave, e o pior caso é
+# regerar na próxima requisição (nunca servir dado velho com versão nova).
+#
+# Last-Modified é o momento em que o arquivo foi gerado (mtime).
+#
+# O "último uso" de cada arquivo é o atime, atualizado explicitamente a cada
+# acerto (não depende de o sistema de arquivos estar montado com atime).
+
+
+class ExportCache:
+    """Arquivos de exportação prontos em disco, com expiração por versão e LRU por tamanho."""
+
+    def __init__(self, app=None):
+        self.directory = None
+        self.max_bytes = 512 * 1024 * 1024
+        self.ttl = 86400
+        self._enabled = False
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._enabled = os.getenv('EXPORT_CACHE_ENABLED', 'true').lower() not in ('false', '0', 'no')
+        self.max_bytes = int(float(os.getenv('EXPORT_CACHE_MAX_MB', 512)) * 1024 * 1024)
+        self.ttl = int(os.getenv('EXPORT_CACHE_TTL', 86400))
+        self.directory = os.getenv('EXPORT_CACHE_DIR',
+                                   os.path.join(tempfile.gettempdir(), 'apple_academy_export_cache'))
+        if self._enabled:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self._enabled and self.max_bytes > 0
+
+    @staticmethod
+    def etag(entidade, formato, versoes):
+        """Chave/ETag a partir de {tabela: (versao, atualizado_em)}."""
+        # atualizado_em entra junto: se tabela_versoes for recriada, a contagem recomeça
+        partes = [entidade, formato] + [f"{t}={versao}@{atualizado_em}" for t, (versao, atualizado_em)
+                                        in sorted(versoes.items())]
+        return hashlib.sha256('|'.join(partes).encode('utf-8')).hexdigest()[:32]
+
+    def _path(self, chave, formato):
+        return os.path.join(self.directory, f"{chave}.{formato}")
+
+    def buscar(self, chave, formato):
+        """Arquivo pronto para a chave, já aberto para leitura, ou None.
+
+        Devolver o arquivo aberto evita corrida com o LRU de outro worker:
+        se ele remover o arquivo, o que já está aberto continua legível.
+        """
+        if not self.enabled:
+            return None
+        path = self._path(chave, formato)
+        try:
+            info = os.stat(path)
+            if time.time() - info.st_mtime > self.ttl:
+                os.unlink(path)
+                return None
+            # Marca o uso para o LRU; o mtime (momento da geração) é preservado
+            os.utime(path, (time.time(), info.st_mtime))
+            return open(path, 'rb')
+        except FileNotFoundError:
+            return None
+
+    def novo_arquivo(self):
+        """Arquivo temporário no diretório do cache; depois concluir() ou descartar()."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        return os.fdopen(fd, 'w+b'), tmp_path
+
+    def concluir(self, arquivo, tmp_path, chave, formato):
+        """Publica o arquivo temporário com o nome da chave (rename atômico) e aplica o LRU.
+
+        Retorna o arquivo publicado aberto para leitura (aberto antes do LRU rodar).
+        """
+        arquivo.close()
+        path = self._path(chave, formato)
+        os.replace(tmp_path, path)
+        publicado = open(path, 'rb')
+        self._evict()
+        return publicado
+
+    @staticmethod
+    def descartar(arquivo, tmp_path):
+        try:
+            arquivo.close()
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def gravar_streaming(self, pedacos, chave, formato):
+        """Repassa os pedaços de um gerador e grava uma cópia no cache.
+
+        O arquivo só é publicado se o gerador chegar ao fim; download
+        interrompido (GeneratorExit) ou erro descartam a cópia parcial.
+        """
+        arquivo, tmp_path = self.novo_arquivo()
+        try:
+            for pedaco in pedacos:
+                arquivo.write(pedaco)
+                yield pedaco
+        except BaseException:
+            self.descartar(arquivo, tmp_path)
+            raise
+        try:
+            self.concluir(arquivo, tmp_path, chave, formato).close()
+        except OSError:
+            self.descartar(arquivo, tmp_path)
+
+    def _evict(self):
+        """Remove os arquivos usados há mais tempo até o diretório caber em max_bytes."""
+        with self._lock:
+            arquivos = []
+            total = 0
+            agora = time.time()
+            for entry in os.scandir(self.directory):
+                try:
+                    info = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith('.tmp'):
+                    # Temporário de uma geração que morreu com o processo
+                    if agora - info.st_mtime > 3600:
+                        self._remover(entry.path)
+                    continue
+                arquivos.append((info.st_atime, info.st_size, entry.path))
+                total += info.st_size
+            arquivos.sort()
+            for _, tamanho, path in arquivos:
+                if total <= self.max_bytes:
+                    break
+                self._remover(path)
+                total -= tamanho
+
+    @staticmethod
+    def _remover(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        if not self.enabled:
+            return
+        for entry in os.scandir(self.directory):
+            self._remover(entry.path)
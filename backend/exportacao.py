@@ -0,0 +1,197 @@
+import os
+import io
+import csv
+import uuid
+import zlib
+import tempfile
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# =============================================================================
+# EXPORTAÇÃO EM STREAMING (/api/export/<entity>)
+# =============================================================================
+#
+# As linhas saem do banco em lotes de EXPORT_BATCH_SIZE por um cursor do lado
+# do servidor (cursor nomeado no Postgres, cursor não-bufferizado no MySQL),
+# então nem o driver nem o Python seguram a tabela inteira em memória.
+#
+# - CSV: cada lote vira um pedaço da resposta (Response com gerador).
+# - XLSX: openpyxl em modo write-only grava as linhas direto em arquivo
+#   temporário; o .xlsx (zip) só existe completo no final, então ele é
+#   montado em disco e enviado em pedaços a partir do arquivo.
+# - CSV.GZ: o mesmo CSV passando por um compressor gzip incremental.
+# - Parquet: cada lote vira um row group gravado por pyarrow em arquivo
+#   temporário (o rodapé do Parquet, como o índice do zip, vem por último).
+
+TAMANHO_LOTE_EXPORTACAO = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+NIVEL_GZIP_EXPORTACAO = int(os.getenv('EXPORT_GZIP_LEVEL', 6))
+
+MIMETYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv; charset=utf-8',
+    'csv.gz': 'application/gzip',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+# Formatos enviados direto do gerador; os demais são montados em arquivo temporário
+FORMATOS_STREAMING = ('csv', 'csv.gz')
+
+
+def abrir_cursor_streaming(conn):
+    """Cursor que busca as linhas do servidor aos poucos (tuplas, não dicts)."""
+    if os.getenv('DB_TYPE') == 'postgres':
+        # Cursor nomeado = cursor do lado do servidor (DECLARE ... CURSOR)
+        cursor = conn.cursor(name=f"exportacao_{uuid.uuid4().hex}")
+        cursor.itersize = TAMANHO_LOTE_EXPORTACAO
+        return cursor
+    # O cursor padrão do mysql-connector não é bufferizado: fetchmany lê do socket
+    return conn.cursor()
+
+
+def ler_em_lotes(cursor, tamanho_lote=None):
+    """Gera listas de até tamanho_lote linhas até o cursor acabar."""
+    tamanho_lote = tamanho_lote or TAMANHO_LOTE_EXPORTACAO
+    while True:
+        lote = cursor.fetchmany(tamanho_lote)
+        if not lote:
+            break
+        yield lote
+
+
+def consultar_em_lotes(conn, query, params=None, bool_columns=()):
+    """Executa a query e devolve (colunas, gerador de lotes já formatados).
+
+    As colunas listadas em bool_columns (comparação sem diferenciar
+    maiúsculas, pois o Postgres devolve os aliases em minúsculas) viram
+    'Sim'/'Não' lote a lote.
+    """
+    cursor = abrir_cursor_streaming(conn)
+    cursor.execute(query, params or ())
+    lotes = ler_em_lotes(cursor)
+
+    # No cursor nomeado do Postgres a descrição só existe depois da 1ª busca
+    primeiro = next(lotes, [])
+    colunas = [d[0] for d in cursor.description] if cursor.description else []
+
+    booleanas = {c.lower() for c in bool_columns}
+    indices_bool = [i for i, c in enumerate(colunas) if c.lower() in booleanas]
+
+    def formatar(lote):
+        if not indices_bool:
+            return lote
+        formatado = []
+        for row in lote:
+            row = list(row)
+            for i in indices_bool:
+                row[i] = 'Sim' if row[i] else 'Não'
+            formatado.append(row)
+        return formatado
+
+    def gerar():
+        try:
+            if primeiro:
+                yield formatar(primeiro)
+            for lote in lotes:
+                yield formatar(lote)
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                # Download interrompido: o MySQL reclama das linhas não lidas
+                pass
+
+    return colunas, gerar()
+
+
+def gerar_csv(colunas, lotes):
+    """Gera o CSV em pedaços (um por lote), com BOM para o Excel reconhecer UTF-8."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(colunas)
+    for lote in lotes:
+        writer.writerows(lote)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def gerar_xlsx(colunas, lotes, titulo='Dados', destino=None):
+    """Monta o .xlsx em modo write-only num arquivo temporário (ou em destino) e o devolve aberto no início."""
+    if Workbook is None:
+        raise RuntimeError('openpyxl não está instalado; use ?format=csv')
+    workbook = Workbook(write_only=True)
+    planilha = workbook.create_sheet(title=titulo)
+    planilha.append(colunas)
+    for lote in lotes:
+        for row in lote:
+            planilha.append(list(row))
+
+    arquivo = destino or tempfile.TemporaryFile()
+    workbook.save(arquivo)
+    arquivo.seek(0)
+    return arquivo
+
+
+def gerar_csv_gzip(colunas, lotes):
+    """Gera o CSV comprimido em gzip pedaço a pedaço, sem montar o arquivo inteiro."""
+    # wbits=31 -> cabeçalho e rodapé gzip (abre com gunzip / pandas.read_csv)
+    compressor = zlib.compressobj(NIVEL_GZIP_EXPORTACAO, zlib.DEFLATED, 31)
+    for pedaco in gerar_csv(colunas, lotes):
+        comprimido = compressor.compress(pedaco)
+        if comprimido:
+            yield comprimido
+    yield compressor.flush()
+
+
+def gerar_parquet(colunas, lotes, destino=None):
+    """Grava um row group por lote num arquivo Parquet temporário (ou em destino) e o devolve aberto no início.
+
+    O schema vem do primeiro lote; colunas que nele só têm NULL viram texto,
+    já que o tipo real não é conhecido e todos os row groups precisam do mesmo schema.
+    """
+    if pq is None:
+        raise RuntimeError('pyarrow não está instalado; use ?format=csv.gz')
+    arquivo = destino or tempfile.TemporaryFile()
+    writer = None
+    schema = None
+    como_texto = set()
+    try:
+        for lote in lotes:
+            valores = [list(coluna) for coluna in zip(*lote)]
+            if schema is None:
+                campos = []
+                for i, nome in enumerate(colunas):
+                    tipo = pa.array(valores[i]).type
+                    if pa.types.is_null(tipo):
+                        como_texto.add(i)
+                        tipo = pa.string()
+                    campos.append(pa.field(nome, tipo))
+                schema = pa.schema(campos)
+                writer = pq.ParquetWriter(arquivo, schema, compression='snappy')
+            for i in como_texto:
+                valores[i] = [None if v is None else str(v) for v in valores[i]]
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(valores[i], type=schema.field(i).type) for i in range(len(colunas))],
+                schema=schema
+            ))
+        if writer is None:
+            # Consulta vazia: arquivo válido só com as colunas
+            schema = pa.schema([pa.field(nome, pa.string()) for nome in colunas])
+            writer = pq.ParquetWriter(arquivo, schema)
+        writer.close()
+    except Exception:
+        arquivo.close()
+        raise
+    arquivo.seek(0)
+    return arquivo
@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import uuid
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# =============================================================================
+# JOBS DE IMPORTAÇÃO (processamento em segundo plano)
+# =============================================================================
+#
+# Variáveis de ambiente:
+#   IMPORT_WORKERS    threads que processam importações (padrão 2)
+#   IMPORT_JOBS_DIR   onde fica o estado dos jobs (padrão: diretório
+#                     temporário do sistema; não usar a pasta de uploads,
+#                     que é servida em /uploads)
+#   IMPORT_JOBS_TTL   segundos que um job finalizado continua consultável
+#                     (padrão 3600)
+#
+# O upload salva o arquivo e devolve o id do job na hora; o processamento
+# roda em um ThreadPoolExecutor do processo. O estado de cada job é um
+# arquivo JSON (escrita atômica, como no FileCacheBackend do
+# response_cache.py), então qualquer worker do gunicorn na mesma máquina
+# responde ao polling de /api/importar/jobs/<id>.
+#
+# O arquivo enviado fica no mesmo diretório (arquivo_entrada), nunca na pasta
+# de uploads: ela é servida sem login em /uploads, e um restore em segundo
+# plano passa por aqui com o dump inteiro do banco. O job apaga a entrada ao
+# terminar; se o worker morrer, _sweep apaga entradas com mais de
+# IMPORT_JOBS_TTL segundos.
+#
+# ao_finalizar (opcional) é chamado quando o processador termina, depois dos
+# commits dele: é onde o app invalida o cache de respostas, para que uma
+# leitura feita durante o job não fique em cache com os números antigos.
+
+STATUS_FINALIZADOS = ('concluido', 'erro')
+PREFIXO_ENTRADA = 'entrada_'
+
+
+class ImportJobManager:
+    """Fila de importações com progresso consultável por id."""
+
+    def __init__(self, app=None, ao_finalizar=None):
+        self.app = None
+        self.ao_finalizar = ao_finalizar
+        self.directory = None
+        self.ttl = 3600
+        self._executor = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.ttl = int(os.getenv('IMPORT_JOBS_TTL', 3600))
+        self.directory = os.getenv('IMPORT_JOBS_DIR',
+                                   os.path.join(tempfile.gettempdir(), 'apple_academy_import_jobs'))
+        os.makedirs(self.directory, exist_ok=True)
+        self._workers = int(os.getenv('IMPORT_WORKERS', 2))
+
+    @property
+    def executor(self):
+        # Criado sob demanda: threads abertas antes do fork do gunicorn não sobrevivem no worker
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers,
+                                                    thread_name_prefix='importacao')
+            return self._executor
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _write(self, job):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(job, f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, self._path(job['id']))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def get(self, job_id):
+        # O id vira nome de arquivo: aceitar só o formato gerado em submit()
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        try:
+            with open(self._path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def arquivo_entrada(self, filename):
+        """Caminho privado (0600, fora da pasta de uploads) para o arquivo do job."""
+        fd, caminho = tempfile.mkstemp(dir=self.directory, prefix=PREFIXO_ENTRADA, suffix=f"_{filename}")
+        os.close(fd)
+        return caminho
+
+    def submit(self, tipo, processador, filepath, filename, usuario_id=None):
+        """Registra o job e agenda processador(filepath, filename, progresso=...)."""
+        self._sweep()
+        job = {
+            'id': uuid.uuid4().hex,
+            'tipo': tipo,
+            'arquivo': filename,
+            'usuario_id': usuario_id,
+            'status': 'pendente',
+            'total_linhas': None,
+            'linhas_processadas': 0,
+            'linhas_por_segundo': None,
+            'mensagem': None,
+            'detalhes': None,
+            'criado_em': time.time(),
+            'iniciado_em': None,
+            'finalizado_em': None
+        }
+        self._write(job)
+        self.executor.submit(self._run, dict(job), processador, filepath, filename)
+        return job
+
+    def _run(self, job, processador, filepath, filename):
+        job.update(status='processando', iniciado_em=time.time())
+        self._write(job)
+        ultimo_registro = [0.0]
+
+        def progresso(processadas, total=None):
+            agora = time.time()
+            job['linhas_processadas'] = processadas
+            if total is not None:
+                job['total_linhas'] = total
+            decorrido = agora - job['iniciado_em']
+            job['linhas_por_segundo'] = round(processadas / decorrido, 1) if decorrido > 0 else None
+            # No máximo duas gravações por segundo durante o processamento
+            if agora - ultimo_registro[0] >= 0.5:
+                ultimo_registro[0] = agora
+                self._write(job)
+
+        try:
+            with self.app.app_context():
+                resultado = processador(filepath, filename, progresso=progresso)
+            detalhes = resultado.get('detalhes')
+            job.update(status='concluido' if resultado.get('success') else 'erro',
+                       mensagem=resultado.get('message'), detalhes=detalhes)
+            if detalhes:
+                job['total_linhas'] = detalhes.get('total_linhas', job['total_linhas'])
+                job['linhas_processadas'] = job['total_linhas']
+        except Exception as e:
+            self.app.logger.error(f"Erro no job de importação {job['id']}: {e}", exc_info=True)
+            job.update(status='erro', mensagem=f'Erro na importação: {str(e)}')
+        finally:
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            if self.ao_finalizar is not None:
+                try:
+                    self.ao_finalizar()
+                except Exception as e:
+                    self.app.logger.warning(f"Falha ao finalizar o job de importação {job['id']}: {e}")
+
+        job['finalizado_em'] = time.time()
+        decorrido = job['finalizado_em'] - job['iniciado_em']
+        if job['linhas_processadas'] and decorrido > 0:
+            job['linhas_por_segundo'] = round(job['linhas_processadas'] / decorrido, 1)
+        self._write(job)
+
+    def _sweep(self):
+        """Apaga o estado de jobs finalizados e entradas esquecidas há mais de IMPORT_JOBS_TTL segundos."""
+        limite = time.time() - self.ttl
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(PREFIXO_ENTRADA):
+                try:
+                    if entry.stat().st_mtime < limite:
+                        os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+                continue
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                if entry.stat().st_mtime >= limite:
+                    continue
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    status = json.load(f).get('status')
+                if status in STATUS_FINALIZADOS:
+                    os.unlink(entry.path)
+            except (FileNotFoundError, ValueError):
+                pass
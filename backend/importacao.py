@@ -0,0 +1,460 @@
+import io
+import os
+import pandas as pd
+try:
+    from openpyxl import load_workbook
+except ImportError:
+    load_workbook = None
+from database import IntegrityError
+try:
+    from psycopg2.extras import execute_values
+except ImportError:
+    execute_values = None
+
+# =============================================================================
+# PIPELINE DE IMPORTAÇÃO (normalização vetorizada + inserção em lotes)
+# =============================================================================
+#
+# As rotas /api/importar/* fazem o mapeamento de colunas e a normalização
+# sobre colunas inteiras do DataFrame e mandam só as linhas válidas para
+# importar_linhas() (COPY no Postgres, INSERT multi-linha em lotes no MySQL).
+# A planilha é lida em blocos de IMPORT_CHUNK_SIZE linhas (ler_em_blocos),
+# então a memória não cresce com o tamanho do arquivo. Cada linha carrega o número da linha da planilha
+# (index + 2, contando o cabeçalho) para os erros manterem o formato
+# "Linha N: ..." em detalhes.erros.
+
+TAMANHO_LOTE = int(os.getenv('IMPORT_BATCH_SIZE', 500))
+TAMANHO_BLOCO = int(os.getenv('IMPORT_CHUNK_SIZE', 5000))
+
+VALORES_VERDADEIROS = ['sim', 'yes', 'true', '1', 's', 'y']
+
+
+def _normalizar_colunas(colunas):
+    return [str(col).strip().lower() for col in colunas]
+
+
+def ler_em_blocos(origem, filename, tamanho_bloco=None):
+    """Lê um CSV/XLSX em DataFrames de até tamanho_bloco linhas.
+
+    origem pode ser um caminho ou um arquivo aberto (o stream do upload).
+    As colunas já vêm aparadas e em minúsculas, e o índice de cada bloco
+    continua o do anterior (índice 0 = linha 2 da planilha), então
+    numero_linha = índice + 2 vale em todos os blocos. Sempre gera ao menos
+    um bloco (vazio, só com as colunas, se não houver linhas).
+    """
+    tamanho_bloco = tamanho_bloco or TAMANHO_BLOCO
+
+    if filename.lower().endswith('.csv'):
+        # Tudo como texto: sem dtype o pandas deduz os tipos bloco a bloco, e o
+        # mesmo CPF/tombamento viraria '123' num bloco e '123.0' em outro (se a
+        # coluna tiver um vazio). A conversão fica com as funções coluna_*.
+        for bloco in pd.read_csv(origem, encoding='utf-8', chunksize=tamanho_bloco,
+                                 dtype=str, keep_default_na=False):
+            bloco.columns = _normalizar_colunas(bloco.columns)
+            yield bloco
+        return
+
+    if load_workbook is None:
+        raise RuntimeError('openpyxl não está instalado; importe o arquivo como CSV')
+
+    # read_only + iter_rows: as linhas são lidas do XML sob demanda
+    workbook = load_workbook(origem, read_only=True, data_only=True)
+    try:
+        linhas = workbook.active.iter_rows(values_only=True)
+        cabecalho = next(linhas, None) or ()
+        colunas = _normalizar_colunas(
+            c if c is not None else f'unnamed: {i}' for i, c in enumerate(cabecalho)
+        )
+        valores, indices = [], []
+        gerou = False
+        for posicao, linha in enumerate(linhas):
+            # Linhas totalmente vazias são puladas, mas contam na numeração
+            if all(v is None or (isinstance(v, str) and not v.strip()) for v in linha):
+                continue
+            linha = tuple(linha[:len(colunas)]) + (None,) * (len(colunas) - len(linha))
+            valores.append(linha)
+            indices.append(posicao)
+            if len(valores) >= tamanho_bloco:
+                yield pd.DataFrame(valores, columns=colunas, index=indices)
+                gerou = True
+                valores, indices = [], []
+        if valores or not gerou:
+            yield pd.DataFrame(valores, columns=colunas, index=indices)
+    finally:
+        workbook.close()
+
+
+def coluna_texto(df, coluna, padrao=None):
+    """Coluna como texto aparado; vazios/NaN viram `padrao`."""
+    if coluna is None or coluna not in df.columns:
+        return pd.Series([padrao] * len(df), index=df.index, dtype=object)
+    serie = df[coluna].astype(object)
+    texto = serie.where(serie.isna(), serie.astype(str).str.strip())
+    texto = texto.where(texto.notna() & (texto != '') & (texto.str.lower() != 'nan'), padrao)
+    return texto.astype(object)
+
+
+def coluna_booleana(df, coluna, padrao=False, verdadeiros=VALORES_VERDADEIROS):
+    """Converte sim/não, true/false, 1/0 etc. para bool em uma única passada.
+
+    Células vazias recebem o padrão, como em parse_boolean(None, padrao).
+    """
+    if coluna is None or coluna not in df.columns:
+        return pd.Series([padrao] * len(df), index=df.index, dtype=bool)
+    serie = df[coluna].astype(object)
+    texto = serie.astype(str).str.strip().str.lower()
+    resultado = texto.isin(verdadeiros)
+    # Células já booleanas ou numéricas (xlsx) valem por si
+    booleanas = serie.map(lambda v: isinstance(v, bool))
+    numericas = serie.map(lambda v: isinstance(v, (int, float)) and not isinstance(v, bool) and v == v)
+    resultado = resultado.where(~booleanas, serie.where(booleanas, False).astype(bool))
+    resultado = resultado.where(~numericas, serie.where(numericas, 0).astype(float) != 0)
+    vazias = serie.isna() | (texto == '')
+    return resultado.where(~vazias, padrao).astype(bool)
+
+
+def coluna_data(df, coluna, padrao=None):
+    """Converte datas (ISO ou dd/mm/aaaa) para date.
+
+    Retorna (serie_de_datas, mascara_invalidas). Células vazias recebem o
+    padrão; células preenchidas que não são datas ficam marcadas como
+    inválidas.
+    """
+    if coluna is None or coluna not in df.columns:
+        return pd.Series([padrao] * len(df), index=df.index, dtype=object), pd.Series(False, index=df.index)
+
+    bruto = df[coluna]
+    vazias = bruto.isna() | (bruto.astype(str).str.strip() == '')
+    texto = bruto.astype(str).str.strip()
+
+    datas = pd.to_datetime(texto, errors='coerce', format='ISO8601')
+    faltando = datas.isna() & ~vazias
+    if faltando.any():
+        datas = datas.fillna(pd.to_datetime(texto.where(faltando), errors='coerce', dayfirst=True, format='mixed'))
+
+    invalidas = datas.isna() & ~vazias
+    resultado = datas.dt.date.astype(object).where(datas.notna(), padrao)
+    return resultado, invalidas
+
+
+def validar_linhas(df, regras):
+    """Aplica regras [(mascara, mensagem)] e devolve (erros, rejeitadas).
+
+    Cada linha recebe só o erro da primeira regra que a rejeita.
+    """
+    numero_linha = pd.Series(df.index + 2, index=df.index)
+    erros = []
+    rejeitadas = pd.Series(False, index=df.index)
+    for mascara, mensagem in regras:
+        mascara = mascara & ~rejeitadas
+        erros.extend((n, f"Linha {n}: {mensagem}") for n in numero_linha[mascara])
+        rejeitadas |= mascara
+    return erros, rejeitadas
+
+
+def montar_linhas(df, colunas, valores, rejeitadas):
+    """[(numero_linha, tupla)] das linhas não rejeitadas, na ordem de `colunas`."""
+    numero_linha = pd.Series(df.index + 2, index=df.index)
+    validas = pd.DataFrame(valores, index=df.index)[~rejeitadas].astype(object)
+    validas = validas.where(validas.notna(), None)
+    return list(zip(numero_linha[~rejeitadas].tolist(),
+                    validas[list(colunas)].itertuples(index=False, name=None)))
+
+
+def acompanhar(progresso, total, ja_processadas=0):
+    """Adapta o callback de progresso do job (processadas, total) para importar_linhas.
+
+    ja_processadas conta as linhas rejeitadas na validação, que não vão ao banco.
+    """
+    if progresso is None:
+        return None
+    progresso(ja_processadas, total)
+    return lambda inseridas: progresso(ja_processadas + inseridas, total)
+
+
+def _sql_insert(tabela, colunas):
+    return f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join(['%s'] * len(colunas))})"
+
+
+def _executar_lote(cursor, tabela, colunas, valores):
+    if os.getenv('DB_TYPE') == 'postgres' and execute_values is not None:
+        # executemany do psycopg2 faz uma ida ao banco por linha
+        execute_values(cursor, f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES %s", valores, page_size=len(valores))
+    else:
+        # O mysql-connector reescreve executemany de INSERT em um INSERT multi-linha
+        cursor.executemany(_sql_insert(tabela, colunas), valores)
+
+
+def inserir_em_lotes(conn, tabela, colunas, linhas, tamanho_lote=None, progresso=None):
+    """Insere linhas em lotes dentro da transação atual (sem commit).
+
+    linhas: lista de (numero_linha, tupla_de_valores).
+    Retorna (sucessos, falhas), onde falhas é uma lista de
+    (numero_linha, exceção). progresso(linhas_processadas) é chamado ao fim
+    de cada lote. Cada lote roda sob SAVEPOINT; se o lote falhar
+    (ex.: chave duplicada), ele é refeito linha a linha para apontar quais
+    linhas deram erro sem descartar as demais. No Postgres isso também evita
+    que um erro aborte a transação inteira.
+    """
+    tamanho_lote = tamanho_lote or TAMANHO_LOTE
+    sucessos = 0
+    falhas = []
+    cursor = conn.cursor()
+    try:
+        for inicio in range(0, len(linhas), tamanho_lote):
+            lote = linhas[inicio:inicio + tamanho_lote]
+            cursor.execute("SAVEPOINT lote_importacao")
+            try:
+                _executar_lote(cursor, tabela, colunas, [valores for _, valores in lote])
+                cursor.execute("RELEASE SAVEPOINT lote_importacao")
+                sucessos += len(lote)
+                if progresso:
+                    progresso(inicio + len(lote))
+                continue
+            except Exception:
+                cursor.execute("ROLLBACK TO SAVEPOINT lote_importacao")
+
+            sql = _sql_insert(tabela, colunas)
+            for numero_linha, valores in lote:
+                cursor.execute("SAVEPOINT linha_importacao")
+                try:
+                    cursor.execute(sql, valores)
+                    cursor.execute("RELEASE SAVEPOINT linha_importacao")
+                    sucessos += 1
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT linha_importacao")
+                    falhas.append((numero_linha, e))
+            if progresso:
+                progresso(inicio + len(lote))
+    finally:
+        cursor.close()
+    return sucessos, falhas
+
+
+# -----------------------------------------------------------------------------
+# Caminho rápido do Postgres: COPY para tabela temporária + INSERT ... SELECT
+# -----------------------------------------------------------------------------
+
+class ChaveDuplicada(Exception):
+    """Linha rejeitada no merge do COPY por violar a chave única `coluna`."""
+
+    def __init__(self, coluna):
+        super().__init__(f"Valor duplicado para a chave única '{coluna}'")
+        self.coluna = coluna
+
+
+def _valor_copy(valor):
+    """Serializa um valor no formato texto do COPY (\\N = NULL)."""
+    if valor is None:
+        return '\\N'
+    if isinstance(valor, bool):
+        return 't' if valor else 'f'
+    texto = valor.isoformat() if hasattr(valor, 'isoformat') else str(valor)
+    return (texto.replace('\\', '\\\\').replace('\t', '\\t')
+                 .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _buffer_copy(linhas):
+    buffer = io.StringIO()
+    for numero_linha, valores in linhas:
+        buffer.write(str(numero_linha))
+        for valor in valores:
+            buffer.write('\t')
+            buffer.write(_valor_copy(valor))
+        buffer.write('\n')
+    buffer.seek(0)
+    return buffer
+
+
+def copiar_para_tabela(conn, tabela, colunas, linhas, chaves_unicas):
+    """Carrega as linhas via COPY e faz o merge com ON CONFLICT DO NOTHING.
+
+    Só no Postgres. As linhas vão para uma tabela temporária com as mesmas
+    colunas (e tipos) do destino mais o número da linha da planilha; o
+    INSERT ... SELECT na ordem da planilha descarta as que violam alguma
+    chave única. Depois do merge, cada linha rejeitada é comparada com o
+    destino para dizer qual chave (de chaves_unicas) colidiu.
+
+    Retorna (sucessos, falhas) no mesmo formato de inserir_em_lotes, com
+    ChaveDuplicada como exceção das linhas rejeitadas.
+    """
+    lista_colunas = ', '.join(colunas)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DROP TABLE IF EXISTS importacao_stage")
+        cursor.execute(f"""CREATE TEMP TABLE importacao_stage ON COMMIT DROP AS
+                           SELECT {lista_colunas} FROM {tabela} WITH NO DATA""")
+        cursor.execute("ALTER TABLE importacao_stage ADD COLUMN numero_linha INTEGER")
+        cursor.copy_expert(f"COPY importacao_stage (numero_linha, {lista_colunas}) FROM STDIN",
+                           _buffer_copy(linhas))
+
+        cursor.execute(f"""INSERT INTO {tabela} ({lista_colunas})
+                           SELECT {lista_colunas} FROM importacao_stage ORDER BY numero_linha
+                           ON CONFLICT DO NOTHING
+                           RETURNING {', '.join(chaves_unicas)}""")
+        inseridas = {tuple(r) for r in cursor.fetchall()}
+
+        # Uma linha foi inserida se a tupla de chaves voltou no RETURNING e
+        # é a primeira ocorrência dela na planilha
+        indices = [colunas.index(c) for c in chaves_unicas]
+        rejeitadas = []
+        for numero_linha, valores in linhas:
+            chave = tuple(valores[i] for i in indices)
+            if chave in inseridas:
+                inseridas.discard(chave)
+            else:
+                rejeitadas.append(numero_linha)
+
+        falhas = []
+        if rejeitadas:
+            existe = ', '.join(
+                f"EXISTS (SELECT 1 FROM {tabela} t WHERE t.{c} = s.{c})" for c in chaves_unicas
+            )
+            cursor.execute(f"""SELECT s.numero_linha, {existe}
+                               FROM importacao_stage s
+                               WHERE s.numero_linha = ANY(%s)
+                               ORDER BY s.numero_linha""", (rejeitadas,))
+            for row in cursor.fetchall():
+                colidiu = [c for c, flag in zip(chaves_unicas, row[1:]) if flag]
+                falhas.append((row[0], ChaveDuplicada(colidiu[0] if colidiu else chaves_unicas[0])))
+
+        cursor.execute("DROP TABLE importacao_stage")
+        return len(linhas) - len(falhas), falhas
+    finally:
+        cursor.close()
+
+
+def importar_linhas(conn, tabela, colunas, linhas, chaves_unicas=(), progresso=None):
+    """Ponto de entrada das rotas de importação.
+
+    Postgres: tenta o COPY (copiar_para_tabela) sob SAVEPOINT; se o COPY ou
+    o merge falhar por outro motivo (NOT NULL, tipo inválido, etc.), volta
+    para inserir_em_lotes, que aponta o erro linha a linha. MySQL: INSERT
+    multi-linha em lotes (inserir_em_lotes). Não faz commit.
+    """
+    if not linhas:
+        return 0, []
+
+    if os.getenv('DB_TYPE') == 'postgres' and chaves_unicas:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SAVEPOINT copy_importacao")
+            try:
+                resultado = copiar_para_tabela(conn, tabela, list(colunas), linhas, list(chaves_unicas))
+                cursor.execute("RELEASE SAVEPOINT copy_importacao")
+                if progresso:
+                    progresso(len(linhas))
+                return resultado
+            except Exception:
+                cursor.execute("ROLLBACK TO SAVEPOINT copy_importacao")
+        finally:
+            cursor.close()
+
+    return inserir_em_lotes(conn, tabela, colunas, linhas, progresso=progresso)
+
+
+def montar_erros(erros, falhas, linhas, mensagem_duplicada):
+    """Junta os erros de validação com as falhas do banco, em ordem de linha.
+
+    erros: [(numero_linha, mensagem)] já prontos; falhas: o retorno de
+    importar_linhas; mensagem_duplicada(valores, exc) monta o texto para
+    violações de chave única. Retorna a lista de strings de detalhes.erros.
+    """
+    valores_por_linha = dict(linhas)
+    for numero_linha, e in falhas:
+        if isinstance(e, (IntegrityError, ChaveDuplicada)):
+            mensagem = mensagem_duplicada(valores_por_linha[numero_linha], e)
+        else:
+            mensagem = str(e)
+        erros.append((numero_linha, f"Linha {numero_linha}: {mensagem}"))
+    return [mensagem for _, mensagem in sorted(erros, key=lambda item: item[0])]
+
+
+# -----------------------------------------------------------------------------
+# Checagem prévia de duplicadas (antes de qualquer escrita)
+# -----------------------------------------------------------------------------
+
+class IndiceChaves:
+    """Chaves únicas já existentes na tabela, carregadas uma vez por importação.
+
+    classificar() marca, de forma vetorizada, as linhas cuja chave já existe
+    no banco ou aparece antes no próprio arquivo (inclusive em blocos
+    anteriores), para que só linhas limpas cheguem ao INSERT/COPY. A
+    restrição UNIQUE do banco continua valendo como última barreira
+    (importações simultâneas, collation case-insensitive do MySQL).
+    """
+
+    def __init__(self, conn, tabela, chaves):
+        self.tabela = tabela
+        self.chaves = tuple(chaves)
+        self.existentes = {}
+        cursor = conn.cursor()
+        try:
+            for chave in self.chaves:
+                cursor.execute(f"SELECT {chave} FROM {tabela} WHERE {chave} IS NOT NULL")
+                self.existentes[chave] = {row[0] for row in cursor.fetchall()}
+        finally:
+            cursor.close()
+
+    def classificar(self, df, valores, rejeitadas):
+        """Retorna uma Series com a chave que colidiu em cada linha (None = livre).
+
+        Linhas já rejeitadas na validação não entram na comparação. As chaves
+        das linhas aceitas passam a contar como existentes para os próximos
+        blocos.
+        """
+        colisao = pd.Series(None, index=df.index, dtype=object)
+        for chave in self.chaves:
+            serie = valores[chave]
+            candidatas = ~rejeitadas & serie.notna() & colisao.isna()
+            ja_existe = serie.isin(self.existentes[chave])
+            repetida = serie.where(candidatas).duplicated(keep='first')
+            colisao = colisao.mask(candidatas & (ja_existe | repetida), chave)
+
+        aceitas = ~rejeitadas & colisao.isna()
+        for chave in self.chaves:
+            serie = valores[chave]
+            self.existentes[chave].update(serie[aceitas & serie.notna()].tolist())
+        return colisao
+
+
+def importar_bloco(conn, tabela, colunas, df, valores, regras, mensagem_duplicada,
+                   indice=None, progresso=None, ja_processadas=0, simular=False):
+    """Valida, separa duplicadas e grava um bloco da planilha.
+
+    valores: {coluna: Series} já normalizadas; regras: as de validar_linhas.
+    Retorna (sucessos, erros, inseridas), com erros já no formato
+    "Linha N: ..." e inseridas = [(numero_linha, valores)] gravadas.
+    Com simular=True (dry run) nada é escrito: as linhas limpas contam como
+    sucesso e o banco só é lido pelo IndiceChaves.
+    """
+    erros, rejeitadas = validar_linhas(df, regras)
+
+    duplicadas = []
+    if indice is not None:
+        colisao = indice.classificar(df, valores, rejeitadas)
+        colidiu = colisao.notna()
+        duplicadas = [
+            (numero_linha, valores_linha, ChaveDuplicada(chave))
+            for (numero_linha, valores_linha), chave
+            in zip(montar_linhas(df, colunas, valores, ~colidiu), colisao[colidiu])
+        ]
+        rejeitadas = rejeitadas | colidiu
+
+    linhas = montar_linhas(df, colunas, valores, rejeitadas)
+    if simular:
+        sucessos, falhas = len(linhas), []
+        if progresso:
+            progresso(ja_processadas + len(df))
+    else:
+        sucessos, falhas = importar_linhas(
+            conn, tabela, colunas, linhas, indice.chaves if indice is not None else (),
+            progresso=acompanhar(progresso, None, ja_processadas + len(erros) + len(duplicadas))
+        )
+
+    com_falha = {numero_linha for numero_linha, _ in falhas}
+    inseridas = [(numero_linha, v) for numero_linha, v in linhas if numero_linha not in com_falha]
+
+    falhas = falhas + [(numero_linha, e) for numero_linha, _, e in duplicadas]
+    linhas = linhas + [(numero_linha, v) for numero_linha, v, _ in duplicadas]
+    return sucessos, montar_erros(erros, falhas, linhas, mensagem_duplicada), inseridas
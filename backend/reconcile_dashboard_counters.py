@@ -0,0 +1,66 @@
+"""
+Reconstrói a tabela dashboard_counters a partir das tabelas de origem e
+mostra quais contadores estavam divergentes.
+
+Uso:
+    python reconcile_dashboard_counters.py           # corrige e reporta
+    python reconcile_dashboard_counters.py --check   # só reporta (exit 1 se houver divergência)
+"""
+import sys
+
+from app import calcular_contadores_dashboard, gravar_contadores_dashboard
+from database import get_db_connection
+
+
+def reconciliar(somente_verificar=False):
+    conn = get_db_connection()
+    if not conn:
+        print("❌ Falha ao conectar ao banco")
+        return None
+
+    try:
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT nome, valor FROM dashboard_counters")
+        gravados = {nome: int(valor) for nome, valor in cursor.fetchall()}
+        corretos = calcular_contadores_dashboard(cursor)
+
+        divergentes = {
+            nome: (gravados.get(nome), valor)
+            for nome, valor in corretos.items()
+            if gravados.get(nome) != valor
+        }
+
+        print("📊 Contadores do dashboard")
+        print(f"{'Contador':<36} | {'Gravado':>8} | {'Real':>8}")
+        print("-" * 58)
+        for nome, valor in sorted(corretos.items()):
+            gravado = gravados.get(nome)
+            marca = "  ⚠️" if nome in divergentes else ""
+            print(f"{nome:<36} | {'-' if gravado is None else gravado:>8} | {valor:>8}{marca}")
+        print("-" * 58)
+
+        if not divergentes:
+            print("✅ Nenhuma divergência encontrada")
+        elif somente_verificar:
+            print(f"⚠️ {len(divergentes)} contador(es) divergente(s)")
+        else:
+            gravar_contadores_dashboard(cursor, corretos)
+            conn.commit()
+            print(f"🔧 {len(divergentes)} contador(es) corrigido(s)")
+
+        cursor.close()
+        return divergentes
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Erro ao reconciliar contadores: {e}")
+        return None
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    somente_verificar = '--check' in sys.argv
+    divergentes = reconciliar(somente_verificar)
+    if divergentes is None or (somente_verificar and divergentes):
+        sys.exit(1)
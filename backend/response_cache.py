@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import request, g, has_request_context, make_response
+from flask_login import current_user
+
+# =============================================================================
+# CACHE DE RESPOSTAS (dashboard / resumos do admin)
+# =============================================================================
+#
+# Variáveis de ambiente:
+#   RESPONSE_CACHE_BACKEND  memory (padrão), file ou off
+#   RESPONSE_CACHE_TTL      segundos que uma resposta fica em cache (padrão 15)
+#   RESPONSE_CACHE_DIR      diretório do backend file (padrão /dev/shm quando
+#                           existe, senão o diretório temporário do sistema)
+#
+# O backend memory é por processo. O backend file é compartilhado entre os
+# workers do gunicorn; em /dev/shm ele fica em memória compartilhada.
+#
+# A chave inclui o papel do usuário (role), a rota e a query string. A
+# invalidação é por namespace: cada namespace tem uma "geração" que entra na
+# chave, então invalidar é só trocar a geração e as entradas antigas deixam de
+# ser encontradas (expiram sozinhas pelo TTL).
+
+class MemoryCacheBackend:
+    """Backend em memória do processo, com TTL e limite de entradas (LRU)."""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def generation(self, namespace):
+        with self._lock:
+            return self._generations.get(namespace, 0)
+
+    def bump(self, namespace):
+        with self._lock:
+            self._generations[namespace] = time.time_ns()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+
+class FileCacheBackend:
+    """Backend em arquivos, visível para todos os workers da mesma máquina.
+
+    Cada entrada é um arquivo <sha256 da chave>.cache cuja primeira linha é o
+    instante de expiração. A escrita é atômica (arquivo temporário + rename).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        self._last_sweep = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.cache')
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                expires_at = float(f.readline())
+                if expires_at < time.time():
+                    os.unlink(path)
+                    return None
+                return f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def set(self, key, value, ttl):
+        expires_at = time.time() + ttl
+        self._write(self._path(key), f"{expires_at}\n".encode('ascii') + value)
+        self._sweep(ttl)
+
+    def generation(self, namespace):
+        try:
+            with open(os.path.join(self.directory, f"{namespace}.gen"), 'r') as f:
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def bump(self, namespace):
+        self._write(os.path.join(self.directory, f"{namespace}.gen"), str(time.time_ns()).encode('ascii'))
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(('.cache', '.gen')):
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def _sweep(self, interval):
+        """Remove entradas expiradas, no máximo uma vez por intervalo de TTL."""
+        agora = time.time()
+        if agora - self._last_sweep < interval:
+            return
+        self._last_sweep = agora
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.cache'):
+                continue
+            try:
+                with open(entry.path, 'rb') as f:
+                    expires_at = float(f.readline())
+                if expires_at < agora:
+                    os.unlink(entry.path)
+            except (FileNotFoundError, ValueError):
+                pass
+
+
+def _default_cache_dir():
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'apple_academy_response_cache')
+
+
+class ResponseCache:
+    """Cache de respostas GET com chave por papel e invalidação por namespace."""
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.ttl = 15
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        tipo = os.getenv('RESPONSE_CACHE_BACKEND', 'memory').lower()
+        self.ttl = int(os.getenv('RESPONSE_CACHE_TTL', 15))
+
+        if tipo == 'off' or self.ttl <= 0:
+            self.backend = None
+        elif tipo == 'file':
+            self.backend = FileCacheBackend(os.getenv('RESPONSE_CACHE_DIR', _default_cache_dir()))
+        else:
+            self.backend = MemoryCacheBackend()
+
+        app.after_request(self._flush_pending)
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def _key(self, namespace):
+        role = getattr(current_user, 'role', None) or 'anonimo'
+        return f"{namespace}:{self.backend.generation(namespace)}:{role}:{request.full_path}"
+
+    def cached(self, namespace, ttl=None):
+        """Decorator para rotas GET cujo conteúdo depende só do papel do usuário.
+
+        Usar abaixo do @login_required. Só respostas 200 que não tenham
+        'success': False no JSON são guardadas.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or request.method != 'GET':
+                    return view(*args, **kwargs)
+
+                key = self._key(namespace)
+                try:
+                    hit = self.backend.get(key)
+                except Exception:
+                    hit = None
+                if hit is not None:
+                    response = self._load(hit)
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                response = make_response(view(*args, **kwargs))
+                if self._cacheable(response):
+                    try:
+                        self.backend.set(key, self._dump(response), ttl or self.ttl)
+                    except Exception:
+                        pass
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
+
+    def invalidates(self, *namespaces):
+        """Decorator para rotas que alteram dados: invalida ao final de requisições não-GET."""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method != 'GET':
+                    self.invalidate_after_request(*namespaces)
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def invalidate(self, *namespaces):
+        if not self.enabled:
+            return
+        for namespace in namespaces:
+            try:
+                self.backend.bump(namespace)
+            except Exception:
+                pass
+
+    def invalidate_after_request(self, *namespaces):
+        """Agenda a invalidação para depois da rota (ou seja, depois do commit).
+
+        Fora de uma requisição invalida na hora, antes do commit de quem
+        chamou: jobs em segundo plano precisam invalidar de novo depois de
+        confirmar a transação (ver ao_finalizar em import_jobs.py).
+        """
+        if not has_request_context():
+            self.invalidate(*namespaces)
+            return
+        pendentes = g.setdefault('_response_cache_pending', set())
+        pendentes.update(namespaces)
+
+    def clear(self):
+        if self.enabled:
+            self.backend.clear()
+
+    def _flush_pending(self, response):
+        pendentes = g.pop('_response_cache_pending', None)
+        if pendentes:
+            self.invalidate(*pendentes)
+        return response
+
+    @staticmethod
+    def _cacheable(response):
+        if response.status_code != 200 or response.direct_passthrough:
+            return False
+        if response.is_json:
+            data = response.get_json(silent=True)
+            if isinstance(data, dict) and data.get('success') is False:
+                return False
+        return True
+
+    @staticmethod
+    def _dump(response):
+        header = json.dumps({'status': response.status_code, 'mimetype': response.mimetype})
+        return header.encode('utf-8') + b'\n' + response.get_data()
+
+    @staticmethod
+    def _load(data):
+        header, body = data.split(b'\n', 1)
+        meta = json.loads(header)
+        response = make_response(body, meta['status'])
+        response.mimetype = meta['mimetype']
+        return response
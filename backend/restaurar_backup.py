@@ -0,0 +1,120 @@
+"""
+Restaura um backup completo seguido da cadeia de backups incrementais gerados
+depois dele, conferindo que cada incremental parte do arquivo anterior.
+
+Uso:
+    python restaurar_backup.py completo.sql.gz [incremental1.sql.gz ...]
+    python restaurar_backup.py completo.tar [incremental1.sql.gz ...]
+    python restaurar_backup.py --check completo.sql.gz incremental1.sql.gz   # só confere a cadeia
+
+Com um completo .sql/.sql.gz tudo roda numa transação só: qualquer erro
+desfaz a cadeia inteira. Com um completo .tar (backup paralelo) ele é
+carregado por restaurar_paralelo, que não é atômico, e os incrementais vêm
+depois numa transação.
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+from app import concluir_restauracao, export_cache
+from backup import (Restauracao, ErroRestauracao, abrir_arquivo_sql, ler_cabecalho, conferir_cadeia,
+                    extrair_tar, ler_manifesto, restaurar_paralelo)
+from database import get_db_connection, get_worker_connection
+
+
+def identificar(caminho, diretorio_tar):
+    """Cabeçalho do arquivo; o .tar é extraído em diretorio_tar e o id vem do manifesto."""
+    nome = os.path.basename(caminho)
+    if nome.endswith('.tar'):
+        with open(caminho, 'rb') as arquivo:
+            extrair_tar(arquivo, diretorio_tar)
+        return {'Backup-Id': ler_manifesto(diretorio_tar).get('id')}
+    linhas = abrir_arquivo_sql(caminho, nome)
+    try:
+        return ler_cabecalho(linhas)
+    finally:
+        linhas.close()
+
+
+def restaurar(arquivos, somente_conferir=False):
+    if any(a.endswith('.tar') for a in arquivos[1:]):
+        print("❌ Só o backup completo (primeiro arquivo) pode ser .tar")
+        return False
+
+    diretorio = tempfile.mkdtemp(prefix='restaurar_backup_')
+    try:
+        try:
+            cabecalhos = [(os.path.basename(a), identificar(a, diretorio)) for a in arquivos]
+            conferir_cadeia(cabecalhos)
+        except ValueError as e:
+            print(f"❌ Cadeia inválida: {e}")
+            return False
+
+        print("🔗 Cadeia de backups")
+        for nome, cabecalho in cabecalhos:
+            print(f"   {nome:<60} {cabecalho.get('Backup-Id', '-')}")
+        if somente_conferir:
+            print("✅ Cadeia válida")
+            return True
+
+        conn = get_db_connection()
+        if not conn:
+            print("❌ Falha ao conectar ao banco")
+            return False
+
+        try:
+            pendentes = arquivos
+            if arquivos[0].endswith('.tar'):
+                resultado = restaurar_paralelo(get_worker_connection, diretorio)
+                if resultado['erros']:
+                    concluir_restauracao(conn)
+                    conn.commit()
+                    for tabela, erro in resultado['erros'].items():
+                        print(f"❌ {tabela}: {erro}")
+                    print("⚠️ Backup completo carregado em parte; incrementais não aplicados")
+                    return False
+                print(f"✅ {cabecalhos[0][0]}: {resultado['tabelas']} tabela(s)")
+                pendentes = arquivos[1:]
+
+            for posicao, caminho in enumerate(pendentes):
+                nome = os.path.basename(caminho)
+                # Índices só são refeitos para o completo; os incrementais são pequenos
+                completo = posicao == 0 and pendentes is arquivos
+                restauracao = Restauracao(conn, recriar_indices=completo)
+                linhas = abrir_arquivo_sql(caminho, nome)
+                try:
+                    restauracao.aplicar(linhas)
+                except ErroRestauracao as e:
+                    conn.rollback()
+                    print(f"❌ {nome}: {e}")
+                    print("↩️ Transação desfeita" + ("" if pendentes is arquivos else
+                                                    " (o backup completo .tar continua carregado)"))
+                    return False
+                finally:
+                    linhas.close()
+                print(f"✅ {nome}: {restauracao.comandos} comando(s), "
+                      f"{restauracao.linhas_copy} linha(s) de COPY")
+
+            concluir_restauracao(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        export_cache.clear()
+        print("🎉 Restauração concluída. O próximo backup precisa ser completo.")
+        return True
+    finally:
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    somente_conferir = '--check' in sys.argv
+    arquivos = [a for a in sys.argv[1:] if a != '--check']
+    if not arquivos:
+        print(__doc__)
+        sys.exit(2)
+    if not restaurar(arquivos, somente_conferir):
+        sys.exit(1)
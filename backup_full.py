@@ -1,4 +1,5 @@
 import os
+import sys
 import datetime
 import subprocess
 import zipfile
@@ -12,6 +13,9 @@ DB_PASS = "Academy2024#@!"
 DB_NAME = "apple_academy"
 CONTAINER_NAME = "apple-academy-manager"
 IMAGE_NAME = "apple_academy_manager-apple-academy"
+# --parallel: one connection per table, same snapshot, one file per table
+PARALLEL = "--parallel" in sys.argv
+PARALLEL_WORKERS = int(os.getenv("BACKUP_WORKERS", 4))
 
 # Setup Timestamp and Directories
 TIMESTAMP = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
@@ -79,10 +83,36 @@ def simple_dump(host, user, password, database, output_file):
         if 'conn' in locals() and conn.is_connected():
             conn.close()
 
+def parallel_dump(host, user, password, database, output_dir, workers):
+    """Data-only dump using backend/backup.py (restore via /api/system/restore with the .tar)."""
+    try:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+        os.environ["DB_TYPE"] = "mysql"
+        from backup import dump_paralelo, empacotar_tar
+
+        def connect():
+            return mysql.connector.connect(
+                host=host, user=user, password=password, database=database
+            )
+
+        manifest = dump_paralelo(connect, output_dir, workers=workers, cabecalho=TIMESTAMP)
+        with open(f"{output_dir}.tar", "wb") as tar_file:
+            empacotar_tar(output_dir, tar_file)
+        shutil.rmtree(output_dir)
+        print(f"✅ {len(manifest['ordem'])} tables dumped with {workers} workers to: {output_dir}.tar")
+        return True
+    except Exception as e:
+        print(f"❌ Parallel DB Dump failed: {e}")
+        return False
+
 # 1. Database Dump
 print("\n[1/3] Dumping Database...")
-db_file = os.path.join(BACKUP_DIR, f"{DB_NAME}_dump.sql")
-simple_dump(DB_HOST, DB_USER, DB_PASS, DB_NAME, db_file)
+if PARALLEL:
+    parallel_dump(DB_HOST, DB_USER, DB_PASS, DB_NAME,
+                  os.path.join(BACKUP_DIR, f"{DB_NAME}_tables"), PARALLEL_WORKERS)
+else:
+    db_file = os.path.join(BACKUP_DIR, f"{DB_NAME}_dump.sql")
+    simple_dump(DB_HOST, DB_USER, DB_PASS, DB_NAME, db_file)
 
 # 2. Project Files Backup
 print("\n[2/3] Zipping Project Files...")
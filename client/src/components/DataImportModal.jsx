@@ -5,6 +5,7 @@ export default function DataImportModal({ isOpen, onClose, endpoint, onSuccess,
     const [file, setFile] = useState(null);
     const [loading, setLoading] = useState(false);
     const [status, setStatus] = useState(null); // { type: 'success' | 'error', message: '', details: {} }
+    const [progress, setProgress] = useState(null); // { processed, total, rate } enquanto o job roda
     const fileInputRef = useRef(null);
 
     if (!isOpen) return null;
@@ -17,7 +18,7 @@ export default function DataImportModal({ isOpen, onClose, endpoint, onSuccess,
         }
     };
 
-    const handleUpload = async () => {
+    const handleUpload = async (dryRun = false) => {
         if (!file) return;
 
         setLoading(true);
@@ -27,14 +28,27 @@ export default function DataImportModal({ isOpen, onClose, endpoint, onSuccess,
         formData.append('file', file);
 
         try {
-            const response = await fetch(endpoint, {
+            // Upload devolve o id do job na hora; o processamento é acompanhado por polling
+            const separator = endpoint.includes('?') ? '&' : '?';
+            // dry_run=1 só valida a planilha (nada é gravado)
+            const response = await fetch(`${endpoint}${separator}async=1${dryRun ? '&dry_run=1' : ''}`, {
                 method: 'POST',
                 body: formData,
             });
 
-            const data = await response.json();
+            let data = await response.json();
+
+            if (data.success && data.job_id) {
+                data = await pollJob(data.status_url || `/api/importar/jobs/${data.job_id}`);
+            }
 
-            if (data.success) {
+            if (data.success && dryRun) {
+                setStatus({
+                    type: data.detalhes && data.detalhes.erros && data.detalhes.erros.length > 0 ? 'error' : 'success',
+                    message: data.message,
+                    details: data.detalhes
+                });
+            } else if (data.success) {
                 setStatus({
                     type: 'success',
                     message: data.message,
@@ -58,12 +72,38 @@ export default function DataImportModal({ isOpen, onClose, endpoint, onSuccess,
             });
         } finally {
             setLoading(false);
+            setProgress(null);
+        }
+    };
+
+    const pollJob = async (statusUrl) => {
+        while (true) {
+            await new Promise((resolve) => setTimeout(resolve, 1000));
+            const response = await fetch(statusUrl);
+            const data = await response.json();
+            if (!data.success) return data;
+
+            const job = data.job;
+            setProgress({
+                processed: job.linhas_processadas,
+                total: job.total_linhas,
+                rate: job.linhas_por_segundo
+            });
+
+            if (job.status === 'concluido' || job.status === 'erro') {
+                return {
+                    success: job.status === 'concluido',
+                    message: job.mensagem,
+                    detalhes: job.detalhes
+                };
+            }
         }
     };
 
     const handleClose = () => {
         setFile(null);
         setStatus(null);
+        setProgress(null);
         setLoading(false);
         onClose();
     };
@@ -120,6 +160,24 @@ export default function DataImportModal({ isOpen, onClose, endpoint, onSuccess,
                         </div>
                     )}
 
+                    {loading && progress && (
+                        <div className="p-3 rounded-md text-sm bg-blue-50 text-blue-800 border border-blue-100">
+                            <p className="font-medium">
+                                Processando... {progress.processed || 0}
+                                {progress.total ? ` de ${progress.total}` : ''} linhas
+                                {progress.rate ? ` (${progress.rate} linhas/s)` : ''}
+                            </p>
+                            {progress.total > 0 && (
+                                <div className="w-full bg-blue-100 rounded-full h-2 mt-2">
+                                    <div
+                                        className="bg-blue-600 h-2 rounded-full transition-all"
+                                        style={{ width: `${Math.min(100, Math.round((progress.processed / progress.total) * 100))}%` }}
+                                    />
+                                </div>
+                            )}
+                        </div>
+                    )}
+
                     {status && (
                         <div className={`p-4 rounded-md text-sm flex items-start ${status.type === 'success' ? 'bg-green-50 text-green-800 border border-green-200' : 'bg-red-50 text-red-800 border border-red-200'
                             }`}>
@@ -130,6 +188,9 @@ export default function DataImportModal({ isOpen, onClose, endpoint, onSuccess,
                                     <ul className="mt-1 list-disc list-inside text-xs opacity-90">
                                         <li>Total processado: {status.details.total_linhas}</li>
                                         <li>Sucessos: {status.details.sucessos}</li>
+                                        {status.details.tempo_ms !== undefined && (
+                                            <li>Tempo de validação: {status.details.tempo_ms} ms</li>
+                                        )}
                                         {status.details.erros && status.details.erros.length > 0 && (
                                             <li className="mt-1">
                                                 Erros:
@@ -146,9 +207,17 @@ export default function DataImportModal({ isOpen, onClose, endpoint, onSuccess,
                         </div>
                     )}
 
-                    <div className="flex justify-end pt-4">
+                    <div className="flex justify-end pt-4 gap-2">
+                        <button
+                            onClick={() => handleUpload(true)}
+                            disabled={!file || loading}
+                            className="flex items-center px-4 py-2 text-gray-700 bg-gray-100 rounded-lg hover:bg-gray-200 transition-colors disabled:opacity-50 disabled:cursor-not-allowed font-medium"
+                        >
+                            <CheckCircle className="w-4 h-4 mr-2" />
+                            Validar
+                        </button>
                         <button
-                            onClick={handleUpload}
+                            onClick={() => handleUpload(false)}
                             disabled={!file || loading}
                             className="flex items-center px-4 py-2 text-white bg-green-600 rounded-lg hover:bg-green-700 transition-colors disabled:opacity-50 disabled:cursor-not-allowed font-medium shadow-sm"
                         >
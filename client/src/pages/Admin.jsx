@@ -645,7 +645,21 @@ Caso você não tenha feito esse empréstimo, contate imediatamente a equipe de
                                         className="flex items-center justify-center w-full px-8 py-6 bg-slate-900 text-white rounded-3xl hover:bg-black transition-all font-black text-xs uppercase tracking-[0.2em] shadow-2xl shadow-slate-200 group/btn"
                                     >
                                         <Download className="w-5 h-5 mr-3 group-hover/btn:translate-y-1 transition-transform" />
-                                        Consolidar Backup (.sql)
+                                        Consolidar Backup (.sql.gz)
+                                    </a>
+                                    <a
+                                        href="/api/system/backup?paralelo=1"
+                                        target="_blank"
+                                        className="block text-center mt-4 text-slate-400 hover:text-slate-900 font-black text-[10px] uppercase tracking-[0.2em] transition-colors"
+                                    >
+                                        Backup paralelo por tabela (.tar)
+                                    </a>
+                                    <a
+                                        href="/api/system/backup?incremental=1"
+                                        target="_blank"
+                                        className="block text-center mt-2 text-slate-400 hover:text-slate-900 font-black text-[10px] uppercase tracking-[0.2em] transition-colors"
+                                    >
+                                        Backup incremental desde o último (.sql.gz)
                                     </a>
                                 </div>
 
@@ -676,7 +690,7 @@ Caso você não tenha feito esse empréstimo, contate imediatamente a equipe de
                                         type="file"
                                         id="restorefs"
                                         className="hidden"
-                                        accept=".sql"
+                                        accept=".sql,.gz,.tar"
                                         onChange={async (e) => {
                                             const file = e.target.files[0];
                                             if (!file) return;
@@ -691,11 +705,26 @@ Caso você não tenha feito esse empréstimo, contate imediatamente a equipe de
 
                                             try {
                                                 alert("OPERACÃO INICIADA: Não feche esta janela...");
-                                                const res = await fetch('/api/system/restore', {
+                                                // Roda como job; o andamento é consultado como nas importações
+                                                const res = await fetch('/api/system/restore?async=1', {
                                                     method: 'POST',
                                                     body: formData
                                                 });
-                                                const data = await res.json();
+                                                let data = await res.json();
+                                                if (data.success && data.job_id) {
+                                                    const statusUrl = data.status_url || `/api/importar/jobs/${data.job_id}`;
+                                                    while (true) {
+                                                        await new Promise((resolve) => setTimeout(resolve, 1000));
+                                                        const statusRes = await fetch(statusUrl);
+                                                        const statusData = await statusRes.json();
+                                                        if (!statusData.success) { data = statusData; break; }
+                                                        const job = statusData.job;
+                                                        if (job.status === 'concluido' || job.status === 'erro') {
+                                                            data = { success: job.status === 'concluido', message: job.mensagem };
+                                                            break;
+                                                        }
+                                                    }
+                                                }
                                                 alert(data.message);
                                                 if (data.success) window.location.reload();
                                             } catch (err) {
@@ -9,6 +9,7 @@ export default function Alunos() {
     const [students, setStudents] = useState([]);
     const [loading, setLoading] = useState(true);
     const [searchTerm, setSearchTerm] = useState('');
+    const [debouncedSearch, setDebouncedSearch] = useState('');
 
     // Pagination states
     const [currentPage, setCurrentPage] = useState(1);
@@ -24,7 +25,9 @@ export default function Alunos() {
 
     const fetchStudents = (page = 1, limit = 10) => {
         setLoading(true);
-        fetch(`/api/alunos/pagina?page=${page}&limit=${limit}`)
+        const params = new URLSearchParams({ page, limit });
+        if (debouncedSearch) params.set('q', debouncedSearch);
+        fetch(`/api/alunos/pagina?${params}`)
             .then(res => res.json())
             .then(data => {
                 if (data.success) {
@@ -41,9 +44,18 @@ export default function Alunos() {
             });
     };
 
+    // Busca no servidor (nome, email ou CPF) com debounce para não consultar a cada tecla
+    useEffect(() => {
+        const timer = setTimeout(() => {
+            setDebouncedSearch(searchTerm.trim());
+            setCurrentPage(1);
+        }, 300);
+        return () => clearTimeout(timer);
+    }, [searchTerm]);
+
     useEffect(() => {
         fetchStudents(currentPage, itemsPerPage);
-    }, [currentPage, itemsPerPage]);
+    }, [currentPage, itemsPerPage, debouncedSearch]);
 
     const handleCreate = () => {
         setSelectedStudent(null);
@@ -118,10 +130,8 @@ export default function Alunos() {
         }
     };
 
-    const filteredStudents = students.filter(student =>
-        student.nome?.toLowerCase().includes(searchTerm.toLowerCase()) ||
-        student.email?.toLowerCase().includes(searchTerm.toLowerCase())
-    );
+    // A filtragem já vem do servidor (parâmetro q)
+    const filteredStudents = students;
 
     return (
         <div className="p-6 max-w-[1600px] mx-auto animate-in fade-in duration-700">